@@ -1,83 +1,57 @@
 # api/insights.py
-import os, json
-from typing import Optional
-from fastapi import FastAPI, Header, HTTPException
+import os, sys, json, time, queue, threading
+from typing import List, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from hubspot_client import (
-    search_cooby_comms, extract_message_text, create_note,
-    search_contact_calls, clean_call_summary_html, strip_html,
-    search_contact_notes, build_elephan_block
-)
-
-from insights_agent import (
-    generate_insights_from_transcript,
-    generate_insights_combined,
-    generate_insights_triple,   
-)
+# o pipeline (openai, requests, HubSpot) é importado dentro das rotas: o cold
+# start só paga FastAPI/pydantic, e requisição recusada no auth nem chega lá
+import job_queue
+import metrics
 
 
 API_TOKEN = os.getenv("AGENT_API_TOKEN")
+# workers em thread dentro da API só servem a servidor de processo longo
+# (uvicorn em VM/contêiner); na função serverless elas congelam depois da
+# resposta. Padrão 0: a API só enfileira e quem processa é
+# run_agent.py --jobs-worker (ver job_queue, "Implantação")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+WEBHOOK_PUBLIC_URL = os.getenv("WEBHOOK_PUBLIC_URL")  # URL cadastrada no app (atrás de proxy, a assinada)
 app = FastAPI(title="Lastro Cooby Insights Agent (Vercel)")
 
 class InsightsRequest(BaseModel):
     contactId: str
     createNote: bool = True
     sinceEpochMs: Optional[int] = None  # filtra itens antigos (ms desde epoch)
-
-def build_cooby_transcript(results, since_ms: Optional[int] = None) -> str:
-    msgs = []
-    for r in results:
-        p = r.get("properties") or {}
-        ts = p.get("hs_timestamp")
-        if since_ms and ts and int(ts) < since_ms:
-            continue
-        body = p.get("hs_communication_body", "")
-        msg = extract_message_text(body)
-        if msg:
-            msgs.append(f"[{ts}] {msg}")
-    msgs.sort()
-    return "\n".join(msgs)
-
-def build_calls_summary_block(call_results, since_ms: Optional[int] = None) -> str:
-    blocks = []
-    for r in call_results:
-        p = r.get("properties") or {}
-        ts = p.get("hs_timestamp")
-        if since_ms and ts and int(ts) < since_ms:
-            continue
-        raw_sum  = p.get("hs_call_summary") or p.get("call_summary") or ""
-        raw_body = p.get("hs_call_body") or ""
-        text = clean_call_summary_html(raw_sum) if raw_sum else strip_html(raw_body)
-        if text:
-            blocks.append(f"[{ts}]\n{text}")
-    blocks.sort()
-    return "\n\n".join(blocks)
-
-def render_note_html(title: str, insights: dict) -> str:
-    def li(items): return "".join(f"<li>{i}</li>" for i in (items or [])) or "<li>—</li>"
-    next_li = "".join(f"<li>{p.get('descricao','')}</li>" for p in (insights.get("proximos_passos") or [])) or "<li>—</li>"
-    pre  = insights.get("lead_scoring_pre", 0)
-    pos  = insights.get("lead_scoring_pos", 0)
-    lab  = insights.get("label_interacao", "-")
-    html = f"""
-    <h3>{title}</h3>
-    <ul>
-      <li><strong>Lead pré:</strong> {pre} &nbsp;|&nbsp; <strong>pós:</strong> {pos}</li>
-      <li><strong>Classificação:</strong> {lab}</li>
-    </ul>
-    <h4>Resumo</h4><ul>{li(insights.get('resumo_bullets'))}</ul>
-    <h4>Objeções</h4><ul>{li(insights.get('principais_objeções'))}</ul>
-    <h4>Sinais de fechamento</h4><ul>{li(insights.get('sinais_fechamento'))}</ul>
-    <h4>Próximos passos</h4><ul>{next_li}</ul>
-    <h4>Recomendações</h4><ul>{li(insights.get('recomendacoes'))}</ul>
-    <h4>Trechos relevantes</h4><ul>{li(insights.get('top_snippets'))}</ul>
-    """.split("\n")
-    return "\n".join(l.strip() for l in html if l.strip())
-
-@app.post("/api/insights")
-def insights(req: InsightsRequest, authorization: Optional[str] = Header(None)):
-    # auth igual está hoje...
+    parallel: bool = True  # buscas, LLM e notas em paralelo (thread pool)
+    useCache: bool = True  # false força nova chamada ao modelo
+    skipUnchangedNotes: bool = False  # não duplica nota se o insight não mudou
+    incremental: bool = False  # só o delta desde a última execução vai ao modelo
+    llmMode: Literal["per_source", "single_call"] = "per_source"  # single_call: uma chamada, todas as camadas
+    compact: bool = True  # dedupe/boilerplate/teto de tokens antes do modelo (ver transcript_compaction)
+    includeDiagnostics: bool = True  # blocos 'timings' e 'usage' (tokens, chamadas HTTP, cache)
+
+class StreamInsightsRequest(InsightsRequest):
+    format: Literal["ndjson", "sse"] = "ndjson"  # Accept: text/event-stream também ativa SSE
+
+class JobInsightsRequest(InsightsRequest):
+    idempotencyKey: Optional[str] = None  # default: contato + opções + janela de JOB_IDEMPOTENCY_WINDOW_S
+
+class BatchInsightsRequest(BaseModel):
+    contactIds: List[str]
+    createNote: bool = True
+    sinceEpochMs: Optional[int] = None
+    useCache: bool = True
+    skipUnchangedNotes: bool = False
+    incremental: bool = False
+    llmMode: Literal["per_source", "single_call"] = "per_source"
+    compact: bool = True
+    includeDiagnostics: bool = True
+    workers: int = 4       # contatos processados em paralelo (teto: INSIGHTS_BATCH_MAX_WORKERS)
+    stream: bool = False   # NDJSON: uma linha por contato, à medida que terminam
+
+def check_auth(authorization: Optional[str]):
     if API_TOKEN:
         if not authorization or not authorization.startswith("Bearer "):
             raise HTTPException(status_code=401, detail="Missing bearer token")
@@ -85,95 +59,186 @@ def insights(req: InsightsRequest, authorization: Optional[str] = Header(None)):
         if token != API_TOKEN:
             raise HTTPException(status_code=403, detail="Invalid token")
 
-    try:
-        # ===== 1) Cooby =====
-        comms = search_cooby_comms(req.contactId)
-        cooby_txt = build_cooby_transcript(comms, req.sinceEpochMs)
-
-        insights_cooby = None
-        note_id_cooby = None
-        if cooby_txt.strip():
-            insights_cooby = generate_insights_from_transcript(cooby_txt)
-            if req.createNote:
-                note_id_cooby = create_note(
-                    req.contactId,
-                    render_note_html("🤖 Insights (Cooby/WhatsApp)", insights_cooby)
-                )
-
-        # ===== 2) Calls =====
-        calls = search_contact_calls(req.contactId)
-        calls_txt = build_calls_summary_block(calls, req.sinceEpochMs)
-
-        insights_calls = None
-        note_id_calls = None
-        if calls_txt.strip():
-            insights_calls = generate_insights_from_transcript(calls_txt)
-            if req.createNote:
-                note_id_calls = create_note(
-                    req.contactId,
-                    render_note_html("📞 Insights (Ligações)", insights_calls)
-                )
-
-        # ===== 3) Elephan (notas do contato com 'por Elephan') =====
-        notes = search_contact_notes(req.contactId)
-        elephan_txt = build_elephan_block(notes, req.sinceEpochMs)
-
-        insights_elephan = None
-        note_id_elephan = None
-        if elephan_txt.strip():
-            insights_elephan = generate_insights_from_transcript(elephan_txt)
-            if req.createNote:
-                note_id_elephan = create_note(
-                    req.contactId,
-                    render_note_html("📝 Insights (Reunião Elephan)", insights_elephan)
-                )
-
-        # Se absolutamente nada tiver dado texto, retornamos um "no data"
-        if not (cooby_txt.strip() or calls_txt.strip() or elephan_txt.strip()):
-            return {
-                "ok": False,
-                "reason": "NO_DATA",
-                "message": "Nenhum dado encontrado em Cooby, Ligações ou Elephan."
-            }
-
-        # ===== 4) Insight Geral (Cooby + Calls + Elephan) =====
-        insights_general = generate_insights_triple(
-            cooby_txt if cooby_txt.strip() else "",
-            calls_txt if calls_txt.strip() else "",
-            elephan_txt if elephan_txt.strip() else "",
-        )
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.inc("http_requests_total", help="Requisições à API", path=path, status=response.status_code)
+    metrics.observe("http_request_seconds", time.perf_counter() - t0, help="Latência da API (até os headers)", path=path)
+    return response
+
+def diagnostics(req, result: dict) -> dict:
+    if not req.includeDiagnostics:
+        result.pop("timings", None)
+        result.pop("usage", None)
+    return result
+
+def require_worker():
+    # job aceito sem ninguém para processá-lo ficaria "queued" para sempre
+    if not job_queue.has_worker(JOB_WORKERS):
+        raise HTTPException(status_code=503, detail=(
+            "Nenhum worker consome a fila deste banco: rode run_agent.py --jobs-worker com o mesmo "
+            "LASTROLENS_DB (ou JOB_WORKERS>0 num servidor de processo longo). Ver job_queue."))
+
+def pipeline_options(req) -> dict:
+    return {
+        "create_note_flag": req.createNote,
+        "since_ms": req.sinceEpochMs,
+        "use_cache": req.useCache,
+        "skip_unchanged_notes": req.skipUnchangedNotes,
+        "incremental": req.incremental,
+        "llm_mode": req.llmMode,
+        "compact": req.compact,
+    }
 
-        note_id_general = None
-        if req.createNote:
-            note_id_general = create_note(
-                req.contactId,
-                render_note_html(
-                    "🧩 Insights (Geral: WhatsApp + Ligações + Elephan)",
-                    insights_general
-                )
-            )
-
-        return {
-            "ok": True,
-            "notes": {
-                "cooby": note_id_cooby,
-                "calls": note_id_calls,
-                "elephan": note_id_elephan,
-                "geral": note_id_general,
-            },
-            "has_calls": bool(calls_txt.strip()),
-            "has_cooby": bool(cooby_txt.strip()),
-            "has_elephan": bool(elephan_txt.strip()),
-            "scores": {
-                "cooby_pre": (insights_cooby or {}).get("lead_scoring_pre") if insights_cooby else None,
-                "cooby_pos": (insights_cooby or {}).get("lead_scoring_pos") if insights_cooby else None,
-                "calls_pre": (insights_calls or {}).get("lead_scoring_pre") if insights_calls else None,
-                "calls_pos": (insights_calls or {}).get("lead_scoring_pos") if insights_calls else None,
-                "elephan_pre": (insights_elephan or {}).get("lead_scoring_pre") if insights_elephan else None,
-                "elephan_pos": (insights_elephan or {}).get("lead_scoring_pos") if insights_elephan else None,
-                "geral_pre": insights_general.get("lead_scoring_pre"),
-                "geral_pos": insights_general.get("lead_scoring_pos"),
-            },
-        }
-    except Exception as e:
-        return {"ok": False, "reason": "ERROR", "error": str(e)}
\ No newline at end of file
+@app.post("/api/insights")
+def insights(req: InsightsRequest, authorization: Optional[str] = Header(None)):
+    # auth igual está hoje...
+    check_auth(authorization)
+    from insights_pipeline import run_insights_safe
+    return diagnostics(req, run_insights_safe(req.contactId, parallel=req.parallel, **pipeline_options(req)))
+
+@app.get("/api/warmup")
+def warmup(deep: bool = False):
+    """
+    Rota leve para manter a função quente (cron/uptime check), sem auth e sem
+    chamadas externas. Com deep=true também importa o pipeline e cria o
+    cliente OpenAI, a sessão HTTP do HubSpot e a conexão SQLite, que as
+    invocações seguintes reaproveitam.
+    """
+    warm = "insights_pipeline" in sys.modules
+    init_ms = {}
+    if deep:
+        steps = (
+            ("pipeline", lambda: __import__("insights_pipeline")),
+            ("openai_client", lambda: __import__("insights_agent").get_client()),
+            ("hubspot_session", lambda: __import__("hubspot_client").get_session()),
+            ("sqlite", lambda: __import__("local_store").connect()),
+        )
+        for name, step in steps:
+            t = time.perf_counter()
+            step()
+            init_ms[name] = round((time.perf_counter() - t) * 1000, 1)
+    return {"ok": True, "warm": warm, "init_ms": init_ms}
+
+@app.get("/metrics")
+def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    # formato texto do Prometheus; o scraper manda o mesmo bearer da API
+    check_auth(authorization)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/insights/stream")
+def insights_stream(req: StreamInsightsRequest, authorization: Optional[str] = Header(None),
+                    accept: Optional[str] = Header(None)):
+    """
+    Mesmo pipeline, mas emite um evento por etapa assim que ela termina:
+    start, fetch (por fonte), insight (por fonte e geral), note, error e,
+    por último, done com o payload completo de /api/insights. Falhas de
+    uma etapa não derrubam as demais (vão como 'error' e em done.errors).
+    """
+    check_auth(authorization)
+    from insights_pipeline import run_insights
+    sse = req.format == "sse" or "text/event-stream" in (accept or "")
+    events = queue.Queue()
+
+    def work():
+        try:
+            run_insights(req.contactId, parallel=req.parallel, on_event=events.put, partial=True,
+                         **pipeline_options(req))
+        except Exception as e:
+            events.put({"event": "error", "contactId": req.contactId, "stage": "pipeline", "error": str(e)})
+            events.put({"event": "done", "contactId": req.contactId, "ok": False, "reason": "ERROR", "error": str(e)})
+        finally:
+            events.put(None)
+
+    def encode(ev: dict) -> str:
+        if ev["event"] == "done":
+            ev = diagnostics(req, dict(ev))  # done leva o payload de /api/insights
+        data = json.dumps(ev, ensure_ascii=False)
+        return f"event: {ev['event']}\ndata: {data}\n\n" if sse else data + "\n"
+
+    def body():
+        yield encode({"event": "start", "contactId": req.contactId})
+        threading.Thread(target=work, daemon=True).start()
+        while (ev := events.get()) is not None:
+            yield encode(ev)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/insights/jobs", status_code=202)
+def insights_job(req: JobInsightsRequest, authorization: Optional[str] = Header(None),
+                 idempotency_key: Optional[str] = Header(None)):
+    """
+    Enfileira o pipeline e responde na hora com o jobId; o resultado sai em
+    GET /api/insights/jobs/{jobId}. Retry com a mesma chave (ou enquanto o
+    contato já tem job na fila) devolve o job existente com deduplicated=true.
+    """
+    check_auth(authorization)
+    require_worker()
+    options = {"parallel": req.parallel, **pipeline_options(req)}
+    job, created = job_queue.enqueue(req.contactId, options, req.idempotencyKey or idempotency_key)
+    if JOB_WORKERS > 0:
+        job_queue.start_workers(JOB_WORKERS)
+    return {**job, "deduplicated": not created}
+
+@app.post("/api/hubspot/webhook")
+async def hubspot_webhook(request: Request):
+    """
+    Webhook do app HubSpot (criação de communications/calls/notes e mudança
+    de associação com contato). Autenticado pela assinatura v3, não pelo
+    bearer. Responde na hora; o recálculo sai do debounce por contato
+    (ver hubspot_webhooks).
+    """
+    import hubspot_webhooks
+
+    body = await request.body()
+    uri = str(request.url)
+    if WEBHOOK_PUBLIC_URL:
+        uri = WEBHOOK_PUBLIC_URL + (f"?{request.url.query}" if request.url.query else "")
+    if not hubspot_webhooks.valid_signature(request.method, uri, body,
+                                            request.headers.get("x-hubspot-request-timestamp"),
+                                            request.headers.get("x-hubspot-signature-v3")):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    try:
+        events = json.loads(body or b"[]")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    require_worker()  # 5xx: o HubSpot reenvia depois
+    summary = hubspot_webhooks.ingest(events)
+    if JOB_WORKERS > 0:
+        job_queue.start_workers(JOB_WORKERS)
+    return {"ok": True, **summary}
+
+@app.get("/api/insights/jobs/{job_id}")
+def insights_job_status(job_id: str, authorization: Optional[str] = Header(None)):
+    check_auth(authorization)
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/insights/batch")
+def insights_batch(req: BatchInsightsRequest, authorization: Optional[str] = Header(None)):
+    check_auth(authorization)
+    from insights_pipeline import run_batch, summarize_batch
+    t0 = time.perf_counter()
+    results = run_batch(req.contactIds, workers=req.workers, **pipeline_options(req))
+
+    if req.stream:
+        def ndjson():
+            done = []
+            for r in results:
+                done.append(r)
+                yield json.dumps(diagnostics(req, dict(r)), ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": summarize_batch(done, time.perf_counter() - t0)}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    results = list(results)
+    summary = summarize_batch(results, time.perf_counter() - t0)
+    return {"ok": True, **summary, "results": [diagnostics(req, r) for r in results]}
@@ -0,0 +1,90 @@
+# benchmarks/bench_html.py
+"""
+Micro-benchmark da limpeza de HTML (hubspot_client.html_to_text) contra a
+implementação antiga com regex encadeadas, em corpos grandes de 'Call summary'.
+Também confere que a saída é idêntica nos corpos gerados.
+
+    python benchmarks/bench_html.py [--sizes 2,20,200] [--repeat 20]
+"""
+import argparse, os, random, re, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hubspot_client import clean_call_summary_html, strip_html  # noqa: E402
+
+# ——— referência: limpeza antiga (várias passadas de regex)
+_RE_BR   = re.compile(r"<br\s*/?>", re.I)
+_RE_LI_1 = re.compile(r"\s*<li>\s*", re.I)
+_RE_LI_2 = re.compile(r"\s*</li>\s*", re.I)
+_RE_UL_OL = re.compile(r"</?(ul|ol)\s*[^>]*>", re.I)
+_RE_H = re.compile(r"</?h[1-6]\s*[^>]*>", re.I)
+_RE_B = re.compile(r"</?b\s*[^>]*>", re.I)
+_RE_I = re.compile(r"</?i\s*[^>]*>", re.I)
+_RE_HR = re.compile(r"<hr\s*[^>]*>", re.I)
+_RE_TAGS = re.compile(r"<[^>]+>", re.I | re.S)
+
+def legacy_clean_call_summary_html(html):
+    t = _RE_BR.sub("\n", html)
+    t = _RE_LI_1.sub("- ", t)
+    t = _RE_LI_2.sub("\n", t)
+    t = _RE_UL_OL.sub("\n", t)
+    t = _RE_H.sub("\n", t)
+    t = _RE_B.sub("", t)
+    t = _RE_I.sub("", t)
+    t = _RE_HR.sub("\n", t)
+    t = _RE_TAGS.sub("", t)
+    lines = [ln.strip() for ln in t.splitlines()]
+    return "\n".join(ln for ln in lines if ln)
+
+def legacy_strip_html(text):
+    t = re.sub(r"<br\s*/?>", "\n", text, flags=re.IGNORECASE)
+    t = re.sub(r"<.*?>", "", t)
+    lines = [ln.strip() for ln in t.splitlines()]
+    return "\n".join(ln for ln in lines if ln)
+
+WORDS = "cliente proposta orçamento prazo reunião diretoria contrato implantação follow-up valor".split()
+
+def make_summary(n_sections: int, rnd: random.Random) -> str:
+    parts = []
+    for i in range(n_sections):
+        parts.append(f"<h3>Tópico {i}</h3>\n<ul>\n")
+        for _ in range(rnd.randint(3, 8)):
+            words = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 25)))
+            parts.append(f"  <li> <b>{words}</b> <i>{rnd.choice(WORDS)}</i> </li>\n")
+        parts.append("</ul><br/>\n<p style=\"margin:0\">" + " ".join(rnd.choice(WORDS) for _ in range(40)) + "</p><hr>\n")
+    return "".join(parts)
+
+def bench(fn, bodies, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for b in bodies:
+            fn(b)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="2,20,200", help="seções <h3>+<ul> por corpo")
+    ap.add_argument("--bodies", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    print(f"{'seções':>7} {'KB/corpo':>9} {'legacy ms':>10} {'novo ms':>9} {'ganho':>6}  (summary | strip)")
+    for size in (int(x) for x in args.sizes.split(",")):
+        bodies = [make_summary(size, rnd) for _ in range(args.bodies)]
+        for b in bodies:
+            assert clean_call_summary_html(b) == legacy_clean_call_summary_html(b), "saída divergente (summary)"
+            assert strip_html(b) == legacy_strip_html(b), "saída divergente (strip_html)"
+        kb = sum(map(len, bodies)) / len(bodies) / 1024
+        for fn_new, fn_old, label in (
+            (clean_call_summary_html, legacy_clean_call_summary_html, "summary"),
+            (strip_html, legacy_strip_html, "strip"),
+        ):
+            old = bench(fn_old, bodies, args.repeat) * 1000
+            new = bench(fn_new, bodies, args.repeat) * 1000
+            print(f"{size:>7} {kb:>9.1f} {old:>10.2f} {new:>9.2f} {old / new:>5.2f}x  {label}")
+
+if __name__ == "__main__":
+    main()
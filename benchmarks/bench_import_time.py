@@ -0,0 +1,73 @@
+# benchmarks/bench_import_time.py
+"""
+Orçamento de cold start: mede o import de api/insights.py (o que a função
+serverless paga antes de atender a primeira requisição) com `-X importtime`,
+em processos novos, e lista os módulos mais caros.
+
+Falha (código 1) se o melhor tempo passar de --budget-ms ou se algum módulo
+pesado que deveria ser carregado só sob demanda (openai, requests, pipeline)
+aparecer no import da API.
+
+    python benchmarks/bench_import_time.py [--budget-ms 500] [--repeat 5] [--top 15]
+"""
+import argparse, os, re, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# não podem entrar no cold start da API (ver os imports dentro das rotas)
+LAZY_MODULES = ("openai", "requests", "insights_pipeline", "insights_agent", "hubspot_client")
+
+TARGETS = {
+    "api": "import sys; sys.path[:0] = ['api', '.']; import insights",
+    "pipeline": "import sys; sys.path.insert(0, '.'); import insights_pipeline",
+}
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+def import_profile(code: str) -> list:
+    """[(módulo, self_us, cumulativo_us, profundidade)] de um processo novo."""
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "x"), "LASTROLENS_LOG": "0"}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f"import falhou:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2))
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "500")))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    failed = False
+    for target, code in TARGETS.items():
+        runs = [import_profile(code) for _ in range(args.repeat)]
+        # total = soma dos módulos de topo (profundidade 0) do processo
+        totals = [sum(cum for _, _, cum, depth in rows if depth == 0) / 1000 for rows in runs]
+        best = min(range(len(runs)), key=totals.__getitem__)
+        rows = runs[best]
+        print(f"== {target}: melhor {totals[best]:.0f} ms, mediana {sorted(totals)[len(totals) // 2]:.0f} ms "
+              f"({args.repeat} processos)")
+        print(f"{'cumulativo ms':>14} {'próprio ms':>11}  módulo")
+        for name, self_us, cum_us, depth in sorted(rows, key=lambda r: -r[2])[:args.top]:
+            print(f"{cum_us / 1000:>14.1f} {self_us / 1000:>11.1f}  {'  ' * depth}{name}")
+        if target != "api":
+            continue
+        eager = sorted({name.split(".")[0] for name, *_ in rows} & set(LAZY_MODULES))
+        if eager:
+            print(f"FALHA: carregados no cold start da API: {', '.join(eager)}", file=sys.stderr)
+            failed = True
+        if totals[best] > args.budget_ms:
+            print(f"FALHA: import da API {totals[best]:.0f} ms > orçamento {args.budget_ms:.0f} ms", file=sys.stderr)
+            failed = True
+        print()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# benchmarks/bench_llm_modes.py
+"""
+Compara o caminho de quatro chamadas (uma por fonte + a geral, concorrentes)
+com a chamada única em camadas (insights_agent.generate_insights_layers)
+para os mesmos transcripts: latência, tokens e o bloco 'scores'.
+Sem cache, sem criar notas. Usa HubSpot/OpenAI reais (ou os definidos no ambiente).
+
+    python benchmarks/bench_llm_modes.py --contact-ids 123,456 [--repeat 3]
+"""
+import argparse, json, os, statistics, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engagements import fetch_engagements  # noqa: E402
+from insights_pipeline import SOURCES, BUILDERS, MAX_TRANSCRIPT_CHARS, scores_from  # noqa: E402
+from insights_agent import (  # noqa: E402
+    generate_insights_from_transcript, generate_insights_triple, generate_insights_layers,
+)
+
+def fetch_texts(contact_id: str) -> dict:
+    records = fetch_engagements([contact_id])[str(contact_id)]
+    return {src: BUILDERS[src](records.for_source(src), None, MAX_TRANSCRIPT_CHARS).strip() for src in SOURCES}
+
+def tokens(stats: dict) -> tuple:
+    calls = stats.get("calls", []) + stats.get("reduce", []) + stats.get("map", [])
+    return (sum(c.get("prompt_tokens") or 0 for c in calls), sum(c.get("completion_tokens") or 0 for c in calls))
+
+def per_source(texts: dict):
+    stats = {src: {} for src in (*SOURCES, "geral")}
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futs = {src: pool.submit(generate_insights_from_transcript, txt, False, stats[src])
+                for src, txt in texts.items() if txt}
+        futs["geral"] = pool.submit(generate_insights_triple, texts["cooby"], texts["calls"],
+                                    texts["elephan"], False, stats["geral"])
+        insights = {src: f.result() for src, f in futs.items()}
+    return insights, len(futs), [sum(x) for x in zip(*(tokens(st) for st in stats.values()))]
+
+def single_call(texts: dict):
+    stats = {}
+    layers = generate_insights_layers(texts["cooby"], texts["calls"], texts["elephan"], False, stats)
+    return {k: v for k, v in layers.items() if v}, len(stats.get("calls", [])), list(tokens(stats))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--contact-ids", required=True)
+    ap.add_argument("--repeat", type=int, default=1)
+    args = ap.parse_args()
+
+    rows = {"per_source": [], "single_call": []}
+    for cid in [c.strip() for c in args.contact_ids.split(",") if c.strip()]:
+        texts = fetch_texts(cid)
+        if not any(texts.values()):
+            print(f"{cid}: sem dados")
+            continue
+        for _ in range(args.repeat):
+            for mode, fn in (("per_source", per_source), ("single_call", single_call)):
+                t = time.perf_counter()
+                insights, n_calls, (p_tok, c_tok) = fn(texts)
+                ms = (time.perf_counter() - t) * 1000
+                scores = scores_from(insights)
+                rows[mode].append((ms, n_calls, p_tok, c_tok))
+                print(json.dumps({"contactId": cid, "mode": mode, "ms": round(ms), "calls": n_calls,
+                                  "prompt_tokens": p_tok, "completion_tokens": c_tok, "scores": scores},
+                                 ensure_ascii=False))
+
+    print(f"\n{'modo':<12} {'p50 ms':>8} {'chamadas':>9} {'prompt tok':>11} {'compl tok':>10}")
+    for mode, r in rows.items():
+        if r:
+            print(f"{mode:<12} {statistics.median(x[0] for x in r):>8.0f} {statistics.mean(x[1] for x in r):>9.1f} "
+                  f"{statistics.mean(x[2] for x in r):>11.0f} {statistics.mean(x[3] for x in r):>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/bench_offline.py
+"""
+Benchmark offline do pipeline contra os dublês locais de HubSpot e OpenAI
+(benchmarks/fake_services.py), com contatos sintéticos de vários tamanhos:
+
+- api:  POST /api/insights via HTTP (uvicorn numa thread; requer `pip install uvicorn`)
+- cli:  run_agent.py em modo lote (subprocesso), um lote por tamanho
+- html: limpeza de HTML (clean_call_summary_html / strip_html) nos corpos gerados
+
+Reporta p50/p95 de latência por contato, contatos/min, requisições HubSpot e
+OpenAI por contato e tokens de prompt por contato. Com --baseline, sai com
+código 1 se algum número piorar além da tolerância (para rodar antes do deploy).
+
+    python benchmarks/bench_offline.py [--targets api,cli,html] [--sizes small,medium,large]
+        [--contacts 5] [--concurrency 1] [--hubspot-latency-ms 40] [--openai-latency-ms 800]
+        [--rate-429 0.02] [--page-cap 20] [--body-scale 2] [--out bench.json]
+        [--baseline bench.json --tolerance 0.2]
+"""
+import argparse, json, os, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_services import FakeConfig, FakeServices  # noqa: E402
+
+# métricas em que "maior é pior" e entram na comparação com o baseline
+GATED = ("p95_ms", "hubspot_calls_per_contact", "openai_calls_per_contact", "prompt_tokens_per_contact")
+
+def pct(values: list, p: float, ndigits: int = 1) -> float | None:
+    if not values:
+        return None
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(round(p / 100 * (len(v) - 1))))], ndigits)
+
+def summarize(latencies_ms: list, wall_s: float, n: int, before: dict, after: dict, errors: int) -> dict:
+    delta = lambda k: after[k] - before[k]
+    return {
+        "contacts": n,
+        "errors": errors,
+        "p50_ms": pct(latencies_ms, 50),
+        "p95_ms": pct(latencies_ms, 95),
+        "contacts_per_min": round(n / wall_s * 60, 1) if wall_s else None,
+        "hubspot_calls_per_contact": round(delta("hubspot_requests") / n, 2),
+        "openai_calls_per_contact": round(delta("openai_requests") / n, 2),
+        "prompt_tokens_per_contact": round(delta("prompt_tokens") / n),
+        "completion_tokens_per_contact": round(delta("completion_tokens") / n),
+        "hubspot_429": delta("hubspot_429"),
+        "openai_429": delta("openai_429"),
+    }
+
+# ——— alvos
+def start_api(port: int = 0):
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("alvo 'api' requer uvicorn (pip install uvicorn)")
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("api_insights", os.path.join(ROOT, "api", "insights.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    server = uvicorn.Server(uvicorn.Config(mod.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    sock = server.servers[0].sockets[0].getsockname()
+    return server, f"http://{sock[0]}:{sock[1]}"
+
+def bench_api(base_url: str, svc: FakeServices, ids: list, args) -> dict:
+    import requests
+
+    session = requests.Session()
+    body = {"createNote": not args.no_notes, "useCache": args.cache, "llmMode": args.llm_mode}
+    token = os.getenv("AGENT_API_TOKEN")
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def one(cid):
+        t = time.perf_counter()
+        r = session.post(f"{base_url}/api/insights", json={"contactId": cid, **body}, headers=headers, timeout=600)
+        ok = r.status_code == 200 and r.json().get("ok")
+        return (time.perf_counter() - t) * 1000, ok
+
+    before, t0 = svc.stats(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        rows = list(pool.map(one, ids))
+    wall = time.perf_counter() - t0
+    return summarize([ms for ms, _ in rows], wall, len(ids), before, svc.stats(), sum(1 for _, ok in rows if not ok))
+
+def bench_cli(env: dict, svc: FakeServices, ids: list, args) -> dict:
+    cmd = [sys.executable, os.path.join(ROOT, "run_agent.py"), "--contact-ids", ",".join(ids),
+           "--workers", str(args.concurrency), "--llm-mode", args.llm_mode]
+    if args.no_notes:
+        cmd.append("--dry-run")
+    before, t0 = svc.stats(), time.perf_counter()
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True, cwd=ROOT)
+    wall = time.perf_counter() - t0
+    results = [json.loads(ln) for ln in proc.stdout.splitlines() if ln.startswith("{")]
+    if not results:
+        sys.exit(f"run_agent.py falhou:\n{proc.stderr[-2000:]}")
+    lat = [r["timings"]["total_ms"] for r in results if r.get("timings")]
+    return summarize(lat, wall, len(ids), before, svc.stats(), sum(1 for r in results if not r.get("ok")))
+
+def bench_html(svc: FakeServices, ids: list, args) -> dict:
+    from hubspot_client import clean_call_summary_html, strip_html
+
+    bodies = [r["properties"]["hs_call_body"] for cid in ids for r in svc.records(cid, "calls")]
+    bodies += [r["properties"]["hs_note_body"] for cid in ids for r in svc.records(cid, "notes")]
+    lat = []
+    for b in bodies:
+        t = time.perf_counter()
+        for _ in range(args.html_repeat):
+            clean_call_summary_html(b)
+            strip_html(b)
+        lat.append((time.perf_counter() - t) * 1000 / args.html_repeat)
+    total_s = sum(lat) / 1000
+    return {
+        "bodies": len(bodies),
+        "kb_per_body": round(sum(map(len, bodies)) / max(1, len(bodies)) / 1024, 1),
+        "p50_ms": pct(lat, 50, 3),
+        "p95_ms": pct(lat, 95, 3),
+        "mb_per_s": round(sum(map(len, bodies)) / 1e6 / total_s, 1) if total_s else None,
+    }
+
+# ——— comparação com baseline
+def regressions(current: dict, baseline: dict, tolerance: float) -> list:
+    out = []
+    for key, row in current.items():
+        base = baseline.get(key) or {}
+        for metric in GATED:
+            new, old = row.get(metric), base.get(metric)
+            if new is None or not old:
+                continue
+            if new > old * (1 + tolerance):
+                out.append(f"{key} {metric}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--targets", default="api,cli,html")
+    ap.add_argument("--sizes", default="small,medium,large")
+    ap.add_argument("--contacts", type=int, default=5, help="contatos por tamanho")
+    ap.add_argument("--concurrency", type=int, default=1, help="api: clientes simultâneos; cli: --workers")
+    ap.add_argument("--llm-mode", choices=["per_source", "single_call"], default="per_source")
+    ap.add_argument("--cache", action="store_true", help="usa o cache de LLM (default: desligado)")
+    ap.add_argument("--no-notes", action="store_true")
+    ap.add_argument("--no-limits", action="store_true", help="desliga os rate limits do cliente HubSpot")
+    ap.add_argument("--hubspot-latency-ms", type=float, default=0)
+    ap.add_argument("--openai-latency-ms", type=float, default=0)
+    ap.add_argument("--openai-ms-per-ktok", type=float, default=0)
+    ap.add_argument("--rate-429", type=float, default=0)
+    ap.add_argument("--page-cap", type=int, default=100)
+    ap.add_argument("--body-scale", type=float, default=1.0)
+    ap.add_argument("--html-repeat", type=int, default=5)
+    ap.add_argument("--out")
+    ap.add_argument("--baseline")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args()
+
+    svc = FakeServices(FakeConfig(
+        hubspot_latency_ms=args.hubspot_latency_ms, openai_latency_ms=args.openai_latency_ms,
+        openai_ms_per_ktok=args.openai_ms_per_ktok, rate_429=args.rate_429,
+        page_cap=args.page_cap, body_scale=args.body_scale,
+    )).start()
+
+    # ambiente do pipeline: tudo aponta para os dublês, banco local descartável.
+    # Precisa estar pronto antes de importar hubspot_client/insights_agent.
+    env = {
+        "HUBSPOT_BASE_URL": svc.url,
+        "HUBSPOT_TOKEN": "fake",
+        "OPENAI_BASE_URL": f"{svc.url}/v1",
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_MAX_RETRIES": os.getenv("OPENAI_MAX_RETRIES", "8"),
+        "LASTROLENS_DB": os.path.join(tempfile.mkdtemp(prefix="lastrolens-bench-"), "bench.sqlite3"),
+        "INSIGHTS_CACHE": "1" if args.cache else "0",
+        "JOB_WORKERS": "0",
+    }
+    if args.no_limits:
+        env.update(HUBSPOT_BURST_LIMIT="1000000", HUBSPOT_SEARCH_PER_SEC="100000")
+    os.environ.update(env)
+    env = {**os.environ}
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    api = start_api() if "api" in targets else None
+
+    results = {}
+    for size in sizes:
+        ids = [f"{size}-{i}" for i in range(args.contacts)]
+        for target in targets:
+            if target == "api":
+                row = bench_api(api[1], svc, ids, args)
+            elif target == "cli":
+                row = bench_cli(env, svc, ids, args)
+            elif target == "html":
+                row = bench_html(svc, ids, args)
+            else:
+                sys.exit(f"alvo desconhecido: {target}")
+            results[f"{target}/{size}"] = row
+            print(json.dumps({"bench": f"{target}/{size}", **row}, ensure_ascii=False), flush=True)
+
+    cols = ("p50_ms", "p95_ms", "contacts_per_min", "hubspot_calls_per_contact",
+            "openai_calls_per_contact", "prompt_tokens_per_contact")
+    heads = ("p50 ms", "p95 ms", "contat/min", "HubSpot/contat", "OpenAI/contat", "prompt tok/contat")
+    print(f"\n{'bench':<14}" + "".join(f"{h:>18}" for h in heads))
+    for key, row in results.items():
+        print(f"{key:<14}" + "".join(f"{'-' if row.get(c) is None else row[c]:>18}" for c in cols))
+
+    if api:
+        api[0].should_exit = True
+    svc.stop()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSÃO:", line, file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
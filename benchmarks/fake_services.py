@@ -0,0 +1,485 @@
+# benchmarks/fake_services.py
+"""
+Servidor HTTP local que imita as partes do HubSpot e da OpenAI usadas pelo
+projeto, para medir o pipeline sem rede nem custo:
+
+- HubSpot: search de communications/calls/notes (com paginação por cursor e
+  filtro hs_timestamp GTE), batch/read v3 desses objetos, notes batch/create
+  e batch/archive e associações v4 (create; batch/read engagement -> contato e contato ->
+  engagements, paginada em ASSOC_PAGE como a real). O ID do engagement
+  carrega o do contato ("small-1~comm3").
+- OpenAI: /v1/chat/completions com response_format json_object, devolvendo
+  um insight no schema pedido e `usage` estimado (~4 caracteres por token);
+  Batch API (files com purpose=batch, batches, conteúdo do arquivo de saída),
+  concluindo cada batch FakeConfig.batch_delay_s depois de criado.
+
+Contatos sintéticos: o ID diz o tamanho ("small-1", "medium-7", "large-3");
+ID desconhecido vira "small"; "bad-*" é contato inexistente (nota associada
+a ele volta 400). Latência, tamanho dos corpos, profundidade da
+paginação e injeção de 429 são configuráveis (FakeConfig). Os contadores
+(requisições, 429, tokens, notas) ficam em FakeServices.stats().
+
+    python benchmarks/fake_services.py --port 8765   # só sobe o servidor
+    HUBSPOT_BASE_URL=http://127.0.0.1:8765 OPENAI_BASE_URL=http://127.0.0.1:8765/v1 ...
+"""
+import argparse, json, random, threading, time, zlib
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# itens por contato: (mensagens Cooby, ligações, notas)
+SIZES = {
+    "small": (12, 2, 2),
+    "medium": (80, 10, 6),
+    "large": (600, 40, 20),
+}
+
+ASSOC_PAGE = 500  # associações por objeto em cada página (v4)
+OBJECT_PREFIXES = {"comm": "communications", "call": "calls", "note": "notes"}
+
+WORDS = ("cliente proposta orçamento prazo reunião diretoria contrato implantação follow-up valor "
+         "desconto piloto integração financeiro aprovação concorrente treinamento suporte").split()
+
+@dataclass
+class FakeConfig:
+    hubspot_latency_ms: float = 0.0
+    openai_latency_ms: float = 0.0
+    openai_ms_per_ktok: float = 0.0   # latência extra por 1k tokens de prompt
+    body_scale: float = 1.0           # multiplica o tamanho dos textos
+    page_cap: int = 100               # maior página que a search devolve (menor => mais páginas)
+    rate_429: float = 0.0             # fração de requisições respondidas com 429
+    retry_after_s: float = 0.0
+    inline_assoc: bool = True         # False: batch/create recusa associações inline (400)
+    batch_delay_s: float = 0.0        # tempo até um batch da OpenAI ficar "completed"
+    seed: int = 7
+    sizes: dict = field(default_factory=lambda: dict(SIZES))
+
+# ——— dados sintéticos
+def _words(rnd: random.Random, n: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+def _iso(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+@lru_cache(maxsize=4096)
+def _records(cfg_key: tuple, contact_id: str, object_type: str) -> tuple:
+    seed, scale, sizes = cfg_key
+    size = contact_id.split("-", 1)[0]
+    n_comms, n_calls, n_notes = dict(sizes).get(size, dict(sizes)["small"])
+    rnd = random.Random(f"{seed}:{contact_id}:{object_type}")
+    now_ms = 1_760_000_000_000
+    words = lambda lo, hi: _words(rnd, max(1, int(rnd.randint(lo, hi) * scale)))
+    out = []
+    if object_type == "communications":
+        for i in range(n_comms):
+            body = (f"<p>Sent via Cooby.co</p><p>Message text: {words(6, 40)}</p>"
+                    f"<p style=\"color:#999\">{rnd.choice(['inbound', 'outbound'])}</p>")
+            props = {"hs_communication_body": body, "hs_communication_channel_type": "WHATS_APP",
+                     "hs_direction": rnd.choice(["INCOMING", "OUTGOING"])}
+            out.append((now_ms - i * 3_600_000, props))
+    elif object_type == "calls":
+        for i in range(n_calls):
+            parts = []
+            for t in range(rnd.randint(2, 4)):
+                parts.append(f"<h3>Tópico {t}</h3><ul>")
+                parts += [f"<li> <b>{words(5, 25)}</b> </li>" for _ in range(rnd.randint(3, 6))]
+                parts.append("</ul><br/>")
+            props = {"hs_call_title": f"Ligação {i}", "hs_call_outcome": "CONNECTED",
+                     "hs_call_duration": str(rnd.randint(60, 3600) * 1000), "hs_call_body": "".join(parts)}
+            out.append((now_ms - i * 86_400_000 - 1_800_000, props))
+    elif object_type == "notes":
+        for i in range(n_notes):
+            head = "Resumo da reunião por Elephan" if i % 2 == 0 else "Nota interna"
+            body = f"<p><b>{head}</b></p>" + "".join(f"<p>{words(10, 60)}</p>" for _ in range(rnd.randint(3, 8)))
+            out.append((now_ms - i * 172_800_000 - 900_000, {"hs_note_body": body}))
+    # do mais recente para o mais antigo; o número no ID cresce com o tempo, como no HubSpot
+    return tuple(
+        {"id": f"{contact_id}~{object_type[:4]}{len(out) - 1 - i}",
+         "properties": {**props, "hs_timestamp": _iso(ts), "hs_lastmodifieddate": _iso(ts)}, "_ts": ts}
+        for i, (ts, props) in enumerate(out)
+    )
+
+def _invalid_contact(contact_id) -> bool:
+    # contato "bad-*" não existe: associação a ele volta 400, como no HubSpot
+    return str(contact_id).startswith("bad-")
+
+def _insight(seed: str) -> dict:
+    rnd = random.Random(seed)
+    pre = rnd.randint(20, 70)
+    return {
+        "resumo_bullets": [_words(rnd, 8) for _ in range(3)],
+        "principais_objeções": rnd.sample(["preço", "prioridade", "prazo", "concorrente"], 2),
+        "sinais_fechamento": rnd.sample(["timeline", "budget", "pedido_proposta", "multi-stakeholder"], 2),
+        "proximos_passos": [{"descricao": "Enviar proposta", "prazo_iso": ""}],
+        "label_interacao": rnd.choice(["ruim", "ok", "boa"]),
+        "lead_scoring_pre": pre,
+        "lead_scoring_pos": min(100, pre + rnd.randint(-10, 30)),
+        "recomendacoes": ["Agendar follow-up em 48h"],
+        "top_snippets": [f"cliente: '{_words(rnd, 5)}'"],
+    }
+
+def completion_for(prompt: str) -> dict:
+    """Resposta no schema pedido no fim do prompt (insight simples ou em camadas)."""
+    seed = str(zlib.crc32(prompt.encode()))
+    try:
+        schema = json.loads(prompt.rsplit("formato:\n", 1)[1])
+    except (IndexError, ValueError):
+        schema = {}
+    if "resumo_bullets" in schema or not isinstance(schema, dict) or not schema:
+        return _insight(seed)
+    return {k: (_insight(seed + k) if v is not None else None) for k, v in schema.items()}
+
+def chat_completion(body: dict, next_id: str) -> tuple[dict, int, int]:
+    """(resposta do /chat/completions, tokens de prompt, tokens de saída)."""
+    prompt = "\n".join(str(m.get("content") or "") for m in body.get("messages") or [])
+    content = json.dumps(completion_for(prompt), ensure_ascii=False)
+    p_tok, c_tok = len(prompt) // 4 + 1, len(content) // 4 + 1
+    return {
+        "id": f"chatcmpl-{next_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": p_tok, "completion_tokens": c_tok, "total_tokens": p_tok + c_tok},
+    }, p_tok, c_tok
+
+# ——— servidor
+class FakeServices:
+    def __init__(self, cfg: FakeConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.cfg = cfg or FakeConfig()
+        self._lock = threading.Lock()
+        self._ids = 0
+        self.files = {}    # Batch API: file id -> (purpose, bytes)
+        self.batches = {}  # batch id -> objeto Batch
+        self.reset()
+        self.httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServices":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {
+                "hubspot_requests": 0, "hubspot_429": 0, "hubspot_routes": {},
+                "openai_requests": 0, "openai_429": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "batch_requests": 0, "batch_prompt_tokens": 0, "batch_completion_tokens": 0,
+                "notes_created": 0, "notes_archived": 0,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def count_route(self, route: str):
+        with self._lock:
+            routes = self._stats["hubspot_routes"]
+            routes[route] = routes.get(route, 0) + 1
+
+    def next_id(self) -> str:
+        with self._lock:
+            self._ids += 1
+            return str(900_000_000 + self._ids)
+
+    def records(self, contact_id: str, object_type: str) -> tuple:
+        c = self.cfg
+        return _records((c.seed, c.body_scale, tuple(sorted(c.sizes.items()))), contact_id, object_type)
+
+    def create_batch(self, body: dict) -> dict:
+        batch = {
+            "id": f"batch_{self.next_id()}", "object": "batch", "endpoint": body.get("endpoint"),
+            "input_file_id": body.get("input_file_id"), "completion_window": body.get("completion_window"),
+            "status": "in_progress", "created_at": int(time.time()), "metadata": body.get("metadata") or {},
+            "output_file_id": None, "error_file_id": None, "errors": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        threading.Timer(self.cfg.batch_delay_s, self._run_batch, (batch,)).start()
+        return batch
+
+    def _run_batch(self, batch: dict):
+        _, raw = self.files.get(batch["input_file_id"], (None, b""))
+        out, errors = [], []
+        for line in raw.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            if req.get("url") != batch["endpoint"]:
+                errors.append({"id": f"batch_req_{self.next_id()}", "custom_id": req.get("custom_id"), "response": None,
+                               "error": {"code": "invalid_url", "message": f"url {req.get('url')!r}"}})
+                continue
+            payload, p_tok, c_tok = chat_completion(req.get("body") or {}, self.next_id())
+            self.count("batch_requests")
+            self.count("batch_prompt_tokens", p_tok)
+            self.count("batch_completion_tokens", c_tok)
+            out.append({"id": f"batch_req_{self.next_id()}", "custom_id": req.get("custom_id"), "error": None,
+                        "response": {"status_code": 200, "request_id": self.next_id(), "body": payload}})
+        with self._lock:
+            for key, lines in (("output_file_id", out), ("error_file_id", errors)):
+                if lines:
+                    fid = f"file-{900_000_000 + len(self.files) + 1}"
+                    self.files[fid] = ("batch_output", "".join(json.dumps(l) + "\n" for l in lines).encode())
+                    batch[key] = fid
+            batch["request_counts"] = {"total": len(out) + len(errors), "completed": len(out), "failed": len(errors)}
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+    def edit(self, record_id: str, **properties):
+        """Altera um engagement sintético (e o hs_lastmodifieddate), como uma edição no HubSpot."""
+        contact_id, _, rest = record_id.partition("~")
+        items = self.records(contact_id, OBJECT_PREFIXES[rest[:4]])
+        props = items[len(items) - 1 - int(rest[4:])]["properties"]
+        props.update(properties, hs_lastmodifieddate=_iso(int(time.time() * 1000)))
+
+def _handler(svc: FakeServices):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como os hosts reais
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status: int, payload, headers: dict | None = None):
+            raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def read_json(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+        def throttled(self, counter: str) -> bool:
+            if svc.cfg.rate_429 and random.random() < svc.cfg.rate_429:
+                svc.count(counter)
+                ra = svc.cfg.retry_after_s
+                self.send(429, {"status": "error", "category": "RATE_LIMITS", "message": "fake 429"},
+                          {"Retry-After": f"{ra:g}", "retry-after-ms": str(int(ra * 1000))})
+                return True
+            return False
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            if path.endswith("/v1/files"):
+                return self.upload_file()
+            body = self.read_json()
+            if path.startswith("/v1/") or path.startswith("/openai/"):
+                return self.openai(path, body)
+            svc.count("hubspot_requests")
+            route = path
+            if "/search" in path:
+                route = "/crm/v3/objects/{type}/search"
+            elif path.startswith("/crm/v3/objects/") and path.endswith("/batch/read"):
+                route = "/crm/v3/objects/{type}/batch/read"
+            svc.count_route(route)
+            if self.throttled("hubspot_429"):
+                return
+            if svc.cfg.hubspot_latency_ms:
+                time.sleep(svc.cfg.hubspot_latency_ms / 1000)
+            if path.endswith("/search"):
+                return self.search(path.split("/")[-2], body)
+            if path == "/crm/v3/objects/notes/batch/create":
+                return self.create_notes(body)
+            if path == "/crm/v4/associations/notes/contacts/batch/create":
+                if any(_invalid_contact((i.get("to") or {}).get("id")) for i in body.get("inputs") or []):
+                    return self.send(400, {"status": "error", "message": "One or more associations are invalid"})
+                return self.send(201, {"status": "COMPLETE", "results": []})
+            if path == "/crm/v3/objects/notes/batch/archive":
+                svc.count("notes_archived", len(body.get("inputs") or []))
+                return self.send(200, {})
+            if path.startswith("/crm/v4/associations/") and path.endswith("/batch/read"):
+                return self.read_associations(path.split("/")[4], path.split("/")[5], body)
+            if path.startswith("/crm/v3/objects/") and path.endswith("/batch/read"):
+                return self.batch_read(path.split("/")[4], body)
+            self.send(404, {"status": "error", "message": f"rota desconhecida: {path}"})
+
+        def do_GET(self):
+            # /crm/v4/objects/contacts/{id}/associations/{tipo}?after=N: páginas seguintes
+            path, _, query = self.path.partition("?")
+            parts = path.strip("/").split("/")
+            if parts[0] == "v1":
+                return self.openai_get(parts)
+            svc.count("hubspot_requests")
+            svc.count_route("/crm/v4/objects/{type}/{id}/associations/{toType}")
+            if self.throttled("hubspot_429"):
+                return
+            if len(parts) != 7 or parts[:3] != ["crm", "v4", "objects"] or parts[5] != "associations":
+                return self.send(404, {"status": "error", "message": f"rota desconhecida: {path}"})
+            params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+            ids = [r["id"] for r in svc.records(parts[4], parts[6])] if parts[3] == "contacts" else []
+            start = int(params.get("after") or 0)
+            limit = min(int(params.get("limit") or ASSOC_PAGE), ASSOC_PAGE)
+            out = {"results": [{"toObjectId": i, "associationTypes": []} for i in ids[start:start + limit]]}
+            if start + limit < len(ids):
+                out["paging"] = {"next": {"after": str(start + limit)}}
+            self.send(200, out)
+
+        def search(self, object_type: str, body: dict):
+            contact_id, since_ms = None, None
+            for fg in body.get("filterGroups") or []:
+                for f in fg.get("filters") or []:
+                    if f.get("propertyName") == "associations.contact":
+                        contact_id = str(f.get("value"))
+                    elif f.get("propertyName") == "hs_timestamp" and f.get("operator") == "GTE":
+                        since_ms = int(f.get("value"))
+            items = svc.records(contact_id or "", object_type) if contact_id else ()
+            if since_ms:
+                items = [r for r in items if r["_ts"] >= since_ms]
+            start = int(body.get("after") or 0)
+            limit = min(int(body.get("limit") or 10), svc.cfg.page_cap)
+            page = items[start:start + limit]
+            wanted = set(body.get("properties") or [])
+            out = {
+                "total": len(items),
+                "results": [
+                    {"id": r["id"], "properties": {k: v for k, v in r["properties"].items() if not wanted or k in wanted}}
+                    for r in page
+                ],
+            }
+            if start + limit < len(items):
+                out["paging"] = {"next": {"after": str(start + limit)}}
+            self.send(200, out)
+
+        def read_associations(self, from_type: str, to_type: str, body: dict):
+            results = []
+            for inp in body.get("inputs") or []:
+                oid = str(inp.get("id"))
+                if to_type == "contacts":
+                    to = [oid.split("~", 1)[0]] if "~" in oid else []
+                elif from_type == "contacts":
+                    to = [r["id"] for r in svc.records(oid, to_type)]
+                else:
+                    to = []
+                if to:
+                    res = {"from": {"id": oid}, "to": [
+                        {"toObjectId": t, "associationTypes": [{"category": "HUBSPOT_DEFINED", "typeId": 1}]}
+                        for t in to[:ASSOC_PAGE]]}
+                    if len(to) > ASSOC_PAGE:
+                        res["paging"] = {"next": {"after": str(ASSOC_PAGE)}}
+                    results.append(res)
+            self.send(207 if len(results) < len(body.get("inputs") or []) else 200,
+                      {"status": "COMPLETE", "results": results, "errors": []})
+
+        def batch_read(self, object_type: str, body: dict):
+            wanted = set(body.get("properties") or [])
+            results = []
+            for inp in body.get("inputs") or []:
+                oid = str(inp.get("id"))
+                contact_id, _, rest = oid.partition("~")
+                if OBJECT_PREFIXES.get(rest[:4]) != object_type or not rest[4:].isdigit():
+                    continue
+                items = svc.records(contact_id, object_type)
+                i = len(items) - 1 - int(rest[4:])
+                if 0 <= i < len(items):
+                    props = items[i]["properties"]
+                    results.append({"id": oid, "properties": {k: v for k, v in props.items() if not wanted or k in wanted}})
+            self.send(207 if len(results) < len(body.get("inputs") or []) else 200,
+                      {"status": "COMPLETE", "results": results})
+
+        def create_notes(self, body: dict):
+            inputs = body.get("inputs") or []
+            if not svc.cfg.inline_assoc and any(i.get("associations") for i in inputs):
+                return self.send(400, {"status": "error", "message": "associations not supported"})
+            if any(_invalid_contact(a["to"]["id"]) for i in inputs for a in i.get("associations") or []):
+                return self.send(400, {"status": "error", "message": "One or more associations are invalid"})
+            results = []
+            for inp in inputs:
+                res = {"id": svc.next_id(), "properties": inp.get("properties") or {}}
+                if inp.get("objectWriteTraceId") is not None:
+                    res["objectWriteTraceId"] = inp["objectWriteTraceId"]
+                results.append(res)
+            svc.count("notes_created", len(results))
+            self.send(201, {"status": "COMPLETE", "results": results})
+
+        def openai(self, path: str, body: dict):
+            if path.endswith("/batches"):
+                if not svc.files.get(body.get("input_file_id")):
+                    return self.send(400, {"error": {"message": "input_file_id inválido"}})
+                return self.send(200, svc.create_batch(body))
+            svc.count("openai_requests")
+            if self.throttled("openai_429"):
+                return
+            if not path.endswith("/chat/completions"):
+                return self.send(404, {"error": {"message": f"rota desconhecida: {path}"}})
+            payload, p_tok, c_tok = chat_completion(body, svc.next_id())
+            svc.count("prompt_tokens", p_tok)
+            svc.count("completion_tokens", c_tok)
+            delay = svc.cfg.openai_latency_ms + svc.cfg.openai_ms_per_ktok * p_tok / 1000
+            if delay:
+                time.sleep(delay / 1000)
+            self.send(200, payload)
+
+        def upload_file(self):
+            # multipart/form-data do SDK: campos "purpose" e "file"
+            n = int(self.headers.get("Content-Length") or 0)
+            head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode()
+            msg = BytesParser(policy=email_policy).parsebytes(head + self.rfile.read(n))
+            fields = {part.get_param("name", header="content-disposition"): part for part in msg.iter_parts()}
+            if "file" not in fields:
+                return self.send(400, {"error": {"message": "campo file ausente"}})
+            raw = fields["file"].get_payload(decode=True) or b""
+            purpose = fields["purpose"].get_content().strip() if "purpose" in fields else ""
+            fid = f"file-{svc.next_id()}"
+            with svc._lock:
+                svc.files[fid] = (purpose, raw)
+            self.send(200, {"id": fid, "object": "file", "bytes": len(raw), "created_at": int(time.time()),
+                            "filename": fields["file"].get_filename(), "purpose": purpose, "status": "processed"})
+
+        def openai_get(self, parts: list):
+            # /v1/batches/{id} e /v1/files/{id}/content
+            if len(parts) == 3 and parts[1] == "batches" and parts[2] in svc.batches:
+                with svc._lock:
+                    return self.send(200, dict(svc.batches[parts[2]]))
+            if len(parts) == 4 and parts[1] == "files" and parts[3] == "content" and parts[2] in svc.files:
+                raw = svc.files[parts[2]][1]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                return self.wfile.write(raw)
+            self.send(404, {"error": {"message": f"rota desconhecida: /{'/'.join(parts)}"}})
+
+    return Handler
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--hubspot-latency-ms", type=float, default=0)
+    ap.add_argument("--openai-latency-ms", type=float, default=0)
+    ap.add_argument("--rate-429", type=float, default=0)
+    args = ap.parse_args()
+    svc = FakeServices(FakeConfig(hubspot_latency_ms=args.hubspot_latency_ms,
+                                  openai_latency_ms=args.openai_latency_ms, rate_429=args.rate_429),
+                       port=args.port)
+    print(f"HUBSPOT_BASE_URL={svc.url} OPENAI_BASE_URL={svc.url}/v1", flush=True)
+    try:
+        svc.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
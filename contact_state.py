@@ -0,0 +1,43 @@
+# contact_state.py
+"""
+Estado incremental por contato e fonte (cooby/calls/elephan/geral):
+último hs_timestamp processado (watermark) e o último insight gerado.
+Na próxima execução só o que chegou depois do watermark é buscado e o
+modelo atualiza o insight anterior com esse delta.
+"""
+import json, time
+
+from local_store import connect, register_schema
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS contact_state (
+    contact_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    watermark_ms INTEGER,
+    insight TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (contact_id, source)
+);
+""")
+
+def load(contact_id: str) -> dict:
+    rows = connect().execute(
+        "SELECT source, watermark_ms, insight FROM contact_state WHERE contact_id = ?", (str(contact_id),)
+    ).fetchall()
+    return {
+        r["source"]: {
+            "watermark_ms": r["watermark_ms"],
+            "insight": json.loads(r["insight"]) if r["insight"] else None,
+        }
+        for r in rows
+    }
+
+def save(contact_id: str, source: str, watermark_ms: int | None, insight: dict | None):
+    connect().execute(
+        "INSERT OR REPLACE INTO contact_state (contact_id, source, watermark_ms, insight, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (str(contact_id), source, watermark_ms,
+         json.dumps(insight, ensure_ascii=False) if insight is not None else None, time.time()),
+    )
+
+def reset(contact_id: str):
+    connect().execute("DELETE FROM contact_state WHERE contact_id = ?", (str(contact_id),))
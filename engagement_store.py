@@ -0,0 +1,77 @@
+# engagement_store.py
+"""
+Réplica local (SQLite) dos engagements já lidos do HubSpot: tipo, ID,
+hs_timestamp, hs_lastmodifieddate e o texto já limpo (mensagem do Cooby,
+resumo da ligação, nota sem HTML) — sem o HTML original.
+
+engagements.fetch_engagements serve daqui o que está na réplica. Passados
+ENGAGEMENT_REVALIDATE_S desde a última sincronização de um registro, ele
+é revalidado com um batch/read só de hs_lastmodifieddate; o corpo só é
+baixado (e limpo) de novo se mudou. Registros que nenhum fetch viu por
+ENGAGEMENT_STORE_TTL_S são descartados.
+"""
+import os, time
+
+from local_store import connect, register_schema
+
+STORE_ENABLED = os.getenv("ENGAGEMENT_STORE", "1") != "0"
+REVALIDATE_S = float(os.getenv("ENGAGEMENT_REVALIDATE_S", "300"))
+STORE_TTL_S = int(os.getenv("ENGAGEMENT_STORE_TTL_S", str(30 * 24 * 3600)))
+_IN_CHUNK = 500  # parâmetros por IN (...) — o SQLite limita o total
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS engagements (
+    object_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    ts TEXT,
+    ts_ms INTEGER,
+    modified_ms INTEGER,
+    text TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (object_type, id)
+);
+CREATE INDEX IF NOT EXISTS engagements_synced ON engagements(synced_at);
+""")
+
+def load(object_type: str, ids) -> dict:
+    """{id: linha (ts, ts_ms, modified_ms, text, synced_at)} dos IDs que estão na réplica."""
+    ids = list(ids)
+    conn = connect()
+    out = {}
+    for start in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[start:start + _IN_CHUNK]
+        rows = conn.execute(
+            f"SELECT id, ts, ts_ms, modified_ms, text, synced_at FROM engagements "
+            f"WHERE object_type = ? AND id IN ({','.join('?' * len(chunk))})",
+            (object_type, *chunk),
+        ).fetchall()
+        out.update((r["id"], r) for r in rows)
+    return out
+
+def save(object_type: str, records: list):
+    """Grava/atualiza registros com `text` já limpo e descarta os expirados."""
+    if not records:
+        return
+    now = time.time()
+    conn = connect()
+    conn.executemany(
+        "INSERT OR REPLACE INTO engagements (object_type, id, ts, ts_ms, modified_ms, text, synced_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(object_type, r.id, r.ts, r.ts_ms, r.modified_ms, r.text or "", now) for r in records],
+    )
+    conn.execute("DELETE FROM engagements WHERE synced_at < ?", (now - STORE_TTL_S,))
+
+def touch(object_type: str, ids):
+    """Marca como revalidados (sem mudança desde a última sincronização)."""
+    ids = list(ids)
+    now = time.time()
+    conn = connect()
+    for start in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[start:start + _IN_CHUNK]
+        conn.execute(
+            f"UPDATE engagements SET synced_at = ? WHERE object_type = ? AND id IN ({','.join('?' * len(chunk))})",
+            (now, object_type, *chunk),
+        )
+
+def is_fresh(row) -> bool:
+    return time.time() - row["synced_at"] < REVALIDATE_S
@@ -0,0 +1,271 @@
+# engagements.py
+"""
+Busca unificada dos engagements de contatos (communications, calls, notes)
+sem a search API:
+
+1. associações contato -> tipo em batch/read v4 (até 1000 contatos por
+   requisição, uma por tipo);
+2. propriedades em batch/read v3 (100 objetos por requisição), juntando os
+   engagements de todos os contatos do lote;
+3. registros tipados (Communication, Call, Note) por contato, do mais
+   recente para o mais antigo, prontos para os builders de transcript.
+
+Para um lote de N contatos o custo é ~3 + (engagements / 100) requisições,
+contra 3+ buscas por contato na search API (a de limite mais apertado).
+O filtro do Cooby (antes CONTAINS_TOKEN "Cooby.co" na busca) é feito aqui,
+assim como o da Elephan; o teto por fonte (HUBSPOT_FETCH_MAX_PER_TYPE) vale
+depois dos filtros e o corte é registrado. Sem a search API, since_ms e os
+watermarks não filtram no servidor: os corpos de todos os IDs associados
+são lidos (uma vez só, com a réplica) e o filtro de data fica nos builders.
+
+Com a réplica local (engagement_store), só os IDs novos ou modificados desde
+a última sincronização têm o corpo baixado e limpo; o resto sai do SQLite
+com o texto pronto (campo `text` dos registros).
+
+HUBSPOT_FETCH_MODE=search volta às buscas por contato (paginação preguiçosa),
+entregando os mesmos registros.
+"""
+import os, logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Iterable, Iterator, Optional
+
+import metrics
+import engagement_store
+from hubspot_client import (
+    batch_read_associations, batch_read_objects, parse_ts_ms,
+    iter_cooby_comms, iter_contact_calls, iter_contact_notes,
+    extract_message_text, clean_call_summary_html, strip_html, ELEPHAN_RE,
+    COMMUNICATION_PROPERTIES, CALL_PROPERTIES, NOTE_PROPERTIES, BATCH_READ_SIZE,
+)
+
+FETCH_MODE = os.getenv("HUBSPOT_FETCH_MODE", "batch")  # "batch" | "search"
+FETCH_WORKERS = int(os.getenv("HUBSPOT_FETCH_WORKERS", "4"))
+# teto por contato e fonte, depois dos filtros do Cooby e da Elephan (os
+# registros mais novos); folgado em relação ao orçamento do transcript
+# (INSIGHTS_MAX_TRANSCRIPT_CHARS), que é quem corta na prática. 0 = sem teto
+MAX_PER_TYPE = int(os.getenv("HUBSPOT_FETCH_MAX_PER_TYPE", "5000"))
+COOBY_TOKEN = "cooby.co"
+
+def _modified_ms(item: dict):
+    p = item.get("properties") or {}
+    return parse_ts_ms(p.get("hs_lastmodifieddate") or item.get("updatedAt"))
+
+@dataclass(frozen=True, slots=True)
+class Communication:
+    id: str
+    ts: Optional[str]      # hs_timestamp como veio do HubSpot (vai para o transcript)
+    ts_ms: Optional[int]
+    body: str
+    channel: Optional[str] = None
+    direction: Optional[str] = None
+    modified_ms: Optional[int] = None
+    text: Optional[str] = None  # mensagem já extraída (réplica); None = extrair do body
+
+    @classmethod
+    def from_hubspot(cls, item: dict) -> "Communication":
+        p = item.get("properties") or {}
+        return cls(str(item.get("id")), p.get("hs_timestamp"), parse_ts_ms(p.get("hs_timestamp")),
+                   p.get("hs_communication_body") or "", p.get("hs_communication_channel_type"),
+                   p.get("hs_direction"), _modified_ms(item))
+
+    @property
+    def is_cooby(self) -> bool:
+        # da réplica só as mensagens do Cooby voltam com texto
+        return bool(self.text) if self.text is not None else COOBY_TOKEN in self.body.lower()
+
+    def clean_text(self) -> str:
+        return self.text if self.text is not None else (extract_message_text(self.body) or "") if self.is_cooby else ""
+
+@dataclass(frozen=True, slots=True)
+class Call:
+    id: str
+    ts: Optional[str]
+    ts_ms: Optional[int]
+    body: str               # HTML das observações
+    summary: str = ""       # hs_call_summary / call_summary, quando o portal tem
+    title: Optional[str] = None
+    outcome: Optional[str] = None
+    duration_ms: Optional[int] = None
+    modified_ms: Optional[int] = None
+    text: Optional[str] = None
+
+    @classmethod
+    def from_hubspot(cls, item: dict) -> "Call":
+        p = item.get("properties") or {}
+        duration = p.get("hs_call_duration")
+        return cls(str(item.get("id")), p.get("hs_timestamp"), parse_ts_ms(p.get("hs_timestamp")),
+                   p.get("hs_call_body") or "", p.get("hs_call_summary") or p.get("call_summary") or "",
+                   p.get("hs_call_title"), p.get("hs_call_outcome"),
+                   int(duration) if str(duration or "").isdigit() else None, _modified_ms(item))
+
+    def clean_text(self) -> str:
+        if self.text is not None:
+            return self.text
+        return clean_call_summary_html(self.summary) if self.summary else strip_html(self.body)
+
+@dataclass(frozen=True, slots=True)
+class Note:
+    id: str
+    ts: Optional[str]
+    ts_ms: Optional[int]
+    body: str
+    modified_ms: Optional[int] = None
+    text: Optional[str] = None
+
+    @classmethod
+    def from_hubspot(cls, item: dict) -> "Note":
+        p = item.get("properties") or {}
+        return cls(str(item.get("id")), p.get("hs_timestamp"), parse_ts_ms(p.get("hs_timestamp")),
+                   p.get("hs_note_body") or "", _modified_ms(item))
+
+    @property
+    def is_elephan(self) -> bool:
+        return bool(ELEPHAN_RE.search(self.clean_text()))
+
+    def clean_text(self) -> str:
+        return self.text if self.text is not None else strip_html(self.body)
+
+# tipo CRM (= campo em ContactEngagements) -> (registro, propriedades)
+OBJECT_TYPES = {
+    "communications": (Communication, COMMUNICATION_PROPERTIES),
+    "calls": (Call, CALL_PROPERTIES),
+    "notes": (Note, NOTE_PROPERTIES),
+}
+
+@dataclass
+class ContactEngagements:
+    contact_id: str
+    communications: list = field(default_factory=list)
+    calls: list = field(default_factory=list)
+    notes: list = field(default_factory=list)
+    capped: dict = field(default_factory=dict)  # {fonte: descartados pelo teto} (ver cap)
+
+    def sort(self):
+        for records in (self.communications, self.calls, self.notes):
+            records.sort(key=lambda r: r.ts_ms or 0, reverse=True)
+
+    def for_source(self, src: str) -> list:
+        """Registros de uma fonte do pipeline (cooby, calls, elephan), mais recentes primeiro."""
+        if src == "cooby":
+            return [r for r in self.communications if r.is_cooby]
+        if src == "calls":
+            return self.calls
+        if src == "elephan":
+            return self.notes
+        raise ValueError(f"fonte desconhecida: {src!r}")
+
+    def cap(self, max_per_source: int) -> dict:
+        """
+        Fica só com os registros que as fontes usam (Cooby, ligações,
+        Elephan), no máximo `max_per_source` por fonte (os mais recentes;
+        chamar depois de sort). Devolve {fonte: descartados} dos cortes.
+        """
+        self.communications = self.for_source("cooby")
+        self.notes = [r for r in self.notes if r.is_elephan]
+        dropped = {}
+        for src, attr in (("cooby", "communications"), ("calls", "calls"), ("elephan", "notes")):
+            records = getattr(self, attr)
+            if max_per_source and len(records) > max_per_source:
+                dropped[src] = len(records) - max_per_source
+                setattr(self, attr, records[:max_per_source])
+        self.capped = dropped
+        return dropped
+
+def _read(pool: ThreadPoolExecutor, wanted: dict, properties=None) -> dict:
+    """
+    {tipo: [itens]} de batch_read_objects para {tipo: [ids]}; um lote de
+    BATCH_READ_SIZE por tarefa, então os lotes dos três tipos correm juntos.
+    Sem `properties`, lê as do tipo (OBJECT_TYPES).
+    """
+    futures = [
+        (object_type, pool.submit(metrics.bind(batch_read_objects), object_type, ids[start:start + BATCH_READ_SIZE],
+                                  properties or OBJECT_TYPES[object_type][1]))
+        for object_type, ids in wanted.items()
+        for start in range(0, len(ids), BATCH_READ_SIZE)
+    ]
+    out = {object_type: [] for object_type in wanted}
+    for object_type, f in futures:
+        out[object_type] += f.result()
+    return out
+
+def _from_store(object_type: str, eid: str, row):
+    return OBJECT_TYPES[object_type][0](eid, row["ts"], row["ts_ms"], "", modified_ms=row["modified_ms"],
+                                        text=row["text"])
+
+def _count(outcome: str, n: int):
+    if n:
+        metrics.inc("engagement_records_total", n, help="Engagements entregues pelo fetch, por origem", outcome=outcome)
+
+def fetch_engagements(contact_ids: Iterable[str]) -> dict:
+    """
+    {contact_id: ContactEngagements} para todos os contatos pedidos (vazio
+    quando não há nada associado). Um engagement associado a vários contatos
+    do lote é lido uma vez só e entregue a todos.
+    """
+    ids = list(dict.fromkeys(str(c) for c in contact_ids))
+    out = {cid: ContactEngagements(cid) for cid in ids}
+    if not ids:
+        return out
+    store = engagement_store.STORE_ENABLED
+    records = {t: [] for t in OBJECT_TYPES}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        assoc = {t: pool.submit(metrics.bind(batch_read_associations), "contacts", t, ids) for t in OBJECT_TYPES}
+        owners = {}  # (tipo, id do engagement) -> contatos
+        missing, stale, cached = {}, {}, {}
+        for object_type, f in assoc.items():
+            for cid, eng_ids in f.result().items():
+                for eid in dict.fromkeys(eng_ids):
+                    owners.setdefault((object_type, eid), []).append(cid)
+            unique = [eid for t, eid in owners if t == object_type]
+            cached[object_type] = engagement_store.load(object_type, unique) if store else {}
+            missing[object_type] = [eid for eid in unique if eid not in cached[object_type]]
+            stale[object_type] = [eid for eid, row in cached[object_type].items() if not engagement_store.is_fresh(row)]
+
+        # réplica: os vencidos só conferem hs_lastmodifieddate; o corpo vem só dos que mudaram
+        checked = _read(pool, {t: v for t, v in stale.items() if v}, ["hs_lastmodifieddate"])
+        for object_type, items in checked.items():
+            rows = cached[object_type]
+            changed = {str(i.get("id")) for i in items
+                       if (_modified_ms(i) or 0) > (rows[str(i.get("id"))]["modified_ms"] or 0)}
+            gone = set(stale[object_type]) - {str(i.get("id")) for i in items}  # apagados no HubSpot
+            missing[object_type] += sorted(changed)
+            for eid in changed | gone:
+                rows.pop(eid, None)
+            engagement_store.touch(object_type, set(stale[object_type]) - changed - gone)
+            _count("changed", len(changed))
+
+        fetched = _read(pool, {t: v for t, v in missing.items() if v})
+    for object_type, items in fetched.items():
+        fresh = list(map(OBJECT_TYPES[object_type][0].from_hubspot, items))
+        if store:
+            # limpa uma vez para a réplica; o texto vai junto e os builders não limpam de novo
+            fresh = [replace(r, text=r.clean_text()) for r in fresh]
+            engagement_store.save(object_type, fresh)
+        records[object_type] += fresh
+        _count("fetched", len(fresh))
+    for object_type, rows in cached.items():
+        records[object_type] += [_from_store(object_type, eid, row) for eid, row in rows.items()]
+        _count("store", len(rows))
+
+    for object_type, recs in records.items():
+        for rec in recs:
+            for cid in owners.get((object_type, rec.id), ()):
+                getattr(out[cid], object_type).append(rec)
+    for ce in out.values():
+        ce.sort()
+        for src, n in ce.cap(MAX_PER_TYPE).items():
+            metrics.inc("engagement_truncated_total", n, help="Engagements descartados pelo teto por fonte", source=src)
+            metrics.log_event("engagements.truncated", logging.WARNING, contactId=ce.contact_id, source=src,
+                              dropped=n, kept=MAX_PER_TYPE)
+    return out
+
+def search_records(contact_id: str, src: str, since_ms: Optional[int] = None) -> Iterator:
+    """Modo search: os mesmos registros, buscados (e paginados) sob demanda."""
+    if src == "cooby":
+        return map(Communication.from_hubspot, iter_cooby_comms(contact_id, since_ms))
+    if src == "calls":
+        return map(Call.from_hubspot, iter_contact_calls(contact_id, since_ms))
+    if src == "elephan":
+        return map(Note.from_hubspot, iter_contact_notes(contact_id, since_ms))
+    raise ValueError(f"fonte desconhecida: {src!r}")
@@ -1,162 +1,602 @@
-import os, re, requests, time
+import os, re, html, logging, requests, time, random, threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from itertools import islice
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+import metrics
 
 HUBSPOT_TOKEN = os.getenv("HUBSPOT_TOKEN")
-BASE = "https://api.hubapi.com"
+BASE = os.getenv("HUBSPOT_BASE_URL", "https://api.hubapi.com").rstrip("/")  # outro host: benchmarks/fake_services.py
 HDRS = {"Authorization": f"Bearer {HUBSPOT_TOKEN}", "Content-Type": "application/json"}
 
+# limites do app privado no portal (ver Settings > Integrations > Private apps)
+BURST_LIMIT = int(os.getenv("HUBSPOT_BURST_LIMIT", "100"))      # req por janela de 10 s
+DAILY_LIMIT = int(os.getenv("HUBSPOT_DAILY_LIMIT", "250000"))   # req por dia
+SEARCH_PER_SEC = int(os.getenv("HUBSPOT_SEARCH_PER_SEC", "5"))  # a search API tem limite próprio
+MAX_RETRIES = int(os.getenv("HUBSPOT_MAX_RETRIES", "5"))
+BACKOFF_BASE_S = float(os.getenv("HUBSPOT_BACKOFF_BASE_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("HUBSPOT_BACKOFF_MAX_S", "30"))
+POOL_SIZE = int(os.getenv("HUBSPOT_POOL_SIZE", "20"))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+SEARCH_PAGE_SIZE = 200       # máximo aceito pela search API
+SEARCH_MAX_RESULTS = 10000   # a search API não pagina além disso
+
+# propriedades lidas de cada tipo (search e batch/read)
+COMMUNICATION_PROPERTIES = ["hs_communication_body", "hs_timestamp", "hs_communication_channel_type", "hs_direction",
+                            "hs_lastmodifieddate"]
+CALL_PROPERTIES = [
+    "hs_call_title",
+    "hs_call_outcome",
+    "hs_call_duration",
+    "hs_call_body",       # HTML das observações
+    "hs_call_summary",    # alguns portais
+    "call_summary",       # variação de internal name
+    "hs_timestamp",
+    "hs_lastmodifieddate"
+]
+NOTE_PROPERTIES = ["hs_note_body", "hs_timestamp", "hs_lastmodifieddate"]
+
 COOBY_MSG_RE = re.compile(r"Message text:\s*(.+?)(?:\n|$)", re.IGNORECASE | re.DOTALL)
 ELEPHAN_RE = re.compile(r"por\s+Elephan", re.IGNORECASE)
 
-def search_cooby_comms(contact_id: str, limit: int = 100):
-    url = f"{BASE}/crm/v3/objects/communications/search"
+# ——— cliente HTTP compartilhado: conexões keep-alive, rate limit e retry
+class TokenBucket:
+    """Token bucket thread-safe: até `capacity` fichas, repostas a `rate` por segundo."""
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = float(capacity)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class DailyQuota:
+    """Contador do limite diário; zera na virada do dia (UTC)."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._day = None
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            today = datetime.now(timezone.utc).date()
+            if today != self._day:
+                self._day, self._used = today, 0
+            if self._used >= self.limit:
+                raise RuntimeError(f"[HubSpot] limite diário de {self.limit} requisições atingido")
+            self._used += 1
+
+_burst = TokenBucket(BURST_LIMIT, BURST_LIMIT / 10)
+_search = TokenBucket(SEARCH_PER_SEC, SEARCH_PER_SEC)
+_daily = DailyQuota(DAILY_LIMIT)
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                s.headers.update(HDRS)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+def _retry_after(r) -> float | None:
+    v = r.headers.get("Retry-After")
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(v) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+def _backoff(attempt: int) -> float:
+    # exponencial com jitter ("equal jitter"): metade fixa, metade aleatória
+    cap = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt)
+    return cap / 2 + random.uniform(0, cap / 2)
+
+def hubspot_request(method: str, url: str, idempotent: bool = True, **kwargs) -> requests.Response:
+    """
+    Requisição ao HubSpot pela sessão compartilhada.
+    Respeita os limites (burst, search e diário) e refaz 429/5xx com backoff,
+    usando o Retry-After quando vier. Requisições não idempotentes (criação)
+    só são refeitas em 429, quando o HubSpot garantidamente não processou.
+    Devolve a última resposta; quem chama decide o que é erro.
+    """
+    kwargs.setdefault("timeout", 30)
+    route = _route(url)
+    for attempt in range(MAX_RETRIES + 1):
+        _daily.take()
+        t0 = time.perf_counter()
+        _burst.acquire()
+        if url.endswith("/search"):
+            _search.acquire()
+        t1 = time.perf_counter()
+        try:
+            r = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record_request(route, type(e).__name__, t1 - t0, time.perf_counter() - t1, 0)
+            if not idempotent or attempt == MAX_RETRIES:
+                raise
+            _retry_wait(route, type(e).__name__, attempt, _backoff(attempt))
+            continue
+        _record_request(route, r.status_code, t1 - t0, time.perf_counter() - t1, len(r.content))
+        retriable = r.status_code == 429 or (idempotent and r.status_code in RETRY_STATUS)
+        if not retriable or attempt == MAX_RETRIES:
+            return r
+        wait = _retry_after(r)
+        wait = wait + random.uniform(0, 1) if wait is not None else _backoff(attempt)
+        _retry_wait(route, r.status_code, attempt, wait)
+
+# ".../objects/contacts/123/associations/..." -> ".../objects/contacts/{id}/...":
+# o ID no path viraria uma série de métricas por contato
+_ROUTE_ID_RE = re.compile(r"(/objects/[^/]+/)(?!batch/|search$)[^/?]+")
+
+def _route(url: str) -> str:
+    """Rota para o label `route` das métricas: sem host, query e IDs de objeto."""
+    path = url[len(BASE):] if url.startswith(BASE) else url
+    return _ROUTE_ID_RE.sub(r"\1{id}", path.split("?", 1)[0])
+
+def _record_request(route: str, status, throttle_s: float, elapsed_s: float, nbytes: int):
+    metrics.inc("hubspot_requests_total", help="Requisições ao HubSpot (por tentativa)", route=route, status=status)
+    metrics.inc("hubspot_bytes_total", nbytes, help="Bytes recebidos do HubSpot", route=route)
+    metrics.inc("hubspot_throttle_seconds_total", throttle_s, help="Espera nos rate limits locais")
+    metrics.observe("hubspot_request_seconds", elapsed_s, help="Latência das requisições ao HubSpot", route=route)
+    metrics.add(hubspot_requests=1, hubspot_bytes=nbytes, hubspot_throttle_ms=throttle_s * 1000)
+
+def _retry_wait(route: str, reason, attempt: int, wait_s: float):
+    metrics.inc("hubspot_retries_total", help="Retentativas ao HubSpot", route=route, reason=reason)
+    metrics.add(hubspot_retries=1)
+    metrics.log_event("hubspot.retry", logging.WARNING, route=route, reason=reason,
+                      attempt=attempt + 1, wait_s=round(wait_s, 2))
+    time.sleep(wait_s)
+
+def parse_ts_ms(ts) -> int | None:
+    """hs_timestamp em ms desde epoch; aceita epoch (str/int) ou ISO 8601."""
+    if ts is None or ts == "":
+        return None
+    s = str(ts)
+    if s.isdigit():
+        return int(s)
+    try:
+        return int(datetime.fromisoformat(s.replace("Z", "+00:00")).timestamp() * 1000)
+    except ValueError:
+        return None
+
+def iter_search(object_type: str, filters: list, properties: list, since_ms: int | None = None,
+                page_size: int = SEARCH_PAGE_SIZE, max_items: int | None = None):
+    """
+    Itera a search API do HubSpot do mais recente para o mais antigo,
+    seguindo o cursor paging.next.after. A próxima página só é buscada
+    quando o consumidor pede mais itens, então quem para cedo (orçamento
+    de transcript atingido) não baixa o resto do histórico.
+    O filtro `since_ms` vai no corpo da busca (hs_timestamp GTE).
+    """
+    url = f"{BASE}/crm/v3/objects/{object_type}/search"
+    filters = list(filters)
+    if since_ms:
+        filters.append({"propertyName": "hs_timestamp", "operator": "GTE", "value": str(since_ms)})
     body = {
-        "filterGroups": [{
-            "filters": [
-                {"propertyName": "associations.contact", "operator": "EQ", "value": contact_id},
-                {"propertyName": "hs_communication_body", "operator": "CONTAINS_TOKEN", "value": "Cooby.co"}
-            ]
-        }],
-        "properties": ["hs_communication_body","hs_timestamp","hs_communication_channel_type","hs_direction"],
-        "limit": limit,
+        "filterGroups": [{"filters": filters}],
+        "properties": properties,
+        "limit": page_size,
         "sorts": [{"propertyName": "hs_timestamp", "direction": "DESCENDING"}]
     }
-    r = requests.post(url, headers=HDRS, json=body, timeout=30)
-    r.raise_for_status()
-    return r.json().get("results", [])
+    max_items = min(max_items or SEARCH_MAX_RESULTS, SEARCH_MAX_RESULTS)
+    n = 0
+    while True:
+        r = hubspot_request("POST", url, json=body)
+        r.raise_for_status()
+        data = r.json()
+        for item in data.get("results", []):
+            yield item
+            n += 1
+            if n >= max_items:
+                return
+        after = ((data.get("paging") or {}).get("next") or {}).get("after")
+        if not after:
+            return
+        body["after"] = after
+
+def iter_cooby_comms(contact_id: str, since_ms: int | None = None, page_size: int = 100):
+    return iter_search(
+        "communications",
+        [
+            {"propertyName": "associations.contact", "operator": "EQ", "value": str(contact_id)},
+            {"propertyName": "hs_communication_body", "operator": "CONTAINS_TOKEN", "value": "Cooby.co"}
+        ],
+        COMMUNICATION_PROPERTIES,
+        since_ms, page_size,
+    )
+
+def search_cooby_comms(contact_id: str, limit: int | None = None, since_ms: int | None = None):
+    return list(islice(iter_cooby_comms(contact_id, since_ms), limit))
 
-def build_elephan_block(note_results, since_ms: int | None = None) -> str:
+def mark_truncated(report: dict | None, record, kept: int):
+    """Anota em `report` (dos builders) onde o orçamento de caracteres cortou o histórico."""
+    if report is not None:
+        report.update(kept=kept, oldest_kept_ts=record.ts, oldest_kept_ms=record.ts_ms)
+
+def build_elephan_block(note_results, since_ms: int | None = None, max_chars: int | None = None,
+                        report: dict | None = None) -> str:
     """
-    Junta todas as notas que parecem ser resumos da Elephan
-    (contêm 'por Elephan') em um texto único.
+    Junta todas as notas (engagements.Note) que parecem ser resumos da
+    Elephan (contêm 'por Elephan') em um texto único.
+    Com `max_chars`, para de consumir `note_results` (mais recentes primeiro)
+    assim que o orçamento do texto é atingido e anota o corte em `report`.
     """
     blocks = []
+    size = 0
     for r in note_results:
-        p = r.get("properties") or {}
-        ts = p.get("hs_timestamp")
-        if since_ms and ts and int(ts) < since_ms:
+        if since_ms and r.ts_ms and r.ts_ms < since_ms:
             continue
-        body = p.get("hs_note_body") or ""
-        txt = strip_html(body)
+        txt = r.clean_text()
         if txt and ELEPHAN_RE.search(txt):
-            blocks.append(f"[{ts}]\n{txt}")
+            blocks.append(f"[{r.ts}]\n{txt}")
+            size += len(blocks[-1])
+            if max_chars and size >= max_chars:
+                mark_truncated(report, r, len(blocks))
+                break
     blocks.sort()
     return "\n\n".join(blocks)
 
 def extract_message_text(body: str):
     if not body:
         return None
-    txt = re.sub(r"<br\s*/?>", "\n", body, flags=re.IGNORECASE)
-    txt = re.sub(r"<.*?>", "", txt)
+    txt = html_to_text(body)
     m = COOBY_MSG_RE.search(txt)
     return m.group(1).strip() if m else None
 
-def create_note(contact_id: str, html: str) -> str:
-    # cria a nota e associa ao contato (v3 textual; com fallback v4 se precisar)
-    # inclui hs_timestamp requerido
-    url = f"{BASE}/crm/v3/objects/notes"
-    now_ms = int(time.time() * 1000)
-    payload = {"properties": {"hs_note_body": html, "hs_timestamp": now_ms}}
-    r = requests.post(url, headers=HDRS, json=payload, timeout=30)
+NOTE_TO_CONTACT = [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 202}]
+NOTE_BATCH_SIZE = 100  # máximo do batch/create
+
+_INLINE_UNSUPPORTED_RE = re.compile(
+    r"associations?\W+(?:\w+\W+){0,3}?(?:not (?:supported|allowed)|unsupported)"
+    r"|(?:unrecognized|unknown|unexpected) (?:field|property)\W+\W*associations",
+    re.I,
+)
+# como o portal aceita associar notas: "inline" (no próprio batch/create) ou
+# "v4" (criar e depois associar em lote). Descoberto na primeira gravação.
+_note_assoc_mode = None
+
+def _note_ids_from_batch(items: list, data: dict) -> list:
+    """IDs na ordem de `items`, casando pelo objectWriteTraceId (ou corpo + timestamp)."""
+    by_trace, by_body = {}, {}
+    for res in data.get("results", []):
+        props = res.get("properties") or {}
+        if res.get("objectWriteTraceId") is not None:
+            by_trace[str(res["objectWriteTraceId"])] = res.get("id")
+        by_body[(props.get("hs_note_body"), parse_ts_ms(props.get("hs_timestamp")))] = res.get("id")
+    return [by_trace.get(str(i)) or by_body.get((html_body, ts)) for i, (_, html_body, ts) in enumerate(items)]
+
+def _batch_create_notes(items: list, inline_assoc: bool) -> list:
+    inputs = []
+    for i, (contact_id, html_body, ts) in enumerate(items):
+        inp = {"objectWriteTraceId": str(i), "properties": {"hs_note_body": html_body, "hs_timestamp": ts}}
+        if inline_assoc:
+            inp["associations"] = [{"to": {"id": str(contact_id)}, "types": NOTE_TO_CONTACT}]
+        inputs.append(inp)
+    return hubspot_request("POST", f"{BASE}/crm/v3/objects/notes/batch/create", idempotent=False,
+                           json={"inputs": inputs})
+
+def _inline_assoc_unsupported(r: requests.Response) -> bool:
+    # só a recusa do campo "associations" em si muda o modo; contato
+    # inexistente ou propriedade inválida também voltam 400, mas são do item
+    return r.status_code == 400 and bool(_INLINE_UNSUPPORTED_RE.search(r.text or ""))
+
+def _archive_notes(note_ids: list):
+    r = hubspot_request("POST", f"{BASE}/crm/v3/objects/notes/batch/archive",
+                        json={"inputs": [{"id": nid} for nid in note_ids]})
+    if r.status_code >= 300:
+        metrics.log_event("hubspot.note_archive_error", logging.ERROR, notes=note_ids, status=r.status_code,
+                          error=r.text[:500])
+
+def _create_chunk(chunk: list) -> tuple:
+    """(IDs na ordem de `chunk`, None) ou (None, resposta do erro)."""
+    global _note_assoc_mode
+    if _note_assoc_mode != "v4":
+        r = _batch_create_notes(chunk, inline_assoc=True)
+        if r.status_code < 300:
+            _note_assoc_mode = "inline"
+            return _note_ids_from_batch(chunk, r.json()), None
+        if _note_assoc_mode == "inline" or not _inline_assoc_unsupported(r):
+            return None, r
+        _note_assoc_mode = "v4"  # portal sem associação inline: não tenta mais
+    r = _batch_create_notes(chunk, inline_assoc=False)
     if r.status_code >= 300:
-        raise RuntimeError(f"[CreateNote] {r.status_code} {r.text}")
-    note_id = r.json().get("id")
-    assoc_url = f"{BASE}/crm/v3/objects/notes/{note_id}/associations/contacts/{contact_id}/note_to_contact"
-    assoc = requests.put(assoc_url, headers=HDRS, timeout=30)
-    if assoc.status_code == 404:
-        v4_url = f"{BASE}/crm/v4/objects/notes/{note_id}/associations/contacts/{contact_id}"
-        body = {"inputs": [{"types": [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 202}]}]}
-        assoc = requests.post(v4_url, headers=HDRS, json=body, timeout=30)
-    if assoc.status_code >= 300:
-        raise RuntimeError(f"[AssociateNote] {assoc.status_code} {assoc.text}")
+        return None, r
+    chunk_ids = _note_ids_from_batch(chunk, r.json())
+    assoc_inputs = [
+        {"from": {"id": nid}, "to": {"id": str(c)}, "types": NOTE_TO_CONTACT}
+        for nid, (c, _, _) in zip(chunk_ids, chunk) if nid
+    ]
+    if assoc_inputs:
+        assoc = hubspot_request("POST", f"{BASE}/crm/v4/associations/notes/contacts/batch/create",
+                                json={"inputs": assoc_inputs})
+        if assoc.status_code >= 300:
+            # nota sem contato não fica para trás: a retentativa criaria outra
+            _archive_notes([nid for nid in chunk_ids if nid])
+            return None, assoc
+    return chunk_ids, None
+
+def _rejected(r: requests.Response) -> bool:
+    # erro do conteúdo do lote (e não de autenticação, limite ou servidor)
+    return 400 <= r.status_code < 500 and r.status_code not in (401, 403, 429)
+
+def create_notes(items: list) -> list:
+    """
+    Cria várias notas (de um ou vários contatos) já associadas aos contatos,
+    em lotes de NOTE_BATCH_SIZE. `items`: [(contact_id, html), ...].
+    Devolve os IDs na mesma ordem; nota que o HubSpot rejeitou vem como None.
+    Lote recusado pelo conteúdo é refeito por contato, para que um contato
+    inválido não leve junto as notas dos outros.
+    """
+    ids = []
+    for start in range(0, len(items), NOTE_BATCH_SIZE):
+        # hs_timestamp é obrigatório; único no lote para casar resposta -> item
+        now_ms = int(time.time() * 1000)
+        chunk = [(c, h, now_ms + i) for i, (c, h) in enumerate(items[start:start + NOTE_BATCH_SIZE])]
+        chunk_ids, err = _create_chunk(chunk)
+        if err is not None:
+            if not _rejected(err):
+                raise RuntimeError(f"[CreateNote] {err.status_code} {err.text}")
+            by_contact = {}
+            for pos, item in enumerate(chunk):
+                by_contact.setdefault(str(item[0]), []).append(pos)
+            chunk_ids = [None] * len(chunk)
+            for contact_id, positions in by_contact.items():
+                part = [chunk[p] for p in positions]
+                part_ids, part_err = _create_chunk(part) if len(by_contact) > 1 else (None, err)
+                if part_err is not None:
+                    if not _rejected(part_err):
+                        raise RuntimeError(f"[CreateNote] {part_err.status_code} {part_err.text}")
+                    metrics.log_event("hubspot.note_rejected", logging.WARNING, contactId=contact_id,
+                                      notes=len(part), status=part_err.status_code, error=part_err.text[:500])
+                    continue
+                for p, nid in zip(positions, part_ids):
+                    chunk_ids[p] = nid
+        ids += chunk_ids
+    return ids
+
+class NoteWriter:
+    """
+    Acumula notas e grava tudo em lote com create_notes.
+    add() devolve um Future com o ID da nota; flush() grava o que estiver
+    pendente, inclusive notas adicionadas por outras threads (quem chega
+    com a fila vazia só espera o próprio Future resolver).
+    """
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, contact_id: str, html_body: str) -> Future:
+        f = Future()
+        with self._lock:
+            self._pending.append((contact_id, html_body, f))
+        return f
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            ids = create_notes([(c, h) for c, h, _ in batch])
+        except Exception as e:
+            for _, _, f in batch:
+                f.set_exception(e)
+            return
+        for note_id, (_, _, f) in zip(ids, batch):
+            if note_id:
+                f.set_result(note_id)
+            else:
+                f.set_exception(RuntimeError("[CreateNote] nota rejeitada no batch/create"))
+
+def create_note(contact_id: str, html: str) -> str:
+    # cria a nota já associada ao contato (uma requisição; ver create_notes)
+    note_id = create_notes([(contact_id, html)])[0]
+    if not note_id:
+        raise RuntimeError("[CreateNote] nota rejeitada no batch/create")
     return note_id
 
-def search_contact_calls(contact_id: str, limit: int = 50):
+ASSOC_BATCH_SIZE = 1000  # máximo do batch/read de associações v4
+ASSOC_PAGE_SIZE = 500    # associações por objeto em cada página (v4)
+BATCH_READ_SIZE = 100    # máximo do batch/read de objetos v3
+
+def _to_ids(items) -> list:
+    return [str(t["toObjectId"]) for t in items or [] if t.get("toObjectId") is not None]
+
+def _next_after(data: dict) -> str | None:
+    return ((data.get("paging") or {}).get("next") or {}).get("after")
+
+def batch_read_associations(from_type: str, to_type: str, ids) -> dict:
+    """
+    Associações de vários objetos de uma vez (v4 batch/read), em lotes de
+    ASSOC_BATCH_SIZE: {id de origem: [ids de destino]}. Objeto sem
+    associação fica de fora (o HubSpot responde 207 com o erro dele).
+    Quem passa de ASSOC_PAGE_SIZE associações tem o resto lido pela rota
+    por objeto, seguindo paging.next.after.
+    """
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    url = f"{BASE}/crm/v4/associations/{from_type}/{to_type}/batch/read"
+    out = {}
+    for start in range(0, len(ids), ASSOC_BATCH_SIZE):
+        r = hubspot_request("POST", url, json={"inputs": [{"id": i} for i in ids[start:start + ASSOC_BATCH_SIZE]]})
+        if r.status_code not in (200, 207):
+            raise RuntimeError(f"[Associations] {r.status_code} {r.text}")
+        for res in r.json().get("results", []):
+            from_id = str((res.get("from") or {}).get("id"))
+            to = _to_ids(res.get("to"))
+            after = _next_after(res)
+            while after:
+                page = hubspot_request("GET", f"{BASE}/crm/v4/objects/{from_type}/{from_id}/associations/{to_type}",
+                                       params={"limit": ASSOC_PAGE_SIZE, "after": after})
+                if page.status_code != 200:
+                    raise RuntimeError(f"[Associations] {page.status_code} {page.text}")
+                data = page.json()
+                to += _to_ids(data.get("results"))
+                after = _next_after(data)
+            if to:
+                out.setdefault(from_id, []).extend(to)
+    return out
+
+def batch_read_objects(object_type: str, ids, properties: list) -> list:
+    """
+    Propriedades de vários objetos de um tipo (v3 batch/read), em lotes de
+    BATCH_READ_SIZE. IDs que não existem mais (207) ficam de fora.
+    """
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    url = f"{BASE}/crm/v3/objects/{object_type}/batch/read"
+    out = []
+    for start in range(0, len(ids), BATCH_READ_SIZE):
+        body = {"properties": properties, "inputs": [{"id": i} for i in ids[start:start + BATCH_READ_SIZE]]}
+        r = hubspot_request("POST", url, json=body)
+        if r.status_code not in (200, 207):
+            raise RuntimeError(f"[BatchRead] {r.status_code} {r.text}")
+        out += r.json().get("results", [])
+    return out
+
+def iter_contact_calls(contact_id: str, since_ms: int | None = None, page_size: int = 50):
     """
-    Busca chamadas (calls) associadas ao contato.
+    Itera as chamadas (calls) associadas ao contato.
     Tenta trazer 'hs_call_summary' ou 'call_summary' (se existirem) e cai para 'hs_call_body'.
     """
-    url = f"{BASE}/crm/v3/objects/calls/search"
-    body = {
-        "filterGroups": [{
-            "filters": [
-                {"propertyName": "associations.contact", "operator": "EQ", "value": str(contact_id)}
-            ]
-        }],
-        "properties": [
-            "hs_call_title",
-            "hs_call_outcome",
-            "hs_call_duration",
-            "hs_call_body",       # HTML das observações
-            "hs_call_summary",    # alguns portais
-            "call_summary",       # variação de internal name
-            "hs_timestamp"
-        ],
-        "limit": limit,
-        "sorts": [{"propertyName": "hs_timestamp", "direction": "DESCENDING"}]
-    }
-    r = requests.post(url, headers=HDRS, json=body, timeout=30)
-    r.raise_for_status()
-    return r.json().get("results", [])
+    return iter_search(
+        "calls",
+        [{"propertyName": "associations.contact", "operator": "EQ", "value": str(contact_id)}],
+        CALL_PROPERTIES,
+        since_ms, page_size,
+    )
+
+def search_contact_calls(contact_id: str, limit: int | None = None, since_ms: int | None = None):
+    """Busca chamadas (calls) associadas ao contato, com todas as páginas."""
+    return list(islice(iter_contact_calls(contact_id, since_ms), limit))
 
-def search_contact_notes(contact_id: str, limit: int = 50):
+def iter_contact_notes(contact_id: str, since_ms: int | None = None, page_size: int = 50):
     """
-    Busca notas (engagements NOTE) associadas ao contato.
+    Itera as notas (engagements NOTE) associadas ao contato.
     Usaremos para encontrar os resumos de reunião da Elephan.
     """
-    url = f"{BASE}/crm/v3/objects/notes/search"
-    body = {
-        "filterGroups": [{
-            "filters": [
-                {"propertyName": "associations.contact", "operator": "EQ", "value": str(contact_id)}
-            ]
-        }],
-        "properties": ["hs_note_body", "hs_timestamp"],
-        "limit": limit,
-        "sorts": [{"propertyName": "hs_timestamp", "direction": "DESCENDING"}]
-    }
-    r = requests.post(url, headers=HDRS, json=body, timeout=30)
-    r.raise_for_status()
-    return r.json().get("results", [])
-
-
-# ——— limpeza do HTML do summary para texto simples com bullets
-_RE_BR   = re.compile(r"<br\s*/?>", re.I)
-_RE_LI_1 = re.compile(r"\s*<li>\s*", re.I)
-_RE_LI_2 = re.compile(r"\s*</li>\s*", re.I)
-_RE_UL_OL = re.compile(r"</?(ul|ol)\s*[^>]*>", re.I)
-_RE_H = re.compile(r"</?h[1-6]\s*[^>]*>", re.I)
-_RE_B = re.compile(r"</?b\s*[^>]*>", re.I)
-_RE_I = re.compile(r"</?i\s*[^>]*>", re.I)
-_RE_HR = re.compile(r"<hr\s*[^>]*>", re.I)
-_RE_TAGS = re.compile(r"<[^>]+>", re.I | re.S)
+    return iter_search(
+        "notes",
+        [{"propertyName": "associations.contact", "operator": "EQ", "value": str(contact_id)}],
+        NOTE_PROPERTIES,
+        since_ms, page_size,
+    )
+
+def search_contact_notes(contact_id: str, limit: int | None = None, since_ms: int | None = None):
+    """Busca notas associadas ao contato, com todas as páginas."""
+    return list(islice(iter_contact_notes(contact_id, since_ms), limit))
+
+# ——— HTML -> texto sem regex encadeadas (usado por strip_html, clean_call_summary_html,
+# extract_message_text e, via strip_html, build_elephan_block)
+_HTML_TOKEN_RE = re.compile(
+    r"<(?:(?P<br>br\b)|(?P<li>li\b)|(?P<endli>/li\b)|(?P<block>/?(?:ul|ol|h[1-6])\b|hr\b))?[^<>]*>",
+    re.I,
+)
+_BR_RE = re.compile(r"<br\b[^<>]*>", re.I)
+_TAG_RE = re.compile(r"<[^<>]*>")
+
+def _decode(text: str) -> str:
+    if "&" not in text:
+        return text
+    return html.unescape(text).replace("\xa0", " ")
+
+def _rstrip_since(out: list, floor: int):
+    # apaga espaços no fim de `out`, sem passar de `floor` (onde houve uma tag)
+    while len(out) > floor:
+        last = out[-1].rstrip()
+        if last:
+            out[-1] = last
+            return
+        out.pop()
+
+def html_to_text(html_text: str, bullets: bool = False) -> str:
+    """
+    Converte HTML em texto em tempo linear. <br> vira quebra de linha, as demais tags somem e as entidades
+    (&amp;, &nbsp; ...) são decodificadas no fim. Com `bullets`, como no
+    'Call summary': <li> -> "- " (engolindo os espaços/quebras em volta,
+    como o antigo \s*<li>\s*), </li>, <ul>/<ol>, <h1..6> e <hr> -> quebra
+    de linha. Não normaliza linhas; veja _tidy_lines.
+    """
+    if not bullets:
+        # duas substituições por string fixa rodam em C; split + lista (ou um
+        # callable por tag) custavam mais que a regex antiga
+        return _decode(_TAG_RE.sub("", _BR_RE.sub("\n", html_text)))
+    out = []
+    li_floor = endli_floor = 0  # até onde <li> / </li> podem apagar espaços para trás
+    eat_ws = False              # depois de <li> / </li>: apaga espaços à frente
+    pos = 0
+    for m in _HTML_TOKEN_RE.finditer(html_text):
+        start = m.start()
+        if start > pos:
+            text = html_text[pos:start]
+            if eat_ws:
+                text = text.lstrip()
+                eat_ws = not text
+            if text:
+                out.append(text)
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "br":
+            if not eat_ws:
+                out.append("\n")
+        elif kind == "li":
+            _rstrip_since(out, li_floor)
+            out.append("- ")
+            li_floor = len(out)
+            eat_ws = True
+        elif kind == "endli":
+            _rstrip_since(out, endli_floor)
+            out.append("\n")
+            li_floor = endli_floor = len(out)
+            eat_ws = True
+        else:
+            if kind == "block":
+                out.append("\n")
+            li_floor = endli_floor = len(out)
+            eat_ws = False
+    if pos < len(html_text):
+        text = html_text[pos:]
+        out.append(text.lstrip() if eat_ws else text)
+    return _decode("".join(out))
+
+def _tidy_lines(text: str) -> str:
+    return "\n".join(filter(None, map(str.strip, text.splitlines())))
 
 def strip_html(text: str) -> str:
     """Remove tags HTML simples (para hs_call_body)."""
     if not text:
         return ""
-    t = re.sub(r"<br\s*/?>", "\n", text, flags=re.IGNORECASE)
-    t = re.sub(r"<.*?>", "", t)
-    lines = [ln.strip() for ln in t.splitlines()]
-    lines = [ln for ln in lines if ln]
-    return "\n".join(lines)
+    return _tidy_lines(html_to_text(text))
 
-def clean_call_summary_html(html: str) -> str:
+def clean_call_summary_html(html_text: str) -> str:
     """
     Converte HTML do 'Call summary' para texto legível:
     - <li> -> "- ..."
     - remove <hr>, estilos e tags restantes
     """
-    if not html:
+    if not html_text:
         return ""
-    t = _RE_BR.sub("\n", html)
-    t = _RE_LI_1.sub("- ", t)
-    t = _RE_LI_2.sub("\n", t)
-    t = _RE_UL_OL.sub("\n", t)
-    t = _RE_H.sub("\n", t)
-    t = _RE_B.sub("", t)
-    t = _RE_I.sub("", t)
-    t = _RE_HR.sub("\n", t)
-    t = _RE_TAGS.sub("", t)
-    lines = [ln.strip() for ln in t.splitlines()]
-    lines = [ln for ln in lines if ln]
-    return "\n".join(lines)
+    return _tidy_lines(html_to_text(html_text, bullets=True))
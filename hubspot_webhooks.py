@@ -0,0 +1,139 @@
+# hubspot_webhooks.py
+"""
+Ingestão dos webhooks do HubSpot (app com assinaturas object.creation de
+communications, calls e notes, e object.associationChange):
+
+1. valida a assinatura v3 (HMAC-SHA256 com o client secret do app);
+2. engagements novos são juntados por WEBHOOK_RESOLVE_WINDOW_S e resolvidos
+   para contatos num batch/read de associações v4 por tipo;
+3. cada contato entra num debounce de WEBHOOK_DEBOUNCE_S (no máximo
+   WEBHOOK_MAX_WAIT_S desde o primeiro evento): 40 mensagens do Cooby em
+   sequência viram um único recálculo;
+4. no disparo, o pipeline incremental é enfileirado em job_queue.
+
+O debounce é em memória (scheduler.Debouncer); o job, uma vez enfileirado,
+fica persistido.
+"""
+import os, time, hmac, base64, hashlib, threading
+from urllib.parse import unquote
+
+import metrics
+import job_queue
+from scheduler import Debouncer
+
+CLIENT_SECRET = os.getenv("HUBSPOT_CLIENT_SECRET")
+WEBHOOK_MAX_AGE_S = int(os.getenv("WEBHOOK_MAX_AGE_S", "300"))  # HubSpot recomenda 5 min
+WEBHOOK_DEBOUNCE_S = float(os.getenv("WEBHOOK_DEBOUNCE_S", "60"))
+WEBHOOK_MAX_WAIT_S = float(os.getenv("WEBHOOK_MAX_WAIT_S", "300"))
+WEBHOOK_RESOLVE_WINDOW_S = float(os.getenv("WEBHOOK_RESOLVE_WINDOW_S", "2"))
+
+# objectTypeId -> nome usado nas APIs CRM
+ENGAGEMENT_TYPES = {"0-18": "communications", "0-48": "calls", "0-46": "notes"}
+CONTACT_TYPE = "0-1"
+
+# recálculo disparado por webhook: só o delta desde o watermark, sem nota repetida
+JOB_OPTIONS = {
+    "parallel": True,
+    "create_note_flag": True,
+    "since_ms": None,
+    "use_cache": True,
+    "skip_unchanged_notes": True,
+    "incremental": True,
+    "llm_mode": os.getenv("WEBHOOK_LLM_MODE", "per_source"),
+}
+
+# caracteres que o HubSpot decodifica na URI antes de assinar
+_URI_DECODE = ("%3A", "%2F", "%3F", "%40", "%21", "%24", "%27", "%28", "%29", "%2A", "%2C", "%3B")
+
+def _decode_uri(uri: str) -> str:
+    for enc in _URI_DECODE:
+        uri = uri.replace(enc, unquote(enc)).replace(enc.lower(), unquote(enc))
+    return uri
+
+def valid_signature(method: str, uri: str, body: bytes, timestamp: str | None, signature: str | None,
+                    secret: str | None = None, now_ms: int | None = None) -> bool:
+    """X-HubSpot-Signature-v3: base64(HMAC-SHA256(secret, método + URI + corpo + timestamp))."""
+    secret = secret or CLIENT_SECRET
+    if not (secret and timestamp and signature):
+        return False
+    try:
+        age_ms = (now_ms or int(time.time() * 1000)) - int(timestamp)
+    except ValueError:
+        return False
+    if age_ms > WEBHOOK_MAX_AGE_S * 1000:
+        return False
+    raw = method.upper().encode() + _decode_uri(uri).encode() + body + timestamp.encode()
+    expected = base64.b64encode(hmac.new(secret.encode(), raw, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+def parse_events(events: list) -> tuple[dict, set]:
+    """({tipo de engagement: {ids}}, {contatos já conhecidos pelo evento})."""
+    engagements, contacts = {}, set()
+    for ev in events if isinstance(events, list) else []:
+        sub = ev.get("subscriptionType") or ""
+        if sub.endswith(".creation"):
+            object_type = ENGAGEMENT_TYPES.get(str(ev.get("objectTypeId")))
+            if object_type and ev.get("objectId") is not None:
+                engagements.setdefault(object_type, set()).add(str(ev["objectId"]))
+        elif sub.endswith(".associationChange") and not ev.get("associationRemoved"):
+            ends = {str(ev.get("fromObjectTypeId")): ev.get("fromObjectId"),
+                    str(ev.get("toObjectTypeId")): ev.get("toObjectId")}
+            if CONTACT_TYPE in ends and ends.keys() & ENGAGEMENT_TYPES.keys() and ends[CONTACT_TYPE] is not None:
+                contacts.add(str(ends[CONTACT_TYPE]))
+    return engagements, contacts
+
+# ——— debounce: engagements -> contatos -> job
+_lock = threading.Lock()
+_resolver = None
+_contacts = None
+
+def _resolve(object_type: str, batches: list):
+    from hubspot_client import batch_read_associations
+
+    ids = set().union(*batches)
+    for contact_ids in batch_read_associations(object_type, "contacts", ids).values():
+        for cid in contact_ids:
+            touch_contact(cid)
+
+def _fire(contact_id: str, events: list):
+    # chave única por disparo: a janela de idempotência da fila não pode
+    # engolir um recálculo legítimo minutos depois do anterior
+    job, created = job_queue.enqueue(contact_id, JOB_OPTIONS, key=f"webhook:{contact_id}:{time.time_ns()}")
+    if not created and job["status"] == "running":
+        # o job em execução pode já ter lido o HubSpot antes destes eventos
+        touch_contact(contact_id)
+        return
+    metrics.inc("webhook_recomputes_total", help="Recálculos disparados por webhook",
+                outcome="enqueued" if created else "coalesced")
+    metrics.log_event("webhook.fire", contactId=contact_id, events=len(events), jobId=job["jobId"], created=created)
+
+def _debouncers() -> tuple[Debouncer, Debouncer]:
+    global _resolver, _contacts
+    with _lock:
+        if _contacts is None:
+            _contacts = Debouncer(WEBHOOK_DEBOUNCE_S, _fire, WEBHOOK_MAX_WAIT_S, name="webhook-contacts")
+            _resolver = Debouncer(WEBHOOK_RESOLVE_WINDOW_S, _resolve, WEBHOOK_RESOLVE_WINDOW_S * 5,
+                                  name="webhook-resolve")
+            metrics.register_gauge("webhook_pending_contacts", "Contatos aguardando o debounce", _contacts.pending)
+        return _resolver, _contacts
+
+def touch_contact(contact_id: str):
+    _debouncers()[1].touch(str(contact_id), 1)
+
+def ingest(events: list) -> dict:
+    """Registra um lote de eventos do webhook e devolve o que foi aproveitado."""
+    resolver, _ = _debouncers()
+    engagements, contacts = parse_events(events)
+    for object_type, ids in engagements.items():
+        resolver.touch(object_type, ids)
+    for cid in contacts:
+        touch_contact(cid)
+    n = len(events) if isinstance(events, list) else 0
+    metrics.inc("webhook_events_total", n, help="Eventos recebidos no webhook")
+    return {"events": n, "engagements": sum(map(len, engagements.values())), "contacts": len(contacts)}
+
+def flush():
+    """Resolve e dispara tudo que está pendente agora (desligamento, testes)."""
+    resolver, contacts = _debouncers()
+    resolver.flush()
+    contacts.flush()
@@ -1,7 +1,44 @@
-import os, json
-from openai import OpenAI
+import os, re, json, time, logging, threading
+from concurrent.futures import ThreadPoolExecutor
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import insights_cache
+import metrics
+
+# o SDK já refaz 429/5xx com backoff (respeitando retry-after); o semáforo
+# limita quantas chamadas ficam em voo no processo (batch + threads da API)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+MODEL = os.getenv("OPENAI_MODEL", "gpt-5-mini")  # ou gpt-4o-mini
+
+# transcripts acima do orçamento viram map-reduce: trechos resumidos em
+# paralelo no mesmo schema e depois consolidados
+CHUNK_MAX_TOKENS = int(os.getenv("INSIGHTS_CHUNK_MAX_TOKENS", "12000"))
+CHUNKS_IN_FLIGHT = int(os.getenv("INSIGHTS_CHUNKS_IN_FLIGHT", "4"))
+# histórico que uma fonte pode levar ao modelo, em trechos do map (acima
+# disso os mais antigos são cortados, com aviso): define os tetos dos
+# builders (INSIGHTS_MAX_TRANSCRIPT_CHARS) e da compactação
+MAX_CHUNKS_PER_SOURCE = int(os.getenv("INSIGHTS_MAX_CHUNKS_PER_SOURCE", "8"))
+CHARS_PER_TOKEN = 4  # aproximação para pt-BR; evita depender de tokenizer
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+def get_client():
+    """
+    Cliente OpenAI do processo, criado na primeira chamada ao modelo: o import
+    do SDK é a parte mais cara do cold start e resposta vinda do cache nem
+    precisa dele. Invocações quentes reaproveitam o mesmo cliente (e conexões).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                # OPENAI_BASE_URL aponta para outro endpoint compatível (ex.: benchmarks/fake_services.py)
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL") or None,
+                                 max_retries=OPENAI_MAX_RETRIES)
+    return _client
 
 SYSTEM_INSTRUCTIONS = (
     "Analista de vendas. Responda apenas JSON válido em pt-BR."
@@ -19,22 +56,193 @@ SCHEMA_EXEMPLO = {
   "top_snippets": ["cliente: 'temos orçamento'"]
 }
 
-def generate_insights_from_transcript(text: str) -> dict:
-    prompt = (
+# instruções do reduce (map-reduce) por tipo de geração
+TRANSCRIPT_REDUCE = "Consolide-os em um insight único do contato; o que é mais recente prevalece."
+TRIPLE_REDUCE = ("Consolide e cruze as informações das fontes, gerando um insight único. "
+                 "Destaque divergências, objeções importantes e próximos passos.")
+DELTA_REDUCE = ("Consolide-os em um insight único só destas interações novas; o que é mais recente prevalece. "
+                "Preserve números, objeções, sinais e próximos passos citados.")
+
+# início de mensagem/bloco nos transcripts: linha que começa com "[timestamp]"
+_UNIT_START_RE = re.compile(r"(?<=\n)(?=\[[^\]\n]*\])")
+
+def chat_request(prompt: str) -> dict:
+    """Parâmetros do chat.completions.create (também o corpo das linhas da Batch API)."""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": {"type": "json_object"},
+    }
+
+def cache_key(prompt: str) -> str:
+    return insights_cache.content_hash(MODEL, SYSTEM_INSTRUCTIONS, SCHEMA_EXEMPLO, prompt)
+
+def chat_json(prompt: str, use_cache: bool = True, usage: list | None = None) -> dict:
+    """
+    Chamada ao modelo pedindo JSON; respeita o limite de concorrência.
+    Com cache, o mesmo prompt (mesmo modelo/instruções/schema) não vai ao modelo de novo.
+    Se `usage` for passado, recebe os tokens gastos nesta chamada.
+    """
+    use_cache = use_cache and insights_cache.CACHE_ENABLED
+    if use_cache:
+        key = cache_key(prompt)
+        cached = insights_cache.get(key)
+        metrics.inc("llm_cache_total", help="Consultas ao cache de LLM", result="hit" if cached is not None else "miss")
+        metrics.add(**{"cache_hits" if cached is not None else "cache_misses": 1})
+        if cached is not None:
+            if usage is not None:
+                usage.append({"prompt_tokens": 0, "completion_tokens": 0, "cached": True})
+            return cached
+    t0 = time.perf_counter()
+    with _slots:
+        t1 = time.perf_counter()
+        try:
+            raw = get_client().chat.completions.with_raw_response.create(**chat_request(prompt))
+        except Exception as e:
+            metrics.inc("openai_requests_total", help="Chamadas ao modelo", model=MODEL, outcome=type(e).__name__)
+            metrics.log_event("openai.error", logging.ERROR, model=MODEL, error=str(e)[:500])
+            raise
+        resp = raw.parse()
+    _record_call(resp.usage, getattr(raw, "retries_taken", 0), t1 - t0, time.perf_counter() - t1)
+    if usage is not None:
+        u = resp.usage
+        usage.append({
+            "prompt_tokens": getattr(u, "prompt_tokens", None),
+            "completion_tokens": getattr(u, "completion_tokens", None),
+            "cached": False,
+        })
+    result = json.loads(resp.choices[0].message.content)
+    if use_cache:
+        insights_cache.put(key, result)
+    return result
+
+def _record_call(u, retries: int, queue_s: float, elapsed_s: float):
+    prompt_tokens = getattr(u, "prompt_tokens", None) or 0
+    completion_tokens = getattr(u, "completion_tokens", None) or 0
+    metrics.inc("openai_requests_total", help="Chamadas ao modelo", model=MODEL, outcome="ok")
+    metrics.inc("openai_retries_total", retries, help="Retentativas feitas pelo SDK da OpenAI", model=MODEL)
+    metrics.inc("openai_tokens_total", prompt_tokens, help="Tokens gastos", model=MODEL, kind="prompt")
+    metrics.inc("openai_tokens_total", completion_tokens, help="Tokens gastos", model=MODEL, kind="completion")
+    metrics.observe("openai_queue_seconds", queue_s, help="Espera por vaga (OPENAI_MAX_CONCURRENCY)")
+    metrics.observe("openai_request_seconds", elapsed_s, help="Latência das chamadas ao modelo", model=MODEL)
+    metrics.add(openai_requests=1, openai_retries=retries, openai_queue_ms=queue_s * 1000,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    metrics.log_event("openai.call", logging.DEBUG, model=MODEL, prompt_tokens=prompt_tokens,
+                      completion_tokens=completion_tokens, retries=retries, ms=round(elapsed_s * 1000, 1))
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_transcript(text: str, max_tokens: int = CHUNK_MAX_TOKENS) -> list:
+    """
+    Quebra um transcript (saída de build_cooby_transcript /
+    build_calls_summary_block / build_elephan_block) em trechos de até
+    `max_tokens`, sempre em fronteira de mensagem/bloco "[timestamp]".
+    Um bloco sozinho maior que o orçamento é quebrado por linhas.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    units = []
+    for unit in _UNIT_START_RE.split(text.strip()):
+        while len(unit) > max_chars:
+            cut = unit.rfind("\n", 0, max_chars) + 1 or max_chars
+            units.append(unit[:cut])
+            unit = unit[cut:]
+        if unit:
+            units.append(unit)
+
+    chunks, cur, size = [], [], 0
+    for unit in units:
+        if cur and size + len(unit) > max_chars:
+            chunks.append("".join(cur).strip())
+            cur, size = [], 0
+        cur.append(unit)
+        size += len(unit)
+    if cur:
+        chunks.append("".join(cur).strip())
+    return [c for c in chunks if c]
+
+def chunk_prompts(sections: dict) -> list:
+    """[(fonte, trecho, prompt do map)] para `sections`: nome da fonte -> texto."""
+    schema = json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False)
+    chunks = [(label, c) for label, text in sections.items() if text for c in split_transcript(text)]
+    return [
+        (label, chunk,
+         f"Trecho {i + 1}/{len(chunks)} do histórico de um contato (fonte: {label}):\n"
+         "<<<\n" + chunk + "\n>>>\n"
+         "Extraia os insights somente deste trecho.\n"
+         "Retorne SOMENTE JSON seguindo este formato:\n" + schema)
+        for i, (label, chunk) in enumerate(chunks)
+    ]
+
+def map_reduce_insights(sections: dict, reduce_instruction: str, use_cache: bool = True,
+                        stats: dict | None = None) -> dict:
+    """
+    Map: cada trecho de cada fonte (`sections`: nome da fonte -> texto) é
+    resumido em paralelo no formato SCHEMA_EXEMPLO, com até CHUNKS_IN_FLIGHT
+    chamadas simultâneas. Reduce: os insights parciais, em ordem
+    cronológica, são consolidados em um só (em níveis, se não couberem
+    em um prompt). `stats` recebe os tokens de cada chamada.
+    """
+    schema = json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False)
+    chunks = chunk_prompts(sections)
+    usages = [[] for _ in chunks]
+
+    def map_one(i):
+        return chat_json(chunks[i][2], use_cache, usages[i])
+
+    with ThreadPoolExecutor(max_workers=max(1, CHUNKS_IN_FLIGHT)) as pool:
+        futures = [pool.submit(metrics.bind(map_one), i) for i in range(len(chunks))]
+        partials = [f.result() for f in futures]
+
+    reduce_usage = []
+    while True:
+        groups, cur, size = [], [], 0
+        for p in partials:
+            raw = json.dumps(p, ensure_ascii=False)
+            # pelo menos dois por grupo, para cada nível reduzir de fato
+            if len(cur) >= 2 and size + len(raw) > CHUNK_MAX_TOKENS * CHARS_PER_TOKEN:
+                groups.append(cur)
+                cur, size = [], 0
+            cur.append(raw)
+            size += len(raw)
+        groups.append(cur)
+        partials = [
+            chat_json(
+                "Insights parciais de trechos consecutivos do histórico de um contato, "
+                "em ordem cronológica:\n" + "\n".join(g) + "\n\n"
+                + reduce_instruction + "\n\n"
+                "Retorne SOMENTE JSON seguindo este formato:\n" + schema,
+                use_cache, reduce_usage,
+            )
+            for g in groups
+        ]
+        if len(partials) == 1:
+            break
+
+    if stats is not None:
+        stats["chunks"] = len(chunks)
+        stats["map"] = [
+            {"chunk": i + 1, "source": label, "est_tokens": estimate_tokens(c), **(u[0] if u else {})}
+            for i, ((label, c, _), u) in enumerate(zip(chunks, usages))
+        ]
+        stats["reduce"] = reduce_usage
+    return partials[0]
+
+def transcript_prompt(text: str) -> str:
+    return (
         "Transcript (WhatsApp Cooby):\n"
         "<<<\n" + text + "\n>>>\n"
         "Retorne SOMENTE JSON seguindo este formato:\n"
         + json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False)
     )
-    resp = client.chat.completions.create(
-        model="gpt-5-mini",  # ou gpt-4o-mini
-        messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
-            {"role": "user", "content": prompt}
-        ],
-        response_format={"type": "json_object"}
-    )
-    return json.loads(resp.choices[0].message.content)
+
+def generate_insights_from_transcript(text: str, use_cache: bool = True, stats: dict | None = None) -> dict:
+    if estimate_tokens(text) > CHUNK_MAX_TOKENS:
+        return map_reduce_insights({"Transcript": text}, TRANSCRIPT_REDUCE, use_cache, stats)
+    return chat_json(transcript_prompt(text), use_cache, stats.setdefault("calls", []) if stats is not None else None)
 
 def build_combined_prompt(cooby_text: str, call_text: str, schema_json: str) -> str:
     return (
@@ -48,24 +256,28 @@ def build_combined_prompt(cooby_text: str, call_text: str, schema_json: str) ->
         f"{schema_json}"
     )
 
-def generate_insights_combined(cooby_text: str, call_text: str) -> dict:
+def generate_insights_combined(cooby_text: str, call_text: str, use_cache: bool = True) -> dict:
     prompt = build_combined_prompt(cooby_text, call_text, json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False))
-    resp = client.chat.completions.create(
-        model="gpt-5-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
-            {"role": "user", "content": prompt}
-        ],
-        response_format={"type": "json_object"}
-    )
-    return json.loads(resp.choices[0].message.content)
+    return chat_json(prompt, use_cache)
 
-def generate_insights_triple(cooby_text: str, call_text: str, elephan_text: str) -> dict:
+def triple_sections(cooby_text: str, call_text: str, elephan_text: str) -> dict:
+    return {"WhatsApp (Cooby)": cooby_text, "Ligações": call_text, "Reunião Elephan": elephan_text}
+
+def generate_insights_triple(cooby_text: str, call_text: str, elephan_text: str,
+                             use_cache: bool = True, stats: dict | None = None) -> dict:
     """
     Gera um insight geral combinando até três fontes.
     Qualquer fonte vazia é simplesmente ignorada.
+    Se as fontes juntas passam do orçamento, vira map-reduce por trechos.
     """
-    prompt = (
+    if estimate_tokens(cooby_text + call_text + elephan_text) > CHUNK_MAX_TOKENS:
+        return map_reduce_insights(triple_sections(cooby_text, call_text, elephan_text), TRIPLE_REDUCE,
+                                   use_cache, stats)
+    prompt = triple_prompt(cooby_text, call_text, elephan_text)
+    return chat_json(prompt, use_cache, stats.setdefault("calls", []) if stats is not None else None)
+
+def triple_prompt(cooby_text: str, call_text: str, elephan_text: str) -> str:
+    return (
         "Gere insights combinando até três fontes abaixo. "
         "Use somente as que tiverem conteúdo relevante. "
         "Se alguma estiver vazia ou ausente, ignore sem falhar.\n\n"
@@ -81,13 +293,86 @@ def generate_insights_triple(cooby_text: str, call_text: str, elephan_text: str)
         + json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False)
     )
 
-    resp = client.chat.completions.create(
-        model="gpt-5-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
+def generate_insights_layers(cooby_text: str, call_text: str, elephan_text: str,
+                             use_cache: bool = True, stats: dict | None = None) -> dict:
+    """
+    Uma chamada só para as camadas por fonte e o insight geral (schema
+    estendido): {"cooby": ..., "calls": ..., "elephan": ..., "geral": ...}.
+    Fonte sem dados volta como None. Se o modelo deixar de fora alguma
+    camada, ela é completada com a chamada correspondente do modo antigo.
+    """
+    texts = {"cooby": cooby_text, "calls": call_text, "elephan": elephan_text}
+    prompt = layers_prompt(cooby_text, call_text, elephan_text)
+    layers = chat_json(prompt, use_cache, stats.setdefault("calls", []) if stats is not None else None)
+    out = {src: (layers.get(src) if txt else None) for src, txt in texts.items()}
+    out["geral"] = layers.get("geral")
+    for src, txt in texts.items():
+        if txt and not isinstance(out[src], dict):
+            out[src] = generate_insights_from_transcript(txt, use_cache, stats)
+    if not isinstance(out["geral"], dict):
+        out["geral"] = generate_insights_triple(cooby_text, call_text, elephan_text, use_cache, stats)
+    return out
+
+def layers_prompt(cooby_text: str, call_text: str, elephan_text: str) -> str:
+    texts = {"cooby": cooby_text, "calls": call_text, "elephan": elephan_text}
+    schema = {src: (SCHEMA_EXEMPLO if txt else None) for src, txt in texts.items()}
+    schema["geral"] = SCHEMA_EXEMPLO
+    return (
+        "Analise as fontes abaixo e responda em camadas:\n"
+        "- 'cooby', 'calls' e 'elephan': o insight de cada fonte isoladamente "
+        "(null se a fonte estiver sem dados);\n"
+        "- 'geral': consolide e cruze as fontes em um insight único, destacando "
+        "divergências, objeções importantes e próximos passos.\n\n"
+        "=== cooby: WhatsApp (Cooby) ===\n"
+        f"{cooby_text or '(sem dados)'}\n\n"
+        "=== calls: Ligações ===\n"
+        f"{call_text or '(sem dados)'}\n\n"
+        "=== elephan: Reunião Elephan ===\n"
+        f"{elephan_text or '(sem dados)'}\n\n"
+        "Retorne SOMENTE JSON seguindo este formato:\n"
+        + json.dumps(schema, ensure_ascii=False)
     )
-    return json.loads(resp.choices[0].message.content)
 
+# ——— prompts que cada geração manda de saída (Batch API: insights_batch.py).
+# No map-reduce só os trechos do map são conhecidos antes das respostas.
+def prompts_for_transcript(text: str) -> list:
+    if estimate_tokens(text) > CHUNK_MAX_TOKENS:
+        return [p for _, _, p in chunk_prompts({"Transcript": text})]
+    return [transcript_prompt(text)]
+
+def prompts_for_triple(cooby_text: str, call_text: str, elephan_text: str) -> list:
+    if estimate_tokens(cooby_text + call_text + elephan_text) > CHUNK_MAX_TOKENS:
+        return [p for _, _, p in chunk_prompts(triple_sections(cooby_text, call_text, elephan_text))]
+    return [triple_prompt(cooby_text, call_text, elephan_text)]
+
+def prompts_for_layers(cooby_text: str, call_text: str, elephan_text: str) -> list:
+    return [layers_prompt(cooby_text, call_text, elephan_text)]
+
+def update_insights(previous: dict, deltas: dict, use_cache: bool = True, stats: dict | None = None) -> dict:
+    """
+    Atualiza um insight já existente com as interações novas, sem reenviar
+    o histórico. `deltas` mapeia o nome da fonte para o texto novo
+    (fonte sem texto entra como '(sem novidades)'). Delta que não cabe no
+    orçamento passa antes pelo map-reduce e entra resumido no update.
+    """
+    previous_json = json.dumps(previous, ensure_ascii=False)
+    sections = "".join(
+        f"=== {label} ===\n{text or '(sem novidades)'}\n\n" for label, text in deltas.items()
+    )
+    if estimate_tokens(previous_json + sections) > CHUNK_MAX_TOKENS:
+        delta_insight = map_reduce_insights({label: text for label, text in deltas.items() if text},
+                                            DELTA_REDUCE, use_cache, stats)
+        sections = ("=== Resumo das novas interações (todas as fontes) ===\n"
+                    + json.dumps(delta_insight, ensure_ascii=False) + "\n\n")
+    prompt = (
+        "Insight anterior deste contato:\n"
+        + previous_json + "\n\n"
+        "Novas interações desde a última análise:\n\n"
+        + sections +
+        "Atualize o insight anterior com o que as novas interações mudam "
+        "(scores, objeções, sinais, próximos passos) e mantenha o que continua válido. "
+        "O lead_scoring_pre passa a ser o lead_scoring_pos anterior.\n\n"
+        "Retorne SOMENTE JSON seguindo este formato:\n"
+        + json.dumps(SCHEMA_EXEMPLO, ensure_ascii=False)
+    )
+    return chat_json(prompt, use_cache, stats.setdefault("calls", []) if stats is not None else None)
@@ -0,0 +1,190 @@
+# insights_batch.py
+"""
+Reprocessamento em massa pela Batch API da OpenAI (jobs noturnos, não
+interativos; metade do preço por token e sem orquestrar milhares de
+chamadas síncronas):
+
+1. plan: busca os engagements em lote, monta os textos e exatamente os
+   prompts do caminho interativo (insights_agent.prompts_for_*), pulando
+   os que já têm resposta no cache;
+2. submit: JSONL com uma linha por prompt (custom_id = contato:camada:chave
+   do cache) -> files.create(purpose="batch") -> batches.create;
+3. wait: consulta o status a cada OPENAI_BATCH_POLL_S até terminar;
+4. collect: baixa o arquivo de saída e fixa cada resposta no insights_cache
+   (insights_cache.pin, fora do descarte LRU) com a chave que chat_json usaria;
+5. run_rescoring: roda o pipeline em lote (run_batch) — as chamadas ao
+   modelo saem do cache e as notas vão juntas pelo NoteWriter compartilhado.
+   O que o batch não cobre (reduce do map-reduce, linhas com erro, contato
+   que mudou entre o plano e a aplicação) cai na chamada síncrona de sempre.
+   No fim, as respostas fixadas são soltas (insights_cache.unpin).
+
+Precisa do cache (INSIGHTS_CACHE=1). Batch já enviado pode ser retomado
+pelo ID (run_agent.py --openai-batch-id).
+"""
+import os, json, time, logging
+from typing import Iterable, Iterator, Optional
+
+import metrics
+import insights_cache
+from engagements import fetch_engagements
+from insights_agent import (
+    get_client, chat_request, cache_key,
+    prompts_for_transcript, prompts_for_triple, prompts_for_layers, MODEL,
+)
+from insights_pipeline import build_texts, llm_plan, run_batch, LAYERS, PREFETCH_CONTACTS, SOURCES
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_POLL_S = float(os.getenv("OPENAI_BATCH_POLL_S", "30"))
+BATCH_TIMEOUT_S = float(os.getenv("OPENAI_BATCH_TIMEOUT_S", str(24 * 3600)))
+BATCH_MAX_REQUESTS = 50000            # limite da Batch API por arquivo
+BATCH_MAX_BYTES = 190 * 1024 * 1024   # o limite é 200 MB
+TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+def contact_prompts(texts: dict, llm_mode: str = "per_source") -> dict:
+    """{camada: [prompts]} que _run_insights mandaria para estes textos (sem insight anterior)."""
+    if not any(texts.values()):
+        return {}
+    mirror, single_call = llm_plan(texts, {}, llm_mode)
+    if single_call:
+        return {LAYERS: prompts_for_layers(texts["cooby"], texts["calls"], texts["elephan"])}
+    out = {src: prompts_for_transcript(texts[src]) for src in SOURCES if texts[src]}
+    if not mirror:
+        out["geral"] = prompts_for_triple(texts["cooby"], texts["calls"], texts["elephan"])
+    return out
+
+def plan(contact_ids: Iterable[str], llm_mode: str = "per_source", since_ms: Optional[int] = None,
+         compact: bool = True) -> tuple[list, dict]:
+    """(linhas do JSONL ainda sem resposta no cache, {contato: prompts no plano})."""
+    ids = list(dict.fromkeys(str(c) for c in contact_ids))
+    lines, planned, seen = [], {}, set()
+    for start in range(0, len(ids), max(1, PREFETCH_CONTACTS)):
+        for cid, records in fetch_engagements(ids[start:start + PREFETCH_CONTACTS]).items():
+            prompts = contact_prompts(build_texts(records, since_ms, compact), llm_mode)
+            planned[cid] = sum(map(len, prompts.values()))
+            for kind, kind_prompts in prompts.items():
+                for prompt in kind_prompts:
+                    key = cache_key(prompt)
+                    if key in seen or insights_cache.has(key):
+                        continue
+                    seen.add(key)
+                    lines.append({"custom_id": f"{cid}:{kind}:{key}", "method": "POST",
+                                  "url": BATCH_ENDPOINT, "body": chat_request(prompt)})
+    return lines, planned
+
+def _parts(lines: list) -> Iterator[bytes]:
+    # um arquivo por batch, dentro dos limites de linhas e de tamanho
+    buf, n = [], 0
+    for line in lines:
+        raw = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+        if buf and (len(buf) >= BATCH_MAX_REQUESTS or n + len(raw) > BATCH_MAX_BYTES):
+            yield b"".join(buf)
+            buf, n = [], 0
+        buf.append(raw)
+        n += len(raw)
+    if buf:
+        yield b"".join(buf)
+
+def submit(lines: list, metadata: Optional[dict] = None) -> list:
+    """Envia as linhas em um ou mais batches e devolve os IDs."""
+    client = get_client()
+    batch_ids = []
+    for i, raw in enumerate(_parts(lines)):
+        f = client.files.create(file=(f"insights_batch_{i}.jsonl", raw), purpose="batch")
+        batch = client.batches.create(input_file_id=f.id, endpoint=BATCH_ENDPOINT, completion_window="24h",
+                                      metadata={"job": "insights_rescoring", **(metadata or {})})
+        batch_ids.append(batch.id)
+        metrics.log_event("openai.batch_submit", batchId=batch.id, fileId=f.id, bytes=len(raw),
+                          requests=raw.count(b"\n"))
+    metrics.inc("openai_batches_total", len(batch_ids), help="Batches enviados à Batch API", model=MODEL)
+    return batch_ids
+
+def wait(batch_ids: list, poll_s: float = BATCH_POLL_S, timeout_s: float = BATCH_TIMEOUT_S) -> list:
+    """Espera todos os batches terminarem (completed/failed/expired/cancelled)."""
+    client = get_client()
+    deadline = time.monotonic() + timeout_s
+    done = {}
+    while True:
+        for batch_id in batch_ids:
+            if batch_id not in done:
+                batch = client.batches.retrieve(batch_id)
+                if batch.status in TERMINAL:
+                    done[batch_id] = batch
+                    metrics.log_event("openai.batch_done", batchId=batch_id, status=batch.status,
+                                      counts=batch.request_counts.model_dump() if batch.request_counts else None)
+        if len(done) == len(batch_ids):
+            return [done[b] for b in batch_ids]
+        if time.monotonic() >= deadline:
+            pending = [b for b in batch_ids if b not in done]
+            raise RuntimeError(f"[Batch] ainda em andamento após {timeout_s:.0f}s: {', '.join(pending)} "
+                               "(retome com --openai-batch-id)")
+        time.sleep(poll_s)
+
+def _lines(file_id: Optional[str]) -> Iterator[dict]:
+    if not file_id:
+        return
+    for line in get_client().files.content(file_id).text.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+def collect(batches: list) -> dict:
+    """
+    Grava no cache as respostas dos batches (expirado/cancelado também
+    entrega o que concluiu) e devolve {contatos, concluídas, falhas, tokens}.
+    """
+    report = {"contacts": [], "completed": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    contacts = {}
+    for batch in batches:
+        for item in _lines(batch.output_file_id):
+            cid, _, key = item["custom_id"].rsplit(":", 2)
+            contacts[cid] = True
+            resp = item.get("response") or {}
+            try:
+                body = resp["body"]
+                if resp.get("status_code") != 200:
+                    raise ValueError(f"status {resp.get('status_code')}")
+                insights_cache.pin(key, json.loads(body["choices"][0]["message"]["content"]), batch.id)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                report["failed"] += 1
+                metrics.log_event("openai.batch_item_error", logging.WARNING, customId=item["custom_id"], error=str(e))
+                continue
+            report["completed"] += 1
+            usage = body.get("usage") or {}
+            report["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            report["completion_tokens"] += usage.get("completion_tokens") or 0
+        for item in _lines(batch.error_file_id):
+            contacts[item["custom_id"].rsplit(":", 2)[0]] = True
+            report["failed"] += 1
+    report["contacts"] = list(contacts)
+    for kind in ("prompt", "completion"):
+        metrics.inc("openai_batch_tokens_total", report[f"{kind}_tokens"], help="Tokens gastos via Batch API",
+                    model=MODEL, kind=kind)
+    metrics.inc("openai_batch_requests_total", report["completed"], help="Linhas processadas pela Batch API",
+                outcome="ok")
+    metrics.inc("openai_batch_requests_total", report["failed"], help="Linhas processadas pela Batch API",
+                outcome="error")
+    metrics.log_event("openai.batch_collect", **{k: v for k, v in report.items() if k != "contacts"},
+                      contacts=len(report["contacts"]))
+    return report
+
+def run_rescoring(contact_ids: Iterable[str] = (), batch_ids: Optional[list] = None, workers: int = 4,
+                  llm_mode: str = "per_source", since_ms: Optional[int] = None, compact: bool = True,
+                  poll_s: float = BATCH_POLL_S, timeout_s: float = BATCH_TIMEOUT_S, **kwargs) -> Iterator[dict]:
+    """
+    Reprocessa os contatos via Batch API e devolve os resultados do pipeline
+    (como run_batch). Com `batch_ids`, retoma batches já enviados: sem
+    `contact_ids`, os contatos saem dos custom_id. `kwargs` vão para
+    run_batch (create_note_flag, note_writer, ...).
+    """
+    if not insights_cache.CACHE_ENABLED:
+        raise RuntimeError("[Batch] as respostas da Batch API chegam ao pipeline pelo cache: use INSIGHTS_CACHE=1")
+    ids = list(dict.fromkeys(str(c) for c in contact_ids))
+    if batch_ids is None:
+        lines, planned = plan(ids, llm_mode, since_ms, compact)
+        metrics.log_event("openai.batch_plan", contacts=len(planned), prompts=sum(planned.values()),
+                          requests=len(lines))
+        batch_ids = submit(lines) if lines else []
+    report = collect(wait(batch_ids, poll_s, timeout_s)) if batch_ids else {"contacts": []}
+    yield from run_batch(ids or report["contacts"], workers, llm_mode=llm_mode, since_ms=since_ms,
+                         compact=compact, use_cache=True, incremental=False, **kwargs)
+    # só depois de consumido: se o lote cair no meio, a retomada ainda acha as respostas
+    insights_cache.unpin(batch_ids)
@@ -0,0 +1,138 @@
+# insights_cache.py
+"""
+Cache persistente (SQLite) dos resultados do modelo, endereçado pelo
+conteúdo: a chave é o hash de modelo + instruções + schema + prompt (que
+contém o transcript). Transcript igual => resposta do cache, sem tokens.
+Entradas expiram por TTL e o total é limitado com descarte LRU.
+Respostas da Batch API ficam fixadas (llm_pinned, fora do LRU) até o
+reprocessamento que as pediu terminar de usá-las.
+Também guarda a última nota escrita por contato/fonte, para não duplicar
+nota quando o insight não mudou.
+"""
+import os, json, time, hashlib, threading
+
+from local_store import connect, register_schema
+import metrics
+
+CACHE_ENABLED = os.getenv("INSIGHTS_CACHE", "1") != "0"
+CACHE_TTL_S = int(os.getenv("INSIGHTS_CACHE_TTL_S", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("INSIGHTS_CACHE_MAX_ENTRIES", "5000"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed_at);
+CREATE TABLE IF NOT EXISTS llm_pinned (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    batch_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_pinned_batch ON llm_pinned(batch_id);
+CREATE TABLE IF NOT EXISTS note_log (
+    contact_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    insight_hash TEXT NOT NULL,
+    note_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (contact_id, kind)
+);
+""")
+
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+metrics.register_gauge("llm_cache_events", "Eventos do cache de LLM desde o início do processo", stats)
+
+def content_hash(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def get(key: str) -> dict | None:
+    conn = connect()
+    row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    now = time.time()
+    if row is not None and now - row["created_at"] > CACHE_TTL_S:
+        conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+        _count("expired")
+        row = None
+    if row is None:
+        pinned = conn.execute("SELECT value FROM llm_pinned WHERE key = ? AND created_at >= ?",
+                              (key, now - CACHE_TTL_S)).fetchone()
+        _count("hits" if pinned else "misses")
+        return json.loads(pinned["value"]) if pinned else None
+    conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+    _count("hits")
+    return json.loads(row["value"])
+
+def has(key: str) -> bool:
+    """Se há resposta válida para `key`, sem contar como hit/miss nem renovar o LRU."""
+    row = connect().execute(
+        "SELECT MAX(created_at) AS created_at FROM (SELECT created_at FROM llm_cache WHERE key = ? "
+        "UNION ALL SELECT created_at FROM llm_pinned WHERE key = ?)", (key, key),
+    ).fetchone()
+    return row["created_at"] is not None and time.time() - row["created_at"] <= CACHE_TTL_S
+
+def put(key: str, value: dict):
+    conn = connect()
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(value, ensure_ascii=False), now, now),
+    )
+    _trim(conn, now)
+
+def _trim(conn, now: float):
+    cur = conn.execute(
+        "DELETE FROM llm_cache WHERE created_at < ? OR key IN ("
+        "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+        (now - CACHE_TTL_S, CACHE_MAX_ENTRIES),
+    )
+    if cur.rowcount:
+        _count("evicted", cur.rowcount)
+
+def pin(key: str, value: dict, batch_id: str):
+    """Grava uma resposta fora do LRU (Batch API): vale até unpin ou o TTL."""
+    conn = connect()
+    now = time.time()
+    conn.execute("INSERT OR REPLACE INTO llm_pinned (key, value, batch_id, created_at) VALUES (?, ?, ?, ?)",
+                 (key, json.dumps(value, ensure_ascii=False), batch_id, now))
+    conn.execute("DELETE FROM llm_pinned WHERE created_at < ?", (now - CACHE_TTL_S,))
+
+def unpin(batch_ids: list):
+    """Solta as respostas fixadas destes batches para o cache comum (sujeitas ao LRU dali em diante)."""
+    conn = connect()
+    now = time.time()
+    for batch_id in batch_ids:
+        conn.execute(
+            "INSERT OR IGNORE INTO llm_cache (key, value, created_at, accessed_at) "
+            "SELECT key, value, created_at, ? FROM llm_pinned WHERE batch_id = ?", (now, batch_id),
+        )
+        conn.execute("DELETE FROM llm_pinned WHERE batch_id = ?", (batch_id,))
+    _trim(conn, now)
+
+def last_note(contact_id: str, kind: str, insight_hash: str) -> str | None:
+    """ID da última nota deste contato/fonte, se foi escrita para o mesmo insight."""
+    row = connect().execute(
+        "SELECT note_id FROM note_log WHERE contact_id = ? AND kind = ? AND insight_hash = ?",
+        (str(contact_id), kind, insight_hash),
+    ).fetchone()
+    return row["note_id"] if row else None
+
+def record_note(contact_id: str, kind: str, insight_hash: str, note_id: str):
+    connect().execute(
+        "INSERT OR REPLACE INTO note_log (contact_id, kind, insight_hash, note_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        (str(contact_id), kind, insight_hash, str(note_id), time.time()),
+    )
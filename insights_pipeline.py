@@ -0,0 +1,573 @@
+# insights_pipeline.py
+"""
+Pipeline de insights de um contato: busca no HubSpot (Cooby, Ligações,
+Elephan), gera os insights por fonte + o geral e cria as notas.
+Usado pela API (api/insights.py) e pelo run_agent.py.
+"""
+import os, time, logging, threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, Optional
+
+from hubspot_client import NoteWriter, build_elephan_block, mark_truncated
+from engagements import ContactEngagements, fetch_engagements, search_records, FETCH_MODE
+
+from insights_agent import (
+    generate_insights_from_transcript,
+    generate_insights_triple,
+    generate_insights_layers,
+    update_insights,
+    estimate_tokens,
+    CHUNK_MAX_TOKENS,
+    CHARS_PER_TOKEN,
+    MAX_CHUNKS_PER_SOURCE,
+)
+import insights_cache
+import contact_state
+import metrics
+from transcript_compaction import compact_transcripts
+
+MAX_WORKERS = int(os.getenv("INSIGHTS_MAX_WORKERS", "8"))
+# por fonte, texto cru antes da compactação: MAX_CHUNKS_PER_SOURCE trechos do map-reduce
+MAX_TRANSCRIPT_CHARS = int(os.getenv("INSIGHTS_MAX_TRANSCRIPT_CHARS",
+                                     str(MAX_CHUNKS_PER_SOURCE * CHUNK_MAX_TOKENS * CHARS_PER_TOKEN)))
+BATCH_MAX_WORKERS = int(os.getenv("INSIGHTS_BATCH_MAX_WORKERS", "16"))
+# lote: contatos cujos engagements são buscados juntos (engagements.fetch_engagements)
+PREFETCH_CONTACTS = int(os.getenv("INSIGHTS_PREFETCH_CONTACTS", "100"))
+# "per_source": uma chamada por fonte + a geral, concorrentes (padrão)
+# "single_call": uma chamada devolve todas as camadas (schema estendido)
+LLM_MODES = ("per_source", "single_call")
+
+def build_cooby_transcript(results, since_ms: Optional[int] = None, max_chars: Optional[int] = None,
+                           report: Optional[dict] = None) -> str:
+    # `results` (engagements.Communication) vem do mais recente para o mais
+    # antigo; com `max_chars` paramos de consumir o iterador (e de paginar,
+    # no modo search) ao atingir o orçamento, anotando o corte em `report`
+    msgs = []
+    size = 0
+    for r in results:
+        if since_ms and r.ts_ms and r.ts_ms < since_ms:
+            continue
+        msg = r.clean_text()
+        if msg:
+            msgs.append(f"[{r.ts}] {msg}")
+            size += len(msgs[-1])
+            if max_chars and size >= max_chars:
+                mark_truncated(report, r, len(msgs))
+                break
+    msgs.sort()
+    return "\n".join(msgs)
+
+def build_calls_summary_block(call_results, since_ms: Optional[int] = None, max_chars: Optional[int] = None,
+                              report: Optional[dict] = None) -> str:
+    blocks = []
+    size = 0
+    for r in call_results:
+        if since_ms and r.ts_ms and r.ts_ms < since_ms:
+            continue
+        text = r.clean_text()
+        if text:
+            blocks.append(f"[{r.ts}]\n{text}")
+            size += len(blocks[-1])
+            if max_chars and size >= max_chars:
+                mark_truncated(report, r, len(blocks))
+                break
+    blocks.sort()
+    return "\n\n".join(blocks)
+
+def render_note_html(title: str, insights: dict) -> str:
+    def li(items): return "".join(f"<li>{i}</li>" for i in (items or [])) or "<li>—</li>"
+    next_li = "".join(f"<li>{p.get('descricao','')}</li>" for p in (insights.get("proximos_passos") or [])) or "<li>—</li>"
+    pre  = insights.get("lead_scoring_pre", 0)
+    pos  = insights.get("lead_scoring_pos", 0)
+    lab  = insights.get("label_interacao", "-")
+    html = f"""
+    <h3>{title}</h3>
+    <ul>
+      <li><strong>Lead pré:</strong> {pre} &nbsp;|&nbsp; <strong>pós:</strong> {pos}</li>
+      <li><strong>Classificação:</strong> {lab}</li>
+    </ul>
+    <h4>Resumo</h4><ul>{li(insights.get('resumo_bullets'))}</ul>
+    <h4>Objeções</h4><ul>{li(insights.get('principais_objeções'))}</ul>
+    <h4>Sinais de fechamento</h4><ul>{li(insights.get('sinais_fechamento'))}</ul>
+    <h4>Próximos passos</h4><ul>{next_li}</ul>
+    <h4>Recomendações</h4><ul>{li(insights.get('recomendacoes'))}</ul>
+    <h4>Trechos relevantes</h4><ul>{li(insights.get('top_snippets'))}</ul>
+    """.split("\n")
+    return "\n".join(l.strip() for l in html if l.strip())
+
+SOURCES = ("cooby", "calls", "elephan")
+SOURCE_LABELS = {"cooby": "WhatsApp (Cooby)", "calls": "Ligações", "elephan": "Reunião Elephan"}
+BUILDERS = {"cooby": build_cooby_transcript, "calls": build_calls_summary_block, "elephan": build_elephan_block}
+
+LAYERS = "camadas"  # chave do Future da chamada única (todas as camadas)
+
+NOTE_TITLES = {
+    "cooby": "🤖 Insights (Cooby/WhatsApp)",
+    "calls": "📞 Insights (Ligações)",
+    "elephan": "📝 Insights (Reunião Elephan)",
+    "geral": "🧩 Insights (Geral: WhatsApp + Ligações + Elephan)",
+}
+
+class StageTimer:
+    """
+    Mede cada etapa do pipeline (ms). As etapas podem rodar em threads
+    diferentes; os grupos (hubspot/llm/notes) reportam o tempo de parede
+    entre o início da primeira e o fim da última etapa do grupo.
+    """
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def timed(self, name: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.spans[name] = (start, end)
+            metrics.observe("stage_seconds", end - start, help="Duração das etapas do pipeline", stage=name)
+
+    def report(self) -> dict:
+        ms = lambda s: round(s * 1000, 1)
+        out = {"total_ms": ms(time.perf_counter() - self.t0)}
+        for group in ("hubspot", "llm", "notes"):
+            spans = [v for k, v in self.spans.items() if k.startswith(group + ".")]
+            if spans:
+                out[f"{group}_ms"] = ms(max(e for _, e in spans) - min(s for s, _ in spans))
+        out["stages"] = {k: ms(e - s) for k, (s, e) in sorted(self.spans.items(), key=lambda kv: kv[1][0])}
+        return out
+
+def scores_from(insights: dict) -> dict:
+    """Bloco 'scores' da resposta a partir dos insights por camada."""
+    score = lambda src, k: (insights.get(src) or {}).get(k)
+    return {
+        "cooby_pre": score("cooby", "lead_scoring_pre"),
+        "cooby_pos": score("cooby", "lead_scoring_pos"),
+        "calls_pre": score("calls", "lead_scoring_pre"),
+        "calls_pos": score("calls", "lead_scoring_pos"),
+        "elephan_pre": score("elephan", "lead_scoring_pre"),
+        "elephan_pos": score("elephan", "lead_scoring_pos"),
+        "geral_pre": score("geral", "lead_scoring_pre"),
+        "geral_pos": score("geral", "lead_scoring_pos"),
+    }
+
+def write_note(writer: NoteWriter, contact_id: str, src: str, insight: dict,
+               skip_unchanged: bool = False) -> Future:
+    """
+    Enfileira a nota do insight no `writer` (gravada no próximo flush) e
+    devolve o Future do ID. Com `skip_unchanged`, se a última nota desta
+    fonte para o contato foi escrita com exatamente o mesmo conteúdo
+    (ex.: insight vindo do cache), devolve o ID dela em vez de duplicar.
+    """
+    html = render_note_html(NOTE_TITLES[src], insight)
+    if not insights_cache.CACHE_ENABLED:
+        return writer.add(contact_id, html)
+    h = insights_cache.content_hash(html)
+    if skip_unchanged:
+        note_id = insights_cache.last_note(contact_id, src, h)
+        if note_id:
+            f = Future()
+            f.set_result(note_id)
+            return f
+    f = writer.add(contact_id, html)
+    f.add_done_callback(
+        lambda f: f.exception() or insights_cache.record_note(contact_id, src, h, f.result())
+    )
+    return f
+
+def llm_plan(texts: dict, prev: dict, llm_mode: str) -> tuple[Optional[str], bool]:
+    """
+    (fonte cujo insight vira o geral, chamada única?) para os textos do
+    contato; o mesmo plano serve ao caminho interativo e ao insights_batch.
+    """
+    with_text = [src for src in SOURCES if texts[src]]
+    mirror = with_text[0] if len(with_text) == 1 and not prev.get("geral") and not prev.get(with_text[0]) else None
+    single_call = (
+        llm_mode == "single_call" and not prev.get("geral") and len(with_text) > 1
+        and estimate_tokens("".join(texts.values())) <= CHUNK_MAX_TOKENS
+    )
+    return mirror, single_call
+
+def build_texts(engagements: ContactEngagements, since_ms: Optional[int] = None, compact: bool = True) -> dict:
+    """
+    Os textos por fonte que _run_insights monta (sem modo incremental) a
+    partir dos registros já buscados, compactados como lá.
+    """
+    texts = {
+        src: BUILDERS[src](engagements.for_source(src), since_ms, MAX_TRANSCRIPT_CHARS).strip()
+        for src in SOURCES
+    }
+    if compact and any(texts.values()):
+        texts, _ = compact_transcripts(texts)
+    return texts
+
+def truncation_report(contact_id: str, engagements: Optional[ContactEngagements], cuts: dict,
+                      since_for: Callable) -> dict:
+    """
+    {fonte: corte} das fontes que perderam histórico: pelo orçamento dos
+    builders (`cuts`, preenchido por mark_truncated) ou pelo teto do fetch
+    (engagements.capped). `dropped` é None no modo search, em que a
+    paginação para no corte e o total não é conhecido.
+    """
+    out = {}
+    for src in SOURCES:
+        cut, capped = cuts.get(src) or {}, (engagements.capped.get(src, 0) if engagements else 0)
+        if not cut and not capped:
+            continue
+        since = since_for(src)
+        dropped = capped
+        if cut and engagements:
+            oldest = cut["oldest_kept_ms"] or 0
+            dropped += sum(1 for r in engagements.for_source(src)
+                           if r.ts_ms and r.ts_ms < oldest and not (since and r.ts_ms < since))
+        elif cut:
+            dropped = None
+        out[src] = {"dropped": dropped, "kept": cut.get("kept"), "oldest_kept_ts": cut.get("oldest_kept_ts"),
+                    "fetch_cap": capped, "budget_chars": MAX_TRANSCRIPT_CHARS if cut else None}
+        if cut:
+            metrics.inc("transcript_truncated_total", help="Fontes cortadas pelo orçamento do transcript", source=src)
+            metrics.log_event("transcript.truncated", logging.WARNING, contactId=contact_id, source=src, **out[src])
+    return out
+
+class WatermarkTracker:
+    """Repassa os registros de um iterador anotando o maior hs_timestamp visto."""
+    def __init__(self, items):
+        self.items = items
+        self.max_ms = None
+
+    def __iter__(self):
+        for r in self.items:
+            if r.ts_ms and (self.max_ms is None or r.ts_ms > self.max_ms):
+                self.max_ms = r.ts_ms
+            yield r
+
+def _run_insights(contact_id: str, timer: StageTimer, pool: Optional[ThreadPoolExecutor], *,
+                  create_note_flag: bool = True, since_ms: Optional[int] = None,
+                  use_cache: bool = True, skip_unchanged_notes: bool = False,
+                  incremental: bool = False, note_writer: Optional[NoteWriter] = None,
+                  llm_mode: str = "per_source", on_event: Optional[Callable[[dict], None]] = None,
+                  partial: bool = False, compact: bool = True,
+                  engagements: Optional[ContactEngagements] = None) -> dict:
+    if llm_mode not in LLM_MODES:
+        raise ValueError(f"llm_mode inválido: {llm_mode!r} (use {', '.join(LLM_MODES)})")
+
+    # `on_event` recebe cada etapa assim que termina (fetch, insight, note, error).
+    # Com `partial`, a falha de uma etapa vira evento/entrada em 'errors' e o
+    # resto do pipeline segue; sem ele, a primeira exceção sobe.
+    errors, failed = [], set()
+
+    def emit(event: str, **data):
+        if on_event:
+            on_event({"event": event, "contactId": contact_id, **data})
+
+    def fail(stage: str, src: str, e: Exception):
+        errors.append({"stage": stage, "source": src, "error": str(e)})
+        failed.add(src)
+        emit("error", stage=stage, source=src, error=str(e))
+
+    def submit(name, fn, *args) -> Future:
+        if pool:
+            # o contexto (uso por requisição) acompanha a etapa na thread do pool
+            return pool.submit(metrics.bind(timer.timed), name, fn, *args)
+        # modo sequencial: executa na hora e devolve um Future já resolvido
+        f = Future()
+        try:
+            f.set_result(timer.timed(name, fn, *args))
+        except Exception as e:
+            f.set_exception(e)
+        return f
+
+    # modo incremental: cada fonte só busca o que veio depois do seu watermark.
+    # Sem insight geral salvo não há base para atualizar, então reconstrói tudo.
+    state = contact_state.load(contact_id) if incremental else {}
+    if "geral" not in state:
+        state = {}
+    prev = {src: (state.get(src) or {}).get("insight") for src in (*SOURCES, "geral")}
+
+    def since_for(src):
+        wm = (state.get(src) or {}).get("watermark_ms")
+        return max(since_ms or 0, wm + 1) if wm else since_ms
+
+    # ===== 1) HubSpot: Cooby, Calls e Elephan (notas com 'por Elephan') =====
+    # `engagements` vem pré-carregado no lote (run_batch); sozinho, o contato
+    # faz o próprio fetch_engagements. No modo search a paginação é preguiçosa:
+    # cada builder consome seu iterador até o orçamento.
+    if engagements is None and FETCH_MODE != "search":
+        try:
+            engagements = timer.timed("hubspot.fetch", fetch_engagements, [contact_id])[str(contact_id)]
+        except Exception as e:
+            if not partial:
+                raise
+            for src in SOURCES:
+                fail("hubspot", src, e)
+            return {"ok": False, "reason": "ERROR", "error": errors[0]["error"], "errors": errors}
+    trackers = {
+        src: WatermarkTracker(engagements.for_source(src) if engagements else search_records(contact_id, src, since_for(src)))
+        for src in SOURCES
+    }
+    cuts = {src: {} for src in SOURCES}
+    fetched = {
+        submit(f"hubspot.{src}", BUILDERS[src], trackers[src], since_for(src), MAX_TRANSCRIPT_CHARS, cuts[src]): src
+        for src in SOURCES
+    }
+    texts = dict.fromkeys(SOURCES, "")
+    for f in (as_completed(fetched) if pool else fetched):
+        src = fetched[f]
+        try:
+            texts[src] = f.result().strip()
+        except Exception as e:
+            if not partial:
+                raise
+            fail("hubspot", src, e)
+            continue
+        emit("fetch", source=src, has_data=bool(texts[src]), chars=len(texts[src]), truncated=bool(cuts[src]))
+    truncated = truncation_report(contact_id, engagements, cuts, since_for)
+
+    if len(failed) == len(SOURCES):
+        return {"ok": False, "reason": "ERROR", "error": errors[0]["error"], "errors": errors}
+
+    # duplicatas, boilerplate, timestamps relativos e teto de tokens por fonte
+    compaction = None
+    if compact and any(texts.values()):
+        texts, compaction = timer.timed("compact", compact_transcripts, texts)
+        saved = max(0, compaction["tokens_saved"])  # contador do Prometheus não pode descer
+        metrics.inc("compaction_tokens_saved_total", saved, help="Tokens de prompt economizados pela compactação")
+        metrics.add(compaction_tokens_saved=saved)
+
+    # Se absolutamente nada tiver dado texto, retornamos um "no data"
+    if not any(texts.values()) and not any(prev.values()):
+        return {
+            "ok": False,
+            "reason": "NO_DATA",
+            "message": "Nenhum dado encontrado em Cooby, Ligações ou Elephan."
+        }
+
+    # ===== 2) LLM: insight por fonte + Insight Geral, todos concorrentes =====
+    # com insight anterior, o modelo só recebe o delta; sem novidade, nada é chamado.
+    # Com uma fonte só (e sem geral anterior), o geral seria a mesma análise
+    # da fonte: reaproveita o insight dela em vez de chamar o modelo de novo.
+    llm = {}
+    llm_stats = {src: {} for src in (*SOURCES, "geral")}
+    with_text = [src for src in SOURCES if texts[src]]
+    mirror, single_call = llm_plan(texts, prev, llm_mode)
+    if single_call:
+        llm[submit("llm.camadas", generate_insights_layers,
+                   texts["cooby"], texts["calls"], texts["elephan"], use_cache, llm_stats["geral"])] = LAYERS
+    else:
+        for src, txt in texts.items():
+            if txt and prev[src]:
+                llm[submit(f"llm.{src}", update_insights, prev[src], {SOURCE_LABELS[src]: txt}, use_cache,
+                           llm_stats[src])] = src
+            elif txt:
+                llm[submit(f"llm.{src}", generate_insights_from_transcript, txt, use_cache, llm_stats[src])] = src
+        if not prev["geral"] and not mirror:
+            llm[submit("llm.geral", generate_insights_triple,
+                       texts["cooby"], texts["calls"], texts["elephan"], use_cache, llm_stats["geral"])] = "geral"
+        elif prev["geral"] and any(texts.values()):
+            deltas = {SOURCE_LABELS[src]: texts[src] for src in SOURCES}
+            llm[submit("llm.geral", update_insights, prev["geral"], deltas, use_cache, llm_stats["geral"])] = "geral"
+
+    # ===== 3) Notas: enfileiradas à medida que os insights ficam prontos e
+    # gravadas num único batch/create (já associadas ao contato) =====
+    writer = note_writer or NoteWriter()
+    insights = {src: ins for src, ins in prev.items() if ins}
+    pending_notes = {}
+
+    def ready(src, insight):
+        insights[src] = insight
+        emit("insight", source=src, insight=insight,
+             scores={"pre": insight.get("lead_scoring_pre"), "pos": insight.get("lead_scoring_pos")})
+        if create_note_flag:
+            pending_notes[src] = write_note(writer, contact_id, src, insight, skip_unchanged_notes)
+
+    for f in (as_completed(llm) if pool else llm):
+        try:
+            res = f.result()
+        except Exception as e:
+            if not partial:
+                raise
+            if llm[f] == LAYERS:
+                for src in (*with_text, "geral"):
+                    insights.pop(src, None)
+                    fail("llm", src, e)
+            else:
+                insights.pop(llm[f], None)
+                fail("llm", llm[f], e)
+            continue
+        if llm[f] == LAYERS:
+            for src, insight in res.items():
+                if insight:
+                    ready(src, insight)
+        else:
+            ready(llm[f], res)
+    if mirror and mirror in insights:
+        ready("geral", insights[mirror])
+    if pending_notes:
+        timer.timed("notes.flush", writer.flush)
+    note_ids = {}
+    for src, f in pending_notes.items():
+        try:
+            note_ids[src] = f.result()
+        except Exception as e:
+            if not partial:
+                raise
+            fail("notes", src, e)
+            continue
+        emit("note", source=src, noteId=note_ids[src])
+
+    result = {
+        "ok": "geral" in insights,
+        "notes": {
+            "cooby": note_ids.get("cooby"),
+            "calls": note_ids.get("calls"),
+            "elephan": note_ids.get("elephan"),
+            "geral": note_ids.get("geral"),
+        },
+        "has_calls": bool(texts["calls"] or prev["calls"]),
+        "has_cooby": bool(texts["cooby"] or prev["cooby"]),
+        "has_elephan": bool(texts["elephan"] or prev["elephan"]),
+        "scores": scores_from(insights),
+    }
+    if errors:
+        result["errors"] = errors
+        if not result["ok"]:
+            result["reason"] = "PARTIAL"
+
+    result["llm"] = {
+        "mode": "single_call" if single_call else "per_source",
+        "calls": len(llm),
+        "geral_from": mirror,  # fonte reaproveitada como geral, se houve
+    }
+
+    if truncated:
+        result["truncated"] = truncated
+    if compaction:
+        result["compaction"] = compaction
+
+    # transcripts grandes passaram por map-reduce: tokens por trecho
+    chunked = {src: st for src, st in llm_stats.items() if st.get("chunks")}
+    if chunked:
+        result["chunking"] = chunked
+
+    if incremental:
+        # só avança o estado depois das notas: se algo falhar, o delta é reprocessado
+        watermarks = {
+            src: max(trackers[src].max_ms or 0, (state.get(src) or {}).get("watermark_ms") or 0) or None
+            for src in SOURCES
+        }
+        watermarks["geral"] = max(w or 0 for w in watermarks.values()) or None
+        for src, wm in watermarks.items():
+            if src not in failed and (wm or src in insights):
+                contact_state.save(contact_id, src, wm, insights.get(src))
+        result["incremental"] = {
+            "rebuilt": not prev["geral"],
+            "new_activity": {src: bool(texts[src]) for src in SOURCES},
+            "watermarks": watermarks,
+        }
+    return result
+
+def run_insights(contact_id: str, parallel: bool = True, **options) -> dict:
+    """
+    Roda o pipeline completo para um contato e devolve o payload da API
+    (com os blocos 'timings' e 'usage'). Exceções sobem para quem chamou.
+    `options`: create_note_flag, since_ms, use_cache, skip_unchanged_notes, incremental,
+    note_writer (compartilhado para juntar notas de vários contatos no mesmo batch), llm_mode,
+    engagements (registros já buscados em lote; ver engagements.fetch_engagements),
+    compact (ver transcript_compaction), on_event + partial (streaming: eventos por etapa e falhas parciais; ver _run_insights).
+    O evento final "done" leva o payload completo.
+    """
+    timer = StageTimer()
+    pool = ThreadPoolExecutor(max_workers=MAX_WORKERS) if parallel else None
+    try:
+        with metrics.track_usage() as usage:
+            try:
+                result = _run_insights(contact_id, timer, pool, **options)
+            except Exception as e:
+                metrics.inc("pipeline_runs_total", help="Execuções do pipeline por contato", outcome="ERROR")
+                metrics.log_event("insights.run", logging.ERROR, contactId=contact_id, ok=False, reason="ERROR",
+                                  error=str(e), timings=timer.report(), usage=usage.report())
+                raise
+        result["timings"] = timer.report()
+        result["usage"] = usage.report()
+        outcome = "ok" if result.get("ok") else result.get("reason", "ERROR")
+        metrics.inc("pipeline_runs_total", help="Execuções do pipeline por contato", outcome=outcome)
+        metrics.log_event("insights.run", contactId=contact_id, ok=result.get("ok"), reason=result.get("reason"),
+                          errors=len(result.get("errors") or ()),
+                          **{k: v for k, v in result["timings"].items() if k != "stages"}, **result["usage"])
+        if options.get("on_event"):
+            options["on_event"]({"event": "done", "contactId": contact_id, **result})
+        return result
+    finally:
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def run_insights_safe(contact_id: str, **kwargs) -> dict:
+    """Igual a run_insights, mas converte falhas no payload de erro da API."""
+    try:
+        return run_insights(contact_id, **kwargs)
+    except Exception as e:
+        return {"ok": False, "reason": "ERROR", "error": str(e)}
+
+def run_batch(contact_ids: Iterable[str], workers: int = 4, **kwargs) -> Iterator[dict]:
+    """
+    Processa vários contatos com um pool de `workers` threads e devolve
+    os resultados à medida que ficam prontos (fora de ordem), cada um com
+    'contactId'. Falha de um contato não interrompe os demais.
+    Os limites de HubSpot/OpenAI são compartilhados pelo processo todo
+    (ver hubspot_client.hubspot_request e insights_agent.chat_json).
+    """
+    workers = max(1, min(workers, BATCH_MAX_WORKERS))
+    # um writer para o lote todo: cada flush leva junto as notas que outros
+    # contatos já enfileiraram
+    kwargs.setdefault("note_writer", NoteWriter())
+    ids = list(dict.fromkeys(str(c) for c in contact_ids))
+    prefetch = FETCH_MODE != "search"
+    size = max(1, PREFETCH_CONTACTS) if prefetch else max(1, len(ids))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for group in (ids[i:i + size] for i in range(0, len(ids), size)):
+            fetched, share = _prefetch(group) if prefetch else ({}, {})
+            for cid in group:
+                f = pool.submit(run_insights_safe, cid, engagements=fetched.get(cid), **kwargs)
+                futures[f] = (cid, share)
+            # enquanto o próximo grupo é buscado, entrega quem já terminou
+            for f in [f for f in futures if f.done()]:
+                yield _batch_result(*futures.pop(f), f.result())
+        for f in as_completed(futures):
+            yield _batch_result(*futures[f], f.result())
+
+def _prefetch(contact_ids: list) -> tuple[dict, dict]:
+    """
+    Engagements de um grupo do lote numa busca só, mais a fatia do uso
+    (requisições ao HubSpot) que cabe a cada contato. Se a busca em lote
+    falhar, devolve vazio e cada contato busca os seus sozinho.
+    """
+    with metrics.track_usage() as usage:
+        try:
+            fetched = fetch_engagements(contact_ids)
+        except Exception as e:
+            metrics.log_event("insights.prefetch", logging.WARNING, contacts=len(contact_ids), error=str(e))
+            fetched = {}
+    return fetched, {k: v / len(contact_ids) for k, v in usage.report().items() if v}
+
+def _batch_result(contact_id: str, share: dict, result: dict) -> dict:
+    if share and "usage" in result:
+        result["usage"] = {k: round(v + share.get(k, 0), 2) for k, v in result["usage"].items()}
+    return {"contactId": contact_id, **result}
+
+def summarize_batch(results: list, elapsed_s: float) -> dict:
+    ok = sum(1 for r in results if r.get("ok"))
+    no_data = sum(1 for r in results if r.get("reason") == "NO_DATA")
+    return {
+        "total": len(results),
+        "succeeded": ok,
+        "no_data": no_data,
+        "failed": len(results) - ok - no_data,
+        "failed_ids": [r["contactId"] for r in results if r.get("reason") == "ERROR"],
+        "truncated_ids": [r["contactId"] for r in results if r.get("truncated")],
+        "elapsed_ms": round(elapsed_s * 1000, 1),
+        "contacts_per_min": round(len(results) / elapsed_s * 60, 1) if elapsed_s else None,
+        "usage": {k: round(sum((r.get("usage") or {}).get(k, 0) for r in results), 1) for k in metrics.USAGE_KEYS},
+    }
@@ -0,0 +1,242 @@
+# job_queue.py
+"""
+Fila de jobs persistida no SQLite local (ver local_store): POST enfileira e
+devolve um jobId, workers processam em background e o status/resultado
+fica consultável depois. Evita o limite de tempo da função serverless e
+os retries do chamador que duplicavam chamadas ao modelo e notas.
+
+- Idempotência: a chave (do chamador ou derivada de contato + opções +
+  janela de JOB_IDEMPOTENCY_WINDOW_S) devolve o mesmo job em vez de criar outro.
+- Dedupe: job do mesmo contato ainda na fila/em execução é reaproveitado.
+- Lease: job 'running' há mais de JOB_LEASE_S volta para a fila
+  (worker morto), até JOB_MAX_ATTEMPTS tentativas.
+
+Implantação: API e workers precisam enxergar o mesmo arquivo
+LASTROLENS_DB. Com a API num servidor de processo longo, use JOB_WORKERS>0
+ou rode `run_agent.py --jobs-worker` na mesma máquina/volume. Na Vercel o
+/tmp é de cada instância: o job fica preso na instância que o recebeu (o GET
+pode cair em outra e dar 404) e thread em background congela depois da
+resposta, então lá a fila só resolve o limite de tempo com um banco
+compartilhado, que este SQLite não é. Por isso a API só aceita job quando
+has_worker(): threads no processo, JOB_EXTERNAL_WORKERS=1 (worker por cron
+com --drain) ou heartbeat recente de um worker neste mesmo banco.
+"""
+import os, json, time, uuid, socket, threading
+
+from local_store import connect, register_schema
+from insights_cache import content_hash
+import metrics
+
+JOB_IDEMPOTENCY_WINDOW_S = int(os.getenv("JOB_IDEMPOTENCY_WINDOW_S", "600"))
+JOB_LEASE_S = int(os.getenv("JOB_LEASE_S", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "1.0"))
+JOB_EXTERNAL_WORKERS = os.getenv("JOB_EXTERNAL_WORKERS") == "1"  # workers de fora sem heartbeat contínuo
+JOB_WORKER_STALE_S = float(os.getenv("JOB_WORKER_STALE_S", "60"))
+
+ACTIVE = ("queued", "running")
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    contact_id TEXT NOT NULL,
+    idem_key TEXT NOT NULL UNIQUE,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_contact ON jobs(contact_id, status);
+CREATE TABLE IF NOT EXISTS job_workers (
+    id TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+""")
+
+def _public(row) -> dict:
+    return {
+        "jobId": row["id"],
+        "contactId": row["contact_id"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+    }
+
+class _tx:
+    # BEGIN IMMEDIATE: pega o lock de escrita já na leitura, então dois
+    # processos não enfileiram/reivindicam o mesmo job
+    def __enter__(self):
+        self.conn = connect()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *_):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+def idempotency_key(contact_id: str, options: dict, key: str | None = None, now: float | None = None) -> str:
+    if key:
+        return content_hash("job", str(contact_id), key)
+    window = int((now or time.time()) // max(1, JOB_IDEMPOTENCY_WINDOW_S))
+    return content_hash("job", str(contact_id), options, window)
+
+def enqueue(contact_id: str, options: dict, key: str | None = None) -> tuple[dict, bool]:
+    """
+    Enfileira o pipeline de um contato. Devolve (job, created): created é
+    False quando a chave de idempotência ou um job ativo do mesmo contato
+    já existiam. Job com erro e mesma chave volta para a fila.
+    """
+    contact_id, now = str(contact_id), time.time()
+    idem = idempotency_key(contact_id, options, key, now)
+    with _tx() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE idem_key = ?", (idem,)).fetchone()
+        if row is not None and row["status"] != "error":
+            return _public(row), False
+        active = conn.execute(
+            "SELECT * FROM jobs WHERE contact_id = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+            (contact_id, *ACTIVE),
+        ).fetchone()
+        if active is not None:
+            return _public(active), False
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, result = NULL, "
+                "started_at = NULL, finished_at = NULL WHERE id = ?", (row["id"],),
+            )
+            job_id = row["id"]
+        else:
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, contact_id, idem_key, options, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, contact_id, idem, json.dumps(options, sort_keys=True), now),
+            )
+        return _public(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()), True
+
+def get(job_id: str) -> dict | None:
+    row = connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _public(row) if row is not None else None
+
+def claim() -> tuple[str, str, dict] | None:
+    """Reivindica o job mais antigo da fila (ou com lease vencido): (id, contato, opções)."""
+    now = time.time()
+    with _tx() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'error', error = 'lease expirado', finished_at = ? "
+            "WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+            (now, now - JOB_LEASE_S, JOB_MAX_ATTEMPTS),
+        )
+        row = conn.execute(
+            "SELECT id, contact_id, options FROM jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND started_at < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (now - JOB_LEASE_S,),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+            (now, row["id"]),
+        )
+        return row["id"], row["contact_id"], json.loads(row["options"])
+
+def finish(job_id: str, result: dict):
+    failed = result.get("reason") == "ERROR"
+    connect().execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+        ("error" if failed else "done", json.dumps(result, ensure_ascii=False),
+         result.get("error") if failed else None, time.time(), job_id),
+    )
+
+def counts() -> dict:
+    rows = connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    return {r["status"]: r["n"] for r in rows}
+
+metrics.register_gauge("jobs", "Jobs na fila por status", counts)
+
+# ===== Workers =====
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+_beat = {"at": 0.0}
+
+def heartbeat():
+    """Marca este processo como worker vivo do banco (no máximo uma escrita a cada poucos segundos)."""
+    now = time.time()
+    if now - _beat["at"] < JOB_WORKER_STALE_S / 4:
+        return
+    _beat["at"] = now
+    conn = connect()
+    conn.execute("INSERT OR REPLACE INTO job_workers (id, seen_at) VALUES (?, ?)", (_WORKER_ID, now))
+    conn.execute("DELETE FROM job_workers WHERE seen_at < ?", (now - 24 * 3600,))
+
+def has_worker(in_process: int = 0) -> bool:
+    """Se algum worker vai consumir a fila deste banco (ver "Implantação")."""
+    if in_process > 0 or JOB_EXTERNAL_WORKERS:
+        return True
+    row = connect().execute("SELECT MAX(seen_at) AS seen_at FROM job_workers").fetchone()
+    return row["seen_at"] is not None and time.time() - row["seen_at"] <= JOB_WORKER_STALE_S
+
+def work_one(note_writer=None) -> bool:
+    """Processa um job da fila. False se a fila estava vazia."""
+    from insights_pipeline import run_insights_safe
+
+    job = claim()
+    if job is None:
+        return False
+    job_id, contact_id, options = job
+    if note_writer is not None:
+        options["note_writer"] = note_writer
+    finish(job_id, run_insights_safe(contact_id, **options))
+    return True
+
+def worker_loop(stop: threading.Event, note_writer=None, drain: bool = False):
+    while not stop.is_set():
+        heartbeat()
+        if not work_one(note_writer) and (drain or stop.wait(JOB_POLL_S)):
+            return
+
+_workers = []
+_workers_lock = threading.Lock()
+_stop = threading.Event()
+_writer = None
+
+def start_workers(n: int) -> int:
+    """
+    Sobe (uma vez por processo) `n` threads daemon consumindo a fila, com
+    um NoteWriter compartilhado como no run_batch. Devolve quantas estão vivas.
+    """
+    from hubspot_client import NoteWriter
+
+    global _writer
+    with _workers_lock:
+        _workers[:] = [t for t in _workers if t.is_alive()]
+        _writer = _writer or NoteWriter()
+        while len(_workers) < n:
+            t = threading.Thread(target=worker_loop, args=(_stop, _writer), name=f"job-worker-{len(_workers)}", daemon=True)
+            t.start()
+            _workers.append(t)
+        return len(_workers)
+
+def run_workers(n: int, drain: bool = False):
+    """Modo worker em primeiro plano (run_agent.py --jobs-worker)."""
+    from hubspot_client import NoteWriter
+
+    stop, writer = threading.Event(), NoteWriter()
+    threads = [threading.Thread(target=worker_loop, args=(stop, writer, drain), daemon=True) for _ in range(max(1, n))]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
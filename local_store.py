@@ -0,0 +1,28 @@
+# local_store.py
+"""
+SQLite local compartilhado pelos módulos com estado (cache de LLM, etc.).
+Cada thread usa sua própria conexão; o DDL registrado pelos módulos roda
+na abertura de cada conexão (CREATE ... IF NOT EXISTS).
+No Vercel só /tmp é gravável, por isso o default fica no diretório temporário.
+"""
+import os, sqlite3, tempfile, threading
+
+DB_PATH = os.getenv("LASTROLENS_DB", os.path.join(tempfile.gettempdir(), "lastrolens.sqlite3"))
+
+_local = threading.local()
+_schemas = []
+
+def register_schema(ddl: str):
+    _schemas.append(ddl)
+
+def connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)  # autocommit
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for ddl in _schemas:
+            conn.executescript(ddl)
+        _local.conn, _local.path = conn, DB_PATH
+    return conn
@@ -0,0 +1,149 @@
+# metrics.py
+"""
+Instrumentação do caminho quente, sem dependências externas:
+
+- contadores e histogramas do processo, expostos no formato texto do
+  Prometheus (render(), rota /metrics da API);
+- uso por requisição (chamadas HTTP, retries, bytes, tokens, cache) num
+  contextvar: track_usage() abre o escopo e add() soma nele.
+  Threads de pool não herdam contextvars; quem submete usa bind() (ver
+  insights_pipeline.submit);
+- log estruturado: uma linha JSON por evento no logger "lastrolens".
+"""
+import os, json, time, logging, threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+LOG_LEVEL = os.getenv("LASTROLENS_LOG_LEVEL", "INFO").upper()
+PREFIX = "lastrolens_"
+
+# segundos; cobre de chamadas locais ao cache até map-reduce longo
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+log = logging.getLogger("lastrolens")
+if not log.handlers:
+    # LASTROLENS_LOG=0 desliga; quem quiser outro destino configura o logger antes
+    _h = logging.StreamHandler() if os.getenv("LASTROLENS_LOG", "1") != "0" else logging.NullHandler()
+    _h.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_h)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    if log.isEnabledFor(level):
+        log.log(level, json.dumps({"ts": round(time.time(), 3), "event": event, **fields},
+                                  ensure_ascii=False, default=str))
+
+# ——— registro do processo
+_lock = threading.Lock()
+_counters = {}    # nome -> {labels(tuple): valor}
+_histograms = {}  # nome -> {labels(tuple): [contagens por bucket..., soma, total]}
+_help = {}
+_gauges = []      # (nome, help, fn) avaliados no render
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, help: str = "", **labels):
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+        if help:
+            _help.setdefault(name, help)
+
+def observe(name: str, seconds: float, help: str = "", **labels):
+    key = _labels(labels)
+    with _lock:
+        h = _histograms.setdefault(name, {}).get(key)
+        if h is None:
+            h = _histograms[name][key] = [0] * (len(BUCKETS) + 2)
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+        if help:
+            _help.setdefault(name, help)
+
+def register_gauge(name: str, help: str, fn):
+    """`fn()` devolve um número ou {valor_do_label: número} (label 'kind')."""
+    _gauges.append((name, help, fn))
+
+def _fmt(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render() -> str:
+    lines = []
+    with _lock:
+        counters = {n: dict(s) for n, s in _counters.items()}
+        histograms = {n: {k: list(v) for k, v in s.items()} for n, s in _histograms.items()}
+    for name, series in sorted(counters.items()):
+        full = PREFIX + name
+        lines += [f"# HELP {full} {_help.get(name, name)}", f"# TYPE {full} counter"]
+        lines += [f"{full}{_fmt(k)} {v:g}" for k, v in sorted(series.items())]
+    for name, series in sorted(histograms.items()):
+        full = PREFIX + name
+        lines += [f"# HELP {full} {_help.get(name, name)}", f"# TYPE {full} histogram"]
+        for k, h in sorted(series.items()):
+            lines += [f"{full}_bucket{_fmt(k, (('le', f'{le:g}'),))} {h[i]}" for i, le in enumerate(BUCKETS)]
+            lines += [f"{full}_bucket{_fmt(k, (('le', '+Inf'),))} {h[-1]}",
+                      f"{full}_sum{_fmt(k)} {h[-2]:.6f}", f"{full}_count{_fmt(k)} {h[-1]}"]
+    for name, help, fn in _gauges:
+        full = PREFIX + name
+        try:
+            value = fn()
+        except Exception as e:
+            log_event("metrics.gauge_error", logging.WARNING, gauge=name, error=str(e))
+            continue
+        lines += [f"# HELP {full} {help}", f"# TYPE {full} gauge"]
+        if isinstance(value, dict):
+            lines += [f"{full}{_fmt((('kind', k),))} {v:g}" for k, v in sorted(value.items())]
+        else:
+            lines.append(f"{full} {value:g}")
+    return "\n".join(lines) + "\n"
+
+# ——— uso por requisição
+USAGE_KEYS = (
+    "hubspot_requests", "hubspot_retries", "hubspot_bytes", "hubspot_throttle_ms",
+    "openai_requests", "openai_retries", "openai_queue_ms", "prompt_tokens", "completion_tokens",
+    "cache_hits", "cache_misses", "compaction_tokens_saved",
+)
+
+class Usage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = dict.fromkeys(USAGE_KEYS, 0)
+
+    def add(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                self._data[k] += v
+
+    def report(self) -> dict:
+        with self._lock:
+            return {k: (round(v, 1) if isinstance(v, float) else v) for k, v in self._data.items()}
+
+_usage: ContextVar[Usage | None] = ContextVar("lastrolens_usage", default=None)
+
+@contextmanager
+def track_usage():
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def add(**counts):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add(**counts)
+
+def bind(fn):
+    """`fn` rodando no contexto (uso por requisição) de quem chamou bind(); para pools de threads."""
+    ctx = copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
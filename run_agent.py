@@ -1,4 +1,4 @@
-import argparse
+import argparse, json, sys, time
 from hubspot_client import search_cooby_comms, extract_message_text, create_note
 from insights_agent import generate_insights_from_transcript
 
@@ -53,11 +53,77 @@ def format_note_html(contact_id: str, insights: dict) -> str:
     # remove múltiplos espaços/linhas
     return "\n".join(line.strip() for line in html.splitlines() if line.strip())
 
+def read_contact_ids(args) -> list:
+    ids = []
+    if args.contact_ids:
+        ids += [c.strip() for c in args.contact_ids.split(",")]
+    if args.contacts_file:
+        f = sys.stdin if args.contacts_file == "-" else open(args.contacts_file, encoding="utf-8")
+        with f:
+            ids += [ln.strip() for ln in f]
+    return [c for c in ids if c]
+
+def run_batch_mode(args):
+    """
+    Pipeline completo (Cooby + Ligações + Elephan) para vários contatos.
+    Imprime um JSON por linha (NDJSON) por contato e o resumo no stderr.
+    """
+    from insights_pipeline import run_batch, summarize_batch
+
+    ids = read_contact_ids(args)
+    t0 = time.perf_counter()
+    results = []
+    if args.openai_batch or args.openai_batch_id:
+        # reprocessamento noturno: modelo via Batch API, notas e scores em lote
+        from insights_batch import run_rescoring
+        results_iter = run_rescoring(
+            ids, batch_ids=args.openai_batch_id.split(",") if args.openai_batch_id else None,
+            workers=args.workers, create_note_flag=not args.dry_run, since_ms=args.since_ms,
+            llm_mode=args.llm_mode, compact=not args.no_compact,
+        )
+    else:
+        results_iter = run_batch(
+            ids, workers=args.workers, create_note_flag=not args.dry_run,
+            since_ms=args.since_ms, incremental=args.incremental, llm_mode=args.llm_mode,
+            compact=not args.no_compact,
+        )
+    for r in results_iter:
+        results.append(r)
+        print(json.dumps(r, ensure_ascii=False), flush=True)
+    summary = summarize_batch(results, time.perf_counter() - t0)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--contact-id", required=True)
+    who = ap.add_mutually_exclusive_group(required=True)
+    who.add_argument("--contact-id")
+    who.add_argument("--contact-ids", help="lote: IDs separados por vírgula")
+    who.add_argument("--contacts-file", help="lote: arquivo com um ID por linha ('-' = stdin)")
+    who.add_argument("--jobs-worker", action="store_true", help="consome a fila de jobs (POST /api/insights/jobs)")
+    who.add_argument("--openai-batch-id", help="lote: retoma batch(es) já enviados à Batch API (IDs separados por vírgula)")
+    ap.add_argument("--workers", type=int, default=4, help="lote/jobs: contatos em paralelo")
+    ap.add_argument("--drain", action="store_true", help="jobs: sai quando a fila esvaziar")
+    ap.add_argument("--since-ms", type=int, default=None, help="lote: ignora itens anteriores (ms desde epoch)")
+    ap.add_argument("--incremental", action="store_true", help="lote: só o delta desde a última execução")
+    ap.add_argument("--llm-mode", choices=["per_source", "single_call"], default="per_source",
+                    help="lote: uma chamada por fonte + geral, ou uma chamada com todas as camadas")
+    ap.add_argument("--no-compact", action="store_true", help="lote: transcripts sem compactação")
+    ap.add_argument("--openai-batch", action="store_true",
+                    help="lote: modelo via Batch API da OpenAI (assíncrono, ~metade do custo; não combina com --incremental)")
     ap.add_argument("--dry-run", action="store_true")
     args = ap.parse_args()
+    if args.openai_batch and (args.contact_id or args.jobs_worker):
+        ap.error("--openai-batch é só para lote (--contact-ids ou --contacts-file)")
+    if (args.openai_batch or args.openai_batch_id) and args.incremental:
+        ap.error("--openai-batch não combina com --incremental (reprocessamento completo)")
+
+    if args.jobs_worker:
+        from job_queue import run_workers
+        run_workers(args.workers, drain=args.drain)
+        return
+    if not args.contact_id:
+        sys.exit(run_batch_mode(args))
 
     comms = search_cooby_comms(args.contact_id)
     txt = build_transcript_text(comms)
@@ -75,4 +141,4 @@ def main():
         print("Nota criada:", note_id)
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
@@ -0,0 +1,85 @@
+# scheduler.py
+"""
+Agendador em processo para agrupar eventos em rajada (debounce com
+coalescência): cada touch() de uma chave adia o disparo dela por `window_s`,
+limitado a `max_wait_s` desde o primeiro toque, e no disparo o callback
+recebe tudo o que foi acumulado para a chave. Uma thread de timer (heap de
+prazos) por instância; os callbacks rodam num pool pequeno para não
+atrasar os outros disparos.
+O estado vive em memória: se o processo morrer, as chaves pendentes somem
+(quem precisa de durabilidade grava no callback, ex.: job_queue).
+"""
+import heapq, itertools, logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Optional
+
+import metrics
+
+class Debouncer:
+    def __init__(self, window_s: float, callback: Callable[[Hashable, list], None],
+                 max_wait_s: Optional[float] = None, workers: int = 2, name: str = "debounce"):
+        self.window_s = window_s
+        self.max_wait_s = max_wait_s
+        self.callback = callback
+        self.name = name
+        self._pending = {}  # chave -> [primeiro toque, prazo, itens]
+        self._heap = []     # (prazo, seq, chave); entradas velhas são ignoradas no pop
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._thread = None
+
+    def touch(self, key: Hashable, item=None) -> bool:
+        """Agenda/adia `key`. True se a chave não estava pendente."""
+        now = time.monotonic()
+        with self._cond:
+            entry = self._pending.get(key)
+            new = entry is None
+            if new:
+                entry = self._pending[key] = [now, 0.0, []]
+            deadline = now + self.window_s
+            if self.max_wait_s is not None:
+                deadline = min(deadline, entry[0] + self.max_wait_s)
+            entry[1] = deadline
+            if item is not None:
+                entry[2].append(item)
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-timer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return new
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, wait: bool = True):
+        """Dispara todas as chaves pendentes agora (desligamento, testes)."""
+        with self._cond:
+            due = list(self._pending.items())
+            self._pending.clear()
+            self._heap.clear()
+        futures = [self._pool.submit(self._fire, key, entry[2]) for key, entry in due]
+        if wait:
+            for f in futures:
+                f.result()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, _, key = heapq.heappop(self._heap)
+                    entry = self._pending.get(key)
+                    if entry is not None and entry[1] == deadline:
+                        del self._pending[key]
+                        self._pool.submit(self._fire, key, entry[2])
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _fire(self, key, items: list):
+        try:
+            self.callback(key, items)
+        except Exception as e:
+            metrics.inc("debounce_errors_total", help="Falhas nos callbacks do agendador", scheduler=self.name)
+            metrics.log_event("debounce.error", logging.ERROR, scheduler=self.name, key=str(key), error=str(e))
@@ -0,0 +1,256 @@
+# transcript_compaction.py
+"""
+Compactação dos transcripts entre a montagem (build_cooby_transcript,
+build_calls_summary_block, build_elephan_block) e o modelo:
+
+- mensagens repetidas: sincronizadas duas vezes (mesmo texto em até
+  DUP_WINDOW_MS) e blocos idênticos somem; só a repetição seguida de fato
+  vira "ok (x3)";
+- quase duplicatas (mesmo conjunto de palavras em >= NEAR_DUP_JACCARD), só
+  com os mesmos números e negações ou dentro de DUP_WINDOW_MS; fica a
+  versão mais recente (a proposta reenviada com o valor novo);
+- boilerplate: assinaturas, "mensagem apagada", links soltos, cabeçalhos
+  da Elephan e linhas que se repetem na maioria dos blocos;
+- timestamps relativos: "[d-3 14:05]" em vez do hs_timestamp cru, com o
+  d0 (dia da atividade mais recente entre todas as fontes) no cabeçalho;
+- orçamento de tokens por fonte: acima dele ficam as unidades mais recentes
+  e, no restante, as mais informativas (números, perguntas, termos de negócio).
+  O padrão (COMPACTION_MAX_TOKENS = MAX_CHUNKS_PER_SOURCE trechos, o mesmo
+  teto dos builders) deixa o histórico longo seguir para o map-reduce de
+  insights_agent; um teto menor troca resumo por corte.
+
+Uma unidade começa em "[ts]" no início da linha só quando ts é um timestamp
+(linhas como "[Cliente] disse ..." ficam dentro do bloco). O formato continua
+"[ts] ..." no começo de cada unidade, então
+insights_agent.split_transcript segue quebrando nas mesmas fronteiras.
+"""
+import os, re
+from datetime import datetime, timedelta, timezone
+
+from hubspot_client import parse_ts_ms
+from insights_agent import estimate_tokens, CHUNK_MAX_TOKENS, MAX_CHUNKS_PER_SOURCE
+
+COMPACTION_MAX_TOKENS = int(os.getenv("COMPACTION_MAX_TOKENS", str(MAX_CHUNKS_PER_SOURCE * CHUNK_MAX_TOKENS)))  # por fonte; 0 = sem teto
+TZ = timezone(timedelta(hours=float(os.getenv("COMPACTION_UTC_OFFSET_H", "-3"))))
+DUP_WINDOW_MS = 5 * 60 * 1000
+NEAR_DUP_JACCARD = 0.9
+NEAR_DUP_MIN_WORDS = 8
+NEAR_DUP_LOOKBACK = 50
+RECENT_SHARE = 0.4  # fração do orçamento reservada às unidades mais recentes
+
+# "lines": uma mensagem por linha (Cooby); "blocks": "[ts]\ntexto" separados por linha em branco
+KINDS = {"cooby": "lines", "calls": "blocks", "elephan": "blocks"}
+
+_UNIT_RE = re.compile(r"^\[([^\]\n]*)\][ \n]?", re.M)
+_WORD_RE = re.compile(r"\w+", re.U)
+_SPACE_RE = re.compile(r"\s+")
+# o que muda o sentido entre duas mensagens quase iguais
+_MEANING_RE = re.compile(r"\d+(?:[.,]\d+)*|\b(?:não|nao|nunca|nem|jamais|sem|not|no|never)\b", re.I)
+_BOILERPLATE_RE = re.compile(
+    r"^(?:"
+    r"enviad[oa] do meu \w+|sent from my \w+"
+    r"|mensagem apagada|essa mensagem foi apagada|this message was deleted"
+    r"|<?m[íi]dia oculta>?|<media omitted>|(?:imagem|áudio|audio|vídeo|video|arquivo) (?:anexad[oa]|omitid[oa])"
+    r"|att\.?|atenciosamente,?|cordialmente,?|abs\.?|abraços?,?"
+    r"|https?://\S+"
+    r"|[-_=*~]{2,}"
+    r"|.*\bpor\s+elephan\b.*|.*\belephan\.(?:ai|com)\S*|gerado automaticamente.*|powered by .*"
+    r")$",
+    re.I,
+)
+_INFO_RE = re.compile(
+    r"\d|\?|r\$|proposta|pre[çc]o|valor|or[çc]amento|contrato|prazo|reuni[ãa]o|desconto|decis[ãa]o"
+    r"|diretor|aprova|concorr|assin|pagamento|implanta|piloto|cancel",
+    re.I,
+)
+_MARKER_TOKENS = 8
+# linha de bloco presente em pelo menos este número (e metade) dos blocos = template
+REPEATED_LINE_MIN_BLOCKS = 3
+
+def _norm(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip(" .,!;:").lower()
+
+def _is_ts(raw: str) -> bool:
+    # "[None]"/"[]" = registro sem hs_timestamp; número curto ("[1]") é enumeração, não epoch
+    if raw in ("", "None"):
+        return True
+    return parse_ts_ms(raw) is not None and (not raw.isdigit() or len(raw) >= 10)
+
+def _units(text: str) -> list:
+    """[(ts_ms, ts_cru, corpo)] na ordem do texto."""
+    marks = [m for m in _UNIT_RE.finditer(text) if _is_ts(m.group(1))]
+    head = text[:marks[0].start()] if marks else text
+    out = [(None, "", head.strip())] if head.strip() else []
+    for i, m in enumerate(marks):
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(text)
+        out.append((parse_ts_ms(m.group(1)), m.group(1), text[m.end():end].strip()))
+    return out
+
+def _label(ts_ms: int | None, raw: str, ref_day) -> str:
+    if ts_ms is None:
+        return raw
+    dt = datetime.fromtimestamp(ts_ms / 1000, TZ)
+    return f"d-{(ref_day - dt.date()).days} {dt:%H:%M}" if dt.date() != ref_day else f"d0 {dt:%H:%M}"
+
+def reference_day(texts) -> "datetime.date | None":
+    """Dia (no fuso TZ) da atividade mais recente entre todos os textos."""
+    latest = max((ts for t in texts if t for ts, _, _ in _units(t) if ts), default=None)
+    return datetime.fromtimestamp(latest / 1000, TZ).date() if latest else None
+
+def _strip_boilerplate(body: str, repeated: set, stats: dict) -> str:
+    kept = []
+    for line in body.splitlines():
+        s = line.strip()
+        if not s:
+            continue
+        if _BOILERPLATE_RE.match(s) or (repeated and _norm(s) in repeated):
+            stats["boilerplate_lines"] += 1
+            continue
+        kept.append(s)
+    return "\n".join(kept)
+
+def _repeated_lines(units: list) -> set:
+    if len(units) < REPEATED_LINE_MIN_BLOCKS:
+        return set()
+    seen = {}
+    for _, _, body in units:
+        for line in {_norm(l) for l in body.splitlines() if len(l.strip()) >= 15}:
+            seen[line] = seen.get(line, 0) + 1
+    floor = max(REPEATED_LINE_MIN_BLOCKS, len(units) / 2)
+    return {line for line, n in seen.items() if n >= floor}
+
+def _informativeness(body: str) -> float:
+    words = _WORD_RE.findall(body.lower())
+    return min(len(set(words)), 40) + 8 * len(_INFO_RE.findall(body[:2000]))
+
+def _same_sync(ts: int | None, other: int | None) -> bool:
+    return ts is not None and other is not None and abs(ts - other) <= DUP_WINDOW_MS
+
+def compact(text: str, kind: str = "lines", ref_day=None, max_tokens: int | None = None) -> tuple[str, dict]:
+    """Compacta um transcript; devolve (texto, estatísticas)."""
+    stats = {"tokens_before": estimate_tokens(text) if text else 0, "duplicates": 0, "near_duplicates": 0,
+             "boilerplate_lines": 0, "budget_dropped": 0}
+    units = _units(text)
+    if not units:
+        stats["tokens_after"] = 0
+        return "", stats
+    units.sort(key=lambda u: (u[0] is None, u[0] or 0))
+    ref_day = ref_day or reference_day([text])
+    repeated = _repeated_lines(units) if kind == "blocks" else set()
+
+    kept = []       # [ts_ms, label, corpo, repetições]; None = substituída por quase duplicata mais nova
+    last_seen = {}  # texto normalizado -> índice em kept
+    word_sets = []  # (índice em kept, palavras, números/negações) das unidades longas recentes
+    for ts, raw, body in units:
+        body = _strip_boilerplate(body, repeated, stats)
+        if not body:
+            continue
+        key = _norm(body)
+        prev = last_seen.get(key)
+        if prev is not None and kept[prev] is not None:
+            p = kept[prev]
+            consecutive = prev == len(kept) - 1
+            same_sync = _same_sync(ts, p[0])
+            if consecutive or same_sync or kind == "blocks" or len(key) >= 40:
+                # "(xN)" só para quem de fato repetiu em seguida; sincronização dupla some calada
+                if consecutive and not same_sync:
+                    p[3] += 1
+                stats["duplicates"] += 1
+                continue
+        words = set(_WORD_RE.findall(key))
+        if len(words) >= NEAR_DUP_MIN_WORDS:
+            meaning = sorted(m.lower() for m in _MEANING_RE.findall(key))
+            near = next((j for j, (i, ws, mn) in reversed(list(enumerate(word_sets)))
+                         if len(words & ws) / len(words | ws) >= NEAR_DUP_JACCARD
+                         and (mn == meaning or _same_sync(ts, kept[i][0]))), None)
+            if near is not None:
+                # a versão nova substitui a antiga (sem "(xN)": não é repetição exata)
+                kept[word_sets.pop(near)[0]] = None
+                stats["near_duplicates"] += 1
+            word_sets.append((len(kept), words, meaning))
+            del word_sets[:-NEAR_DUP_LOOKBACK]
+        last_seen[key] = len(kept)
+        kept.append([ts, _label(ts, raw, ref_day) if ref_day else raw, body, 1])
+
+    kept = [k for k in kept if k is not None]
+    rendered = [
+        f"[{label}]{' ' if kind == 'lines' else chr(10)}{body}{f' (x{n})' if n > 1 else ''}"
+        for _, label, body, n in kept
+    ]
+    sep = "\n" if kind == "lines" else "\n\n"
+    if max_tokens and estimate_tokens(sep.join(rendered)) > max_tokens:
+        rendered = _fit_budget(rendered, [k[2] for k in kept], max_tokens, kind, stats)
+    out = sep.join(rendered)
+    stats["tokens_after"] = estimate_tokens(out) if out else 0
+    return out, stats
+
+def _with_gaps(rendered: list, chosen: set, kind: str) -> list:
+    unit = "mensagens omitidas" if kind == "lines" else "blocos omitidos"
+    out, gap = [], 0
+    for i, r in enumerate(rendered):
+        if i not in chosen:
+            gap += 1
+            continue
+        if gap:
+            out.append(f"(… {gap} {unit} …)")
+            gap = 0
+        out.append(r)
+    if gap:
+        out.append(f"(… {gap} {unit} …)")
+    return out
+
+def _fit_budget(rendered: list, bodies: list, max_tokens: int, kind: str, stats: dict) -> list:
+    # mais recentes primeiro até RECENT_SHARE do orçamento; depois as mais
+    # informativas por token; a saída volta à ordem cronológica, com um
+    # marcador no lugar de cada trecho omitido
+    cost = [estimate_tokens(r) + 1 for r in rendered]
+    chosen, used = set(), _MARKER_TOKENS
+    for i in range(len(rendered) - 1, -1, -1):
+        if used + cost[i] > max_tokens * RECENT_SHARE:
+            break
+        chosen.add(i)
+        used += cost[i]
+    score = {i: _informativeness(bodies[i]) / cost[i] for i in range(len(rendered)) if i not in chosen}
+    for i in sorted(score, key=score.get, reverse=True):
+        # cada unidade avulsa pode abrir mais um marcador de omissão
+        if used + cost[i] + _MARKER_TOKENS <= max_tokens:
+            chosen.add(i)
+            used += cost[i] + _MARKER_TOKENS
+    out = _with_gaps(rendered, chosen, kind)
+    # a estimativa de marcadores é folgada, mas o teto é rígido
+    for i in sorted((i for i in chosen if i in score), key=score.get):
+        if estimate_tokens("\n".join(out)) <= max_tokens:
+            break
+        chosen.discard(i)
+        out = _with_gaps(rendered, chosen, kind)
+    stats["budget_dropped"] = len(rendered) - len(chosen)
+    return out
+
+def compact_transcripts(texts: dict, max_tokens: int | None = COMPACTION_MAX_TOKENS) -> tuple[dict, dict]:
+    """
+    Compacta os textos por fonte ({fonte: texto}) com o mesmo d0 para todas.
+    Devolve (textos, relatório com tokens antes/depois/economizados por fonte).
+    """
+    ref_day = reference_day(texts.values())
+    out, report = {}, {}
+    for src, text in texts.items():
+        if not text:
+            out[src] = text
+            continue
+        header = f"(datas relativas: d0 = {ref_day:%Y-%m-%d}, UTC{TZ.utcoffset(None).total_seconds() / 3600:+g})\n" \
+            if ref_day else ""
+        budget = max(1, max_tokens - estimate_tokens(header)) if max_tokens else None
+        compacted, stats = compact(text, KINDS.get(src, "blocks"), ref_day, budget)
+        out[src] = header + compacted if compacted else compacted
+        stats["tokens_after"] = estimate_tokens(out[src]) if out[src] else 0
+        if compacted and stats["tokens_after"] >= stats["tokens_before"]:
+            # texto curto: o cabeçalho custa mais do que a compactação economiza
+            out[src], stats["tokens_after"], stats["original"] = text, stats["tokens_before"], True
+        stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+        report[src] = stats
+    return out, {
+        "tokens_before": sum(s["tokens_before"] for s in report.values()),
+        "tokens_after": sum(s["tokens_after"] for s in report.values()),
+        "tokens_saved": sum(s["tokens_saved"] for s in report.values()),
+        "sources": report,
+    }